@@ -0,0 +1,255 @@
+"""
+One render thread owning the device output, instead of a thread per
+animation sleeping between frames.
+
+Animations are Clips in a priority queue: only the top clip is shown, a
+higher priority clip preempts the one playing (which resumes where it
+was once it is back on top), and any clip can be cancelled; pad presses
+interrupt() the interruptible ones. A clip's frames are due at fixed
+times from its start, so a late frame is dropped rather than making the
+rest late, and output never goes faster than max_fps.
+
+Sends that aren't from a clip (the canvas, a DDR song) go through send():
+they only reach the device while no clip is showing, or while the top
+clip is a LiveClip from hold(), which hands the device to its owner.
+"""
+import time
+import heapq
+import itertools
+import threading
+
+# clip priorities
+MARQUEE = 10
+GALLERY = 20
+GAME = 100
+
+
+class Clip:
+    """
+    frames: an iterable of whatever the Animator's output takes, shown at
+    fps. on_done() is called once the clip has ended or was cancelled.
+    """
+    live = False
+    def __init__(self, frames, fps=15, priority=0, name=None, interruptible=False, on_done=None):
+        self.frames = iter(frames)
+        self.fps = fps
+        self.priority = priority
+        self.name = name
+        self.interruptible = interruptible
+        self.on_done = on_done
+        self.cancelled = False
+        self.ended = False
+        self.done = threading.Event()
+        self.index = -1         # last frame taken
+        self.start = None       # when frame 0 was due, moved on by time spent preempted
+        self.paused_at = None
+        self.dropped = 0
+        self._animator = None
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.name} priority={self.priority}>'
+
+    def due(self, i):
+        return self.start + i / self.fps
+
+    def take(self, now):
+        """
+        The latest frame due by now, dropping any older ones not yet shown;
+        None if none is due. Sets ended when the frames run out.
+        """
+        target = int((now - self.start) * self.fps + 1e-6)
+        frame, taken = None, 0
+        while self.index < target:
+            try:
+                frame = next(self.frames)
+            except StopIteration:
+                self.ended = True
+                break
+            self.index += 1
+            taken += 1
+        self.dropped += max(0, taken - 1)
+        return frame
+
+    def cancel(self):
+        if self._animator:
+            self._animator._cancel(lambda c: c is self)
+        else:
+            self.cancelled = True
+
+    def _finish(self):
+        self.done.set()
+        if self.on_done:
+            self.on_done()
+
+class LiveClip(Clip):
+    """
+    Holds the device for an owner pacing its own frames through
+    Animator.send() (a DDR song on its FrameClock); end() lets it go.
+    """
+    live = True
+    def __init__(self, priority=GAME, name=None, interruptible=False, on_done=None):
+        super().__init__((), priority=priority, name=name,
+                            interruptible=interruptible, on_done=on_done)
+
+    def end(self):
+        self.ended = True
+        if self._animator:
+            self._animator._cancel(lambda c: c is self)
+
+
+class Animator:
+    SPIN_MARGIN = 0.001
+
+    def __init__(self, output, max_fps=60, clock=time.perf_counter):
+        """
+        output: called with each clip frame to show. Neither it nor a
+        send() runs while the other does.
+        """
+        self.output = output
+        self.interval = 1 / max_fps
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition(threading.RLock())
+        self._port = threading.Lock()
+        self._active = None
+        self._last_sent = float('-inf')
+        self._running = True
+        self._finished = []     # clips _select() took off, for _run to call on_done
+        self.sent = 0
+        self.dropped = 0        # clip frames skipped to keep time
+        self.blocked = 0        # send()s refused while a clip was showing
+        self.preempted = 0
+        self.lateness = []      # seconds each clip frame went out after it was due
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def play(self, clip, replace=False):
+        """
+        Queue a clip; it shows as soon as it is the highest priority one
+        (the newest, among equals). replace: cancel the clips with its name.
+        """
+        with self._cond:
+            if replace:
+                self._cancel(lambda c: c.name == clip.name)
+            clip._animator = self
+            # newest first among equal priorities
+            heapq.heappush(self._heap, (-clip.priority, -next(self._seq), clip))
+            self._cond.notify()
+        return clip
+
+    def hold(self, priority=GAME, name=None, on_done=None):
+        return self.play(LiveClip(priority, name, on_done=on_done), replace=name is not None)
+
+    def cancel(self, name=None):
+        """ Cancel the clips called name, or all of them. """
+        self._cancel(lambda c: name is None or c.name == name)
+
+    def interrupt(self):
+        """ Cancel the interruptible clips, so what comes next shows at once. """
+        self._cancel(lambda c: c.interruptible)
+
+    def _cancel(self, match):
+        with self._cond:
+            keep = []
+            for entry in self._heap:
+                if match(entry[2]):
+                    entry[2].cancelled = not entry[2].ended
+                    self._finished.append(entry[2])
+                else:
+                    keep.append(entry)
+            self._heap = keep
+            heapq.heapify(self._heap)
+            self._select()      # hand the device on before returning
+            self._cond.notify()
+
+    def busy(self):
+        return self._active is not None and not self._active.live
+
+    def send(self, func, *args):
+        """
+        Run func(*args), a send straight to the device, if no clip is
+        showing; returns whether it ran.
+        """
+        with self._port:
+            if self._active is not None and not self._active.live:
+                self.blocked += 1
+                return False
+            func(*args)
+            self.sent += 1
+            return True
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cancel(lambda c: True)
+        self._thread.join()
+
+    def stats(self):
+        from .scheduler import percentile
+        ms = [x*1000 for x in self.lateness]
+        return {'sent': self.sent, 'dropped': self.dropped, 'blocked': self.blocked,
+                'preempted': self.preempted, 'late_p50_ms': percentile(ms, 50),
+                'late_p99_ms': percentile(ms, 99)}
+
+    def _select(self):
+        """
+        Drop ended and cancelled clips off the top, then make the top clip
+        the active one: pausing the one it preempts, starting or resuming
+        it. Call with _cond held.
+        """
+        while self._heap and (self._heap[0][2].cancelled or self._heap[0][2].ended):
+            clip = heapq.heappop(self._heap)[2]
+            self._finished.append(clip)
+        top = self._heap[0][2] if self._heap else None
+        if top is self._active:
+            return top
+        now = self.clock()
+        with self._port:    # not mid-frame
+            old, self._active = self._active, top
+        if old is not None and not (old.cancelled or old.ended):
+            old.paused_at = now
+            self.preempted += 1
+        if top is not None and not top.live:
+            if top.start is None:
+                top.start = now
+            elif top.paused_at is not None:
+                top.start += now - top.paused_at
+            top.paused_at = None
+        return top
+
+    def _run(self):
+        while True:
+            with self._cond:
+                clip = self._select()
+                finished, self._finished = self._finished, []
+                wait = None     # nothing to show: until play()/cancel()
+                if clip is not None and not clip.live:
+                    due = max(clip.due(clip.index + 1), self._last_sent + self.interval)
+                    wait = due - self.clock()
+                if not finished:
+                    if not self._running:
+                        return
+                    if wait is None or wait > self.SPIN_MARGIN:
+                        # wake early (or on a new clip) and re-check
+                        self._cond.wait(None if wait is None else wait - self.SPIN_MARGIN)
+                        continue
+            for done in finished:
+                done._finish()
+            if finished or wait > 0:
+                if not finished:
+                    time.sleep(0)   # spin out the last stretch
+                continue
+            now = self.clock()
+            dropped = clip.dropped
+            frame = clip.take(now)
+            self.dropped += clip.dropped - dropped
+            if frame is None:
+                continue
+            with self._port:
+                if self._active is not clip:    # preempted since
+                    continue
+                self.output(frame)
+            self.sent += 1
+            self.lateness.append(now - clip.due(clip.index))
+            self._last_sent = now
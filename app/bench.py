@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the hot paths. No device needed, everything runs
+against the in-memory virtual ports.
+
+    python -m app.bench [name ...]
+"""
+import os
+import sys
+import time
+import queue
+import threading
+import random
+import tempfile
+import numpy as np
+import mido
+from . import midi_io
+from . import sysex
+from . import mixer
+from . import scheduler
+from . import scoring
+from . import ddr
+from .scheduler import percentile
+
+
+def rate(func, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n / (time.perf_counter() - t0)
+
+def report(name, latencies, cpu):
+    ms = [x*1000 for x in latencies]
+    print(f'{name:<10} n={len(ms):<5} mean={sum(ms)/len(ms):.3f}ms '
+          f'p50={percentile(ms, 50):.3f}ms p99={percentile(ms, 99):.3f}ms '
+          f'cpu={cpu:.2f}s')
+
+###------------ input latency ------------###
+def _polling_receive(ports):
+    """ the old MultiPainter.receive loop """
+    msg = ports[0].receive(block=False)
+    if not msg:
+        msg = ports[1].receive(block=False)
+    time.sleep(0.001)
+    return msg
+
+def _drive_input(receive, inboxes, n, interval):
+    latencies = []
+    def produce():
+        for i in range(n):
+            time.sleep(interval)
+            msg = mido.Message('note_on', note=11 + i % 8, velocity=64)
+            msg.time = time.perf_counter()
+            inboxes[i % len(inboxes)].put(msg)
+    producer = threading.Thread(target=produce, daemon=True)
+    cpu0 = time.process_time()
+    producer.start()
+    while len(latencies) < n:
+        msg = receive()
+        if msg:
+            latencies.append(time.perf_counter() - msg.time)
+    producer.join()
+    return latencies, time.process_time() - cpu0
+
+def bench_input_latency(n=500, interval=0.002):
+    """
+    Pad press -> listener wake-up latency, polling loop vs InputMux.
+    """
+    inboxes = [queue.Queue(), queue.Queue()]
+    ports = [midi_io.VirtualInport(inbox=q) for q in inboxes]
+    latencies, cpu = _drive_input(lambda: _polling_receive(ports),
+                                  inboxes, n, interval)
+    report('polling', latencies, cpu)
+
+    inboxes = [queue.Queue(), queue.Queue()]
+    ports = [midi_io.VirtualInport(inbox=q) for q in inboxes]
+    mux = midi_io.InputMux(ports)
+    latencies, cpu = _drive_input(mux.receive, inboxes, n, interval)
+    mux.close()
+    report('mux', latencies, cpu)
+###------------ end input latency ------------###
+
+###------------ frame building ------------###
+PADMAP = {i: 81 - 10*(i // 8) + i % 8 for i in range(64)}
+
+def _legacy_build_sysex(data, mode=0):
+    """ the old Painter._build_sysex """
+    bytes = [0, 32, 41, 2, 14, 3]
+    for i in range(64):
+        spec = [mode, PADMAP[i], data[i]]
+        bytes.extend(spec)
+    return mido.Message('sysex', data=bytes)
+
+def _legacy_build_sysex_rgb(pixels):
+    """ the old spritesheet.build_sysex_rgb """
+    rescale = lambda x: int(x*127/255)
+    bytes = [0, 32, 41, 2, 14, 3]
+    for i in range(64):
+        spec = [3, PADMAP[i], *map(rescale, pixels[i])]
+        bytes.extend(spec)
+    return mido.Message('sysex', data=bytes)
+
+def bench_frame_build(n=5000):
+    """
+    Full-frame sysex building in frames/sec, legacy lists vs FrameBuilder.
+    'bytes' is the buffer fill alone, 'msg' includes the mido.Message.
+    """
+    colors = [random.randrange(128) for _ in range(64)]
+    pixels = [tuple(random.randrange(256) for _ in range(3)) for _ in range(64)]
+    palette = sysex.FrameBuilder(PADMAP)
+    rgb = sysex.FrameBuilder(PADMAP, mode=sysex.MODE_RGB)
+    rgb_7bit = sysex.RGB_TO_7BIT[pixels]
+    rows = [
+        ('palette legacy msg', lambda: _legacy_build_sysex(colors)),
+        ('palette builder bytes', lambda: palette.write(colors)),
+        ('palette builder msg', lambda: palette.build(colors)),
+        ('rgb legacy msg', lambda: _legacy_build_sysex_rgb(pixels)),
+        ('rgb builder bytes', lambda: rgb.write(rgb_7bit)),
+        ('rgb builder msg', lambda: rgb.build(sysex.RGB_TO_7BIT[pixels])),
+    ]
+    for name, func in rows:
+        print(f'{name:<24} {rate(func, n):>10.0f} frames/s')
+###------------ end frame building ------------###
+
+###------------ startup ------------###
+def bench_startup(timeout=30):
+    """
+    Time from Painter() to the note_on answering a pad press that was
+    already waiting in the input queue (time-to-first-pad-response).
+    """
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    t0 = time.perf_counter()
+    from . import launchpad
+    t_import = time.perf_counter() - t0
+
+    inbox, outbox = queue.Queue(), queue.Queue()
+    class BenchPainter(launchpad.Painter):
+        def _init_connections(self):
+            self.outport = midi_io.VirtualOutport(outbox=outbox)
+            self.port = midi_io.VirtualInport(inbox=inbox)
+            self.inports = [self.port]
+    inbox.put(mido.Message('note_on', note=launchpad.PADMAP[0], velocity=64))
+    t0 = time.perf_counter()
+    painter = BenchPainter()
+    t_init = time.perf_counter() - t0
+    while True:
+        msg = outbox.get(timeout=timeout)
+        if msg.type == 'note_on':
+            t_first = time.perf_counter() - t0
+            break
+    painter.sampler.loading.result(timeout=timeout)
+    t_samples = time.perf_counter() - t0
+    painter.stop()
+    print(f'import app.launchpad     {t_import*1000:8.1f} ms')
+    print(f'Painter() returned       {t_init*1000:8.1f} ms')
+    print(f'first pad response       {t_first*1000:8.1f} ms')
+    print(f'sample pack decoded      {t_samples*1000:8.1f} ms')
+###------------ end startup ------------###
+
+###------------ mixer ------------###
+def _pluck(note, rate, seconds=0.5):
+    t = np.arange(int(rate*seconds)) / rate
+    freq = 440 * 2**((note - 69)/12)
+    tone = np.sin(2*np.pi*freq*t) * np.exp(-6*t)
+    return np.repeat(tone[:, None], 2, axis=1).astype(np.float32)
+
+def bench_mixer(seconds=10, rate=44100):
+    """
+    Offline render of a dense chord pattern (8-note chords every 50ms, so
+    voice stealing kicks in): throughput as x realtime and per-block render
+    time against the block's playback duration.
+    """
+    random.seed(0)
+    events = [(k*0.05, 48 + random.randrange(36)) for k in range(int(seconds/0.05))
+                                                    for _ in range(8)]
+    for block_size in (64, 256, 1024):
+        engine = mixer.Mixer(rate, 2, block_size=block_size, voices=32)
+        for note in range(48, 84):
+            engine.load(note, _pluck(note, rate))
+        block_times = []
+        render_block = engine.render_block
+        def timed_block():
+            t0 = time.perf_counter()
+            out = render_block()
+            block_times.append(time.perf_counter() - t0)
+            return out
+        engine.render_block = timed_block
+        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
+            t0 = time.perf_counter()
+            pcm = engine.render_to_wav(f.name, events)
+            elapsed = time.perf_counter() - t0
+        budget = block_size / rate * 1000
+        ms = [x*1000 for x in block_times]
+        print(f'block={block_size:<5} latency={budget:6.2f}ms '
+              f'x{len(pcm)/rate/elapsed:6.1f} realtime  block p50={percentile(ms, 50):.3f}ms '
+              f'p99={percentile(ms, 99):.3f}ms  stolen={engine.stolen}/{engine.notes_played}')
+###------------ end mixer ------------###
+
+###------------ scheduler ------------###
+def _legacy_pacing(durations, per_frame):
+    """ the old InputListener.play pacing: time.time() + time.sleep """
+    start = time.time()
+    t = 0
+    lateness = []
+    for duration in durations:
+        per_frame()
+        t += duration
+        wait = t - (time.time() - start)
+        if wait > 0.0:
+            time.sleep(wait)
+        lateness.append(time.time() - start - t)
+    return lateness
+
+def _frameclock_pacing(durations, per_frame):
+    clock = scheduler.FrameClock()
+    clock.start()
+    t = 0
+    for duration in durations:
+        per_frame()
+        t += duration
+        clock.wait_until(t)
+    return clock.lateness
+
+def _load(stop):
+    """ background work: bursts of numpy rendering, like the emulator's frame loop """
+    pixels = np.random.default_rng(0).random((512, 512), dtype=np.float32)
+    while not stop.is_set():
+        pixels @ pixels
+        time.sleep(0.001)
+
+def _paced_lateness(pacing, durations):
+    """ ms late of each frame, with 8 autoplay hits a frame on a TimerHeap """
+    timers = scheduler.TimerHeap()
+    def per_frame():
+        for _ in range(8):
+            timers.call_later(0, int)
+    try:
+        return [x*1000 for x in pacing(durations, per_frame)]
+    finally:
+        timers.stop()
+
+def bench_scheduler(n=240, fps=60, load_threads=2, rounds=2, p99_budget_ms=None,
+                    tolerance=1.5, slack_ms=2.0):
+    """
+    Frame lateness, old sleep pacing vs FrameClock, idle and with
+    load_threads busy rendering. The two take turns for rounds of the same
+    frames, so both see the same conditions. Fails if FrameClock's idle
+    p99 is over p99_budget_ms (by default a frame: 99% of frames go out
+    before the next is due), or if under load its p99 is worse than the
+    sleep pacing's by more than tolerance times plus slack_ms.
+    """
+    if p99_budget_ms is None:
+        p99_budget_ms = 1000 / fps
+    random.seed(0)
+    durations = [random.choice((1, 1, 2, 3)) / (fps*2) for _ in range(n)]
+    pacings = {'sleep pacing': _legacy_pacing, 'FrameClock': _frameclock_pacing}
+    p99 = { }
+    for load in (0, load_threads):
+        stop = threading.Event()
+        for _ in range(load):
+            threading.Thread(target=_load, args=(stop,), daemon=True).start()
+        lateness = {name: [] for name in pacings}
+        try:
+            for _ in range(rounds):
+                for name, pacing in pacings.items():
+                    lateness[name] += _paced_lateness(pacing, durations)
+        finally:
+            stop.set()
+        for name, ms in lateness.items():
+            p99[name, load] = percentile(ms, 99)
+            print(f'{load} load threads, {name:<13} p50={percentile(ms, 50):.3f}ms '
+                  f'p99={percentile(ms, 99):.3f}ms max={max(ms):.3f}ms')
+    idle = p99['FrameClock', 0]
+    assert idle < p99_budget_ms, \
+        f'idle p99 frame lateness {idle:.3f}ms over budget {p99_budget_ms:.1f}ms'
+    new, old = p99['FrameClock', load_threads], p99['sleep pacing', load_threads]
+    assert new <= old * tolerance + slack_ms, \
+        f'p99 frame lateness under load {new:.3f}ms, sleep pacing {old:.3f}ms'
+###------------ end scheduler ------------###
+
+###------------ scoring ------------###
+SONGS = ('ddr_test', 'fallen_down', 'mario_theme')
+
+def _offline_playtrack(name):
+    """ a PlayTrack with no device or sampler behind it """
+    from . import launchpad, replay     # not at the top: bench_startup times that import
+    song = launchpad.Song.get_metadata(name)
+    return ddr.PlayTrack(name + '.mid', replay.OfflinePainter(), bpm=song.bpm,
+                            time_signature=song.time_signature,
+                            start_tick=song.start_tick, seed=0)
+
+def _chart_hits(chart, shift=0.0, jitter=0.0, keep=1, seed=0):
+    rng = random.Random(seed)
+    hits = []
+    for col, onsets in chart.onsets.items():
+        for i, t in enumerate(onsets):
+            if i % keep == 0:
+                hits.append((t + shift + rng.uniform(-jitter, jitter), scoring.STRIKE_ROW + col))
+    return hits
+
+def bench_scoring(n=20):
+    """
+    Replays synthetic hit streams against each song's chart and checks the
+    judging: on-time => all perfect, 60ms late => all great, half the notes
+    => the rest missed, off-strike-row => strays, and a jittered stream
+    scores the same every time. Then judging throughput.
+    """
+    for song in SONGS:
+        chart = scoring.Chart.from_playtrack(_offline_playtrack(song))
+        notes = len(chart)
+        result = scoring.replay(chart, _chart_hits(chart))
+        assert result['perfect'] == notes and result['max_combo'] == notes, result
+        result = scoring.replay(chart, _chart_hits(chart, shift=0.06))
+        assert result['great'] == notes, result
+        result = scoring.replay(chart, _chart_hits(chart, keep=2))
+        assert result['miss'] == notes - result['perfect'] and result['miss'] > 0, result
+        result = scoring.replay(chart, [(t, pad - 8) for t, pad in _chart_hits(chart)])
+        assert result['strays'] == notes and result['miss'] == notes, result
+        jittered = _chart_hits(chart, jitter=0.15, seed=1)
+        result = scoring.replay(chart, jittered)
+        assert result == scoring.replay(chart, jittered), 'replay is not deterministic'
+        print(f'{song:<12} notes={notes:<4} jittered: ' +
+              ' '.join(f'{k}={result[k]}' for k in ('perfect', 'great', 'good', 'miss', 'strays')))
+    hits = _chart_hits(chart, jitter=0.05)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        scoring.replay(chart, hits)
+    print(f'judging: {n*len(hits) / (time.perf_counter() - t0):.0f} hits/s')
+###------------ end scoring ------------###
+
+###------------ replay ------------###
+def bench_replay():
+    """
+    Records a jittered session per song on simulated time, saves it, and
+    replays it from the file: frames/sec, judging latency, and the score
+    must come back unchanged.
+    """
+    from . import replay
+    with tempfile.TemporaryDirectory() as tmp:
+        for song in SONGS:
+            playtrack = _offline_playtrack(song)
+            chart = scoring.Chart.from_playtrack(playtrack)
+            hits = np.array([(t, replay.HIT, pad) for t, pad in
+                            sorted(_chart_hits(chart, jitter=0.15, seed=1))], dtype=replay.EVENT)
+            recorder = replay.Recorder()
+            clock = replay.VirtualClock(hits, playtrack._input_q)
+            result = playtrack.play(clock=clock, recorder=recorder)
+            path = recorder.save(os.path.join(tmp, song + '.npz'), playtrack, result)
+            report = replay.replay(path)
+            print(f"{song:<12} {report['frames']} frames at {report['fps']:.0f} fps "
+                  f"({report['speedup']:.0f}x real time), judging "
+                  f"p50={report['latency_p50_ms']:.3f}ms p99={report['latency_p99_ms']:.3f}ms, "
+                  f"{os.path.getsize(path)} byte recording")
+            assert not report['score_diff'], report['score_diff']
+###------------ end replay ------------###
+
+###------------ calibration ------------###
+def bench_calibration(beats=64, lag=0.035, jitter=0.008, input_lag=0.06):
+    """
+    Estimates a known tap lag from jittered taps, some missed and some
+    stray, then plays a session whose hits all land input_lag late, on
+    simulated time: uncompensated they are great at best, compensated by
+    an input offset all perfect.
+    """
+    from . import replay
+    from . import calibration
+    rng = random.Random(0)
+    interval = 60 / calibration.Calibrator.BPM
+    beat_times = [i*interval for i in range(beats)]
+    taps = [t + lag + rng.gauss(0, jitter) for t in beat_times if rng.random() > 0.1]
+    taps += [rng.uniform(0, beats*interval) for _ in range(beats // 10)]
+    estimate, spread, n = calibration.tap_offset(beat_times, sorted(taps), interval)
+    print(f'tap lag {lag*1000:.1f}ms: estimated {estimate*1000:.1f}ms '
+          f'(spread {spread*1000:.1f}ms, {n}/{len(taps)} taps)')
+    assert abs(estimate - lag) < jitter / 2, estimate
+    playtrack = _offline_playtrack(SONGS[0])
+    chart = scoring.Chart.from_playtrack(playtrack)
+    hits = np.array([(t, replay.HIT, pad) for t, pad in sorted(_chart_hits(chart, shift=input_lag))],
+                    dtype=replay.EVENT)
+    for offsets in (calibration.Offsets(), calibration.Offsets(input=input_lag)):
+        clock = replay.VirtualClock(hits, playtrack._input_q)
+        result = playtrack.play(clock=clock, offsets=offsets)
+        print(f'{offsets}: perfect={result["perfect"]} great={result["great"]} of {result["notes"]}')
+    assert result['perfect'] == result['notes'], result
+###------------ end calibration ------------###
+
+###------------ animation ------------###
+def bench_animation(seconds=2, fps=30, slow_send=0.05):
+    """
+    Frame timing of the animator at a fixed rate, the same clip against a
+    port slower than a frame (frames must be dropped, not delayed), and a
+    clip preempted mid-way resuming with no frame lost.
+    """
+    from . import animation
+    n = int(seconds * fps)
+    animator = animation.Animator(lambda frame: None)
+    clip = animator.play(animation.Clip(range(n), fps=fps))
+    clip.done.wait()
+    stats = animator.stats()
+    print(f"{n} frames at {fps}fps: late p50={stats['late_p50_ms']:.3f}ms "
+          f"p99={stats['late_p99_ms']:.3f}ms, dropped {stats['dropped']}")
+    animator.stop()
+
+    animator = animation.Animator(lambda frame: time.sleep(slow_send))
+    t0 = time.perf_counter()
+    clip = animator.play(animation.Clip(range(n), fps=fps))
+    clip.done.wait()
+    wall = time.perf_counter() - t0
+    stats = animator.stats()
+    print(f'{slow_send*1000:.0f}ms sends: {stats["sent"]} sent, {stats["dropped"]} dropped, '
+          f'finished in {wall:.2f}s (clip is {n/fps:.2f}s)')
+    assert stats['dropped'] > 0 and wall < n/fps + 2*slow_send, stats
+    animator.stop()
+
+    shown = []
+    animator = animation.Animator(shown.append)
+    low = animator.play(animation.Clip(range(fps), fps=fps, name='low'))
+    time.sleep(0.25)
+    animator.play(animation.Clip(['high']*(fps//4), fps=fps, priority=animation.GAME))
+    low.done.wait()
+    numbers = [frame for frame in shown if frame != 'high']
+    print(f"preempted after {shown.index('high')} frames, resumed: "
+          f"{len(numbers)}/{fps} frames, {animator.stats()['preempted']} preemption")
+    assert numbers == list(range(fps)) or animator.stats()['dropped'], numbers
+    animator.stop()
+###------------ end animation ------------###
+
+###------------ emulator ------------###
+def _legacy_parse_sysex(device, data):
+    specs = data[6:]        # [mode, note, color] per pad, palette mode only
+    for i in range(0, len(specs), 3):
+        device.leds[specs[i+1]] = device.palette[specs[i+2]]
+
+def bench_emulator(presses=5000, frames=2000):
+    """
+    Synthetic pad presses through a Painter on the headless emulator: the
+    rate it takes them, and that what it drew is what the device shows.
+    """
+    from . import emulator
+    painter = emulator.HeadlessPainter()
+    painter.animator.cancel()
+    per_sec, sent = emulator.drive(painter, presses)
+    device = painter.emulator
+    expected = device.palette[np.array(painter.canvas.colors, dtype=np.intp)].reshape(8, 8, 3)
+    print(f'{presses} presses: {per_sec:.0f} presses/s, {sent} messages applied by the device')
+    print(f'device inbox: {device.inbox.stats()}')
+    assert (device.grid == expected).all(), 'device out of step with the canvas'
+    painter.stop()
+    device.stop()
+
+    rng = np.random.default_rng(0)
+    frame_diff = sysex.FrameDiff(PADMAP)
+    msgs = {mode: [frame_diff.encode(rng.integers(0, 128, (64, sysex.SPEC_WIDTH[mode])), mode)[0]
+                    for _ in range(16)] for mode in sysex.SPEC_WIDTH}
+    device = emulator.Device()
+    legacy = rate(lambda: [_legacy_parse_sysex(device, msg.data) for msg in msgs[sysex.MODE_PALETTE]],
+                    frames // 16) * 16
+    for mode, name in ((sysex.MODE_PALETTE, 'palette'), (sysex.MODE_RGB, 'rgb')):
+        new = rate(lambda: [device.receive(msg) for msg in msgs[mode]], frames // 16) * 16
+        print(f'decode full {name} frames: {new:.0f}/s' +
+              (f' (per-spec loop: {legacy:.0f}/s)' if mode == sysex.MODE_PALETTE else ''))
+###------------ end emulator ------------###
+
+###------------ message ring ------------###
+def bench_message_ring(fills=50, n=20000):
+    """
+    A storm of flood fills (every pad, one note_on each) sent between two
+    frames: how many frames the pygame emulator took to show the last
+    fill with one message a frame off a queue.Queue, and with a drained,
+    coalescing MessageRing; then plain put+get throughput of each.
+    """
+    from . import emulator
+    storm = [mido.Message('note_on', note=note, velocity=(fill % 127) + 1)
+                for fill in range(fills) for note in PADMAP.values()]
+    q = queue.Queue()
+    for msg in storm:
+        q.put(msg)
+    print(f'{len(storm)} note_ons, one per frame off a queue: {q.qsize()} frames '
+          f'({q.qsize() / 60:.1f}s at 60fps) to catch up')
+    ring = midi_io.MessageRing(coalesce=True)
+    for msg in storm:
+        ring.put(msg)
+    device = emulator.Device(inbox=ring)
+    applied = device.pump()
+    expected = device.palette[storm[-1].velocity]    # the last fill
+    assert (device.grid == expected).all(), 'coalesced fill differs'
+    print(f'drained from a ring: 1 frame, {applied} applied, {ring.stats()}')
+
+    msg = storm[0]
+    for name, box in (('queue.Queue', queue.Queue()), ('MessageRing', midi_io.MessageRing())):
+        print(f'{name:<12} put+get: {rate(lambda: (box.put(msg), box.get_nowait()), n):.0f}/s')
+###------------ end message ring ------------###
+
+BENCHMARKS = {
+    'input_latency': bench_input_latency,
+    'frame_build': bench_frame_build,
+    'startup': bench_startup,
+    'mixer': bench_mixer,
+    'scheduler': bench_scheduler,
+    'scoring': bench_scoring,
+    'replay': bench_replay,
+    'calibration': bench_calibration,
+    'animation': bench_animation,
+    'emulator': bench_emulator,
+    'message_ring': bench_message_ring,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'--- {name} ---')
+        BENCHMARKS[name]()
@@ -0,0 +1,230 @@
+"""
+Per-device latency offsets for DDR, and the calibration mode that measures
+them. All offsets are seconds:
+
+    audio:  from play() to the sound being heard (backing track, samples)
+    visual: from a frame being sent to the pads lighting up
+    input:  from a pad being pressed to its hit being timestamped
+
+InputListener.play() sends each frame visual seconds early, starts the
+backing track audio seconds early and takes input seconds off every hit
+before judging it, so judging happens on the time the player saw, heard
+and hit things.
+"""
+import os
+import json
+import queue
+import threading
+import mido
+import numpy as np
+from . import scheduler
+from .config import STORAGE_PATH
+from .scheduler import percentile
+
+CALIBRATION_PATH = os.path.join(STORAGE_PATH, 'calibration.json')
+IDENTITY_REQUEST = mido.Message('sysex', data=[0x7E, 0x7F, 0x06, 0x01])  # universal device inquiry
+
+
+class Offsets:
+    FIELDS = ('audio', 'visual', 'input')
+    def __init__(self, audio=0.0, visual=0.0, input=0.0):
+        self.audio = audio
+        self.visual = visual
+        self.input = input
+
+    def __repr__(self):
+        return 'Offsets(' + ', '.join(f'{k}={getattr(self, k)*1000:.1f}ms' for k in self.FIELDS) + ')'
+
+    @property
+    def lead(self):
+        """ How far ahead of the song playback has to start sending things. """
+        return max(0.0, self.audio, self.visual)
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**{k: float(d.get(k, 0.0)) for k in cls.FIELDS})
+
+def load(device, path=CALIBRATION_PATH):
+    """ The device's stored offsets; all zero if it was never calibrated. """
+    try:
+        with open(path) as f:
+            return Offsets.from_dict(json.load(f).get(device, { }))
+    except (OSError, ValueError):
+        return Offsets()
+
+def save(device, offsets, path=CALIBRATION_PATH):
+    try:
+        with open(path) as f:
+            devices = json.load(f)
+    except (OSError, ValueError):
+        devices = { }
+    devices[device] = offsets.as_dict()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(devices, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_identity_reply(msg):
+    return msg.type == 'sysex' and len(msg.data) >= 4 and msg.data[0] == 0x7E \
+            and tuple(msg.data[2:4]) == (0x06, 0x02)
+
+def tap_offset(beats, taps, interval):
+    """
+    How late taps land on beats: the median distance from each tap to its
+    nearest beat, ignoring taps more than half a beat from any. Returns
+    (median, spread, taps used), spread being the median absolute deviation
+    from that median; (None, None, 0) if no tap counted.
+    """
+    beats = np.asarray(beats, dtype=np.float64)
+    taps = np.asarray(taps, dtype=np.float64)
+    if len(beats) < 2 or not len(taps):
+        return None, None, 0
+    i = np.searchsorted(beats, taps).clip(1, len(beats) - 1)
+    nearest = np.where(taps - beats[i-1] < beats[i] - taps, beats[i-1], beats[i])
+    d = taps - nearest
+    d = d[np.abs(d) < interval / 2]
+    if not len(d):
+        return None, None, 0
+    median = float(np.median(d))
+    return median, float(np.median(np.abs(d - median))), len(d)
+
+
+class Calibrator:
+    """
+    Calibration mode, three passes on the painter's device:
+
+    loopback: sends device inquiries and times the replies; half the round
+        trip is taken as the input offset (the way back in).
+    audio tap-along: a click every beat, tap any pad with it; the taps'
+        lag behind the clicks, less the input offset, is the audio offset.
+    visual tap-along: the pads flash every beat, no sound; likewise for the
+        visual offset.
+
+    Pad presses reach it through the sampler's input queue, the same way
+    DDR hits do, and identity replies through on_message(). cancel() stops
+    it within a beat; nothing is stored then.
+    """
+    BPM = 100
+    BEATS = 20
+    WARMUP_BEATS = 4    # taps while the player finds the beat are ignored
+    PINGS = 8
+    PING_TIMEOUT = 0.25
+    CLICK_NOTE = 48     # any sound does: a note the pack lacks plays the miss sound
+    FLASH_COLOR = 5
+
+    def __init__(self, painter, device, offsets=None, path=CALIBRATION_PATH):
+        self.painter = painter
+        self.device = device
+        # a copy, kept where a pass measures nothing: a cancelled run leaves offsets as they were
+        self.offsets = Offsets.from_dict(offsets.as_dict()) if offsets else Offsets()
+        self.path = path
+        self.clock = scheduler.FrameClock()
+        self.replies = queue.Queue()
+        self.metrics = { }
+        self._cancel = threading.Event()
+
+    def on_message(self, msg):
+        if is_identity_reply(msg):
+            self.replies.put(self.clock.clock())
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def measure_loopback(self):
+        """ Round trip seconds of each answered device inquiry. """
+        rtts = []
+        for _ in range(self.PINGS):
+            if self.cancelled:
+                break
+            while not self.replies.empty():
+                self.replies.get()
+            sent = self.clock.clock()
+            self.painter.send_note(IDENTITY_REQUEST)
+            try:
+                rtts.append(self.replies.get(timeout=self.PING_TIMEOUT) - sent)
+            except queue.Empty:
+                pass
+        return rtts
+
+    def tap_along(self, cue, uncue=None):
+        """
+        Calls cue() on every beat (uncue() half a beat later) and returns
+        (beats, taps): the clock times of the beats past the warm-up, and
+        of every pad press meanwhile.
+        """
+        interval = 60 / self.BPM
+        input_q = self.painter.sampler.input_q
+        while not input_q.empty():
+            input_q.get()
+        beats = []
+        self.clock.start()
+        for i in range(self.BEATS):
+            if self.cancelled:
+                return [], []
+            self.clock.wait_until(i * interval)
+            beats.append(self.clock.clock())
+            cue()
+            if uncue:
+                self.clock.wait_until((i + 0.5) * interval)
+                uncue()
+        self.clock.wait_until(self.BEATS * interval)    # let a late last tap in
+        taps = []
+        while not input_q.empty():
+            got = input_q.get()
+            if got['type'] == 'hit':
+                taps.append(got['time'])
+        return beats[self.WARMUP_BEATS:], taps
+
+    def _tap_pass(self, name, cue, uncue=None):
+        print(f'calibrating {name}: tap any pad along with the beat...')
+        beats, taps = self.tap_along(cue, uncue)
+        if self.cancelled:
+            return getattr(self.offsets, name)
+        lag, spread, n = tap_offset(beats, taps, 60 / self.BPM)
+        self.metrics[f'{name}_taps'] = n
+        self.metrics[f'{name}_spread_ms'] = spread * 1000 if n else None
+        if not n:
+            print(f'no taps on the beat, keeping the {name} offset')
+            return getattr(self.offsets, name)
+        return lag - self.offsets.input
+
+    def run(self):
+        """
+        Measure, store and return this device's offsets; None if cancelled.
+        """
+        rtts = self.measure_loopback()
+        self.metrics['loopback_replies'] = len(rtts)
+        self.metrics['loopback_rtt_ms'] = percentile([x*1000 for x in rtts], 50) if rtts else None
+        if rtts:
+            self.offsets.input = float(np.median(rtts)) / 2
+        else:
+            print('no reply to device inquiry, keeping the input offset')
+        sampler = self.painter.sampler
+        lit, dark = [self.FLASH_COLOR]*64, [0]*64
+        passes = (('audio', lambda: sampler.play_midi_note(self.CLICK_NOTE), None),
+                  ('visual', lambda: self.painter.send_frame(lit),
+                                lambda: self.painter.send_frame(dark)))
+        for name, cue, uncue in passes:
+            if self.cancelled:
+                break
+            setattr(self.offsets, name, self._tap_pass(name, cue, uncue))
+        if self.cancelled:
+            print('calibration cancelled, keeping the previous offsets')
+            return None
+        self.metrics.update({f'{k}_ms': v*1000 for k, v in self.offsets.as_dict().items()})
+        save(self.device, self.offsets, self.path)
+        self.show_metrics()
+        return self.offsets
+
+    def show_metrics(self):
+        print(f'calibrated {self.device}:')
+        for k, v in self.metrics.items():
+            print(f'    {k}: ' + ('-' if v is None else f'{v:.1f}' if isinstance(v, float) else f'{v}'))
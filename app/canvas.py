@@ -0,0 +1,222 @@
+import uuid
+import numpy as np
+
+
+class Page:
+    """
+    A grid of pad colors backed by a uint8 array: (rows, cols) palette
+    indices, or (rows, cols, 3) 7-bit RGB values for RGB pages. Flat pad
+    index i is row i // cols, column i % cols (same order as PADMAP).
+    """
+    def __init__(self, colors, quick_id=None, rows=8, cols=8):
+        self.pixels = _as_grid(colors, rows, cols)
+        self.id = uuid.uuid1()
+        self.quick_id = quick_id
+
+    @classmethod
+    def blank(cls, color=0, rows=8, cols=8, rgb=False):
+        shape = (rows, cols, 3) if rgb else (rows, cols)
+        page = cls(np.zeros(shape, dtype=np.uint8), rows=rows, cols=cols)
+        page.fill(color)
+        return page
+
+    def __getstate__(self):
+        return {'pixels': self.pixels, 'id': self.id, 'quick_id': self.quick_id}
+
+    def __setstate__(self, state):
+        if 'colors' in state:   # pickled before pages were arrays
+            state = dict(state)
+            state['pixels'] = _as_grid(state.pop('colors'), 8, 8)
+        vars(self).update(state)
+
+    @property
+    def shape(self):
+        return self.pixels.shape[:2]
+
+    @property
+    def is_rgb(self):
+        return self.pixels.ndim == 3
+
+    @property
+    def colors(self):
+        """
+        Flat (pads,) or (pads, 3) colors. A view of pixels for a whole page;
+        for a window() over a larger page this is a copy, so don't write to it.
+        """
+        rows, cols = self.shape
+        return self.pixels.reshape(rows*cols, -1) if self.is_rgb \
+                                                else self.pixels.reshape(rows*cols)
+
+    def _cell(self, index):
+        if isinstance(index, tuple):
+            return index
+        return divmod(index, self.shape[1])
+
+    def edit(self, index, color):
+        self.pixels[self._cell(index)] = color
+
+    def get_color(self, index):
+        color = self.pixels[self._cell(index)]
+        return tuple(color.tolist()) if self.is_rgb else int(color)
+
+    def fill(self, color):
+        self.pixels[...] = color
+
+    def blit(self, src:'Page', x=0, y=0, transparent=None):
+        """
+        Paste src with its top-left corner at column x, row y, clipped to
+        this page. Pixels equal to transparent are skipped.
+        """
+        rows, cols = self.shape
+        src_rows, src_cols = src.shape
+        top, left = max(y, 0), max(x, 0)
+        bottom, right = min(y + src_rows, rows), min(x + src_cols, cols)
+        if top >= bottom or left >= right:
+            return
+        dst = self.pixels[top:bottom, left:right]
+        patch = src.pixels[top - y:bottom - y, left - x:right - x]
+        if transparent is None:
+            dst[...] = patch
+        else:
+            mask = _opaque(patch, transparent)
+            dst[mask] = patch[mask]
+
+    def window(self, x, y, rows=8, cols=8):
+        """
+        Page that views (and writes through to) a rows x cols part of this
+        one, starting at column x, row y.
+        """
+        page = Page.__new__(Page)
+        page.pixels = self.pixels[y:y+rows, x:x+cols]
+        page.id = self.id
+        page.quick_id = self.quick_id
+        return page
+
+    def flood_fill(self, index, color, connectivity=4, tolerance=0):
+        """
+        Fill the region around index (flat index or (row, col)) with color.
+        Returns the flat indices of the pads that were painted.
+        """
+        row, col = self._cell(index)
+        region = region_mask(self.pixels, row, col, connectivity, tolerance)
+        region &= ~_similar(self.pixels, color, 0)  # already that color
+        self.pixels[region] = color
+        return np.flatnonzero(region)
+
+    def copy(self):
+        page = Page.__new__(Page)
+        page.pixels = self.pixels.copy()
+        page.id = self.id
+        page.quick_id = self.quick_id
+        return page
+
+    def diff(self, other:'Page'):
+        """
+        Flat indices of the pads whose color differs from other.
+        """
+        changed = self.pixels != other.pixels
+        if self.is_rgb:
+            changed = changed.any(axis=2)
+        return np.flatnonzero(changed)
+
+    def _derive(self, pixels):
+        page = Page.__new__(Page)
+        page.pixels = np.ascontiguousarray(pixels)
+        page.id = uuid.uuid1()
+        page.quick_id = self.quick_id
+        return page
+
+    def rotate(self, k=1):
+        """
+        New page rotated by k quarter turns counter-clockwise.
+        """
+        return self._derive(np.rot90(self.pixels, k, axes=(0, 1)))
+
+    def flip(self, horizontal=True):
+        return self._derive(self.pixels[:, ::-1] if horizontal else self.pixels[::-1])
+
+    @classmethod
+    def compose(cls, layers:'list[Page]', transparent=0):
+        """
+        Stack layers bottom to top; transparent pixels let the layer below
+        show through.
+        """
+        page = layers[0]._derive(layers[0].pixels.copy())
+        for layer in layers[1:]:
+            mask = _opaque(layer.pixels, transparent)
+            page.pixels[mask] = layer.pixels[mask]
+        return page
+
+###------------ region operations ------------###
+def _similar(pixels, color, tolerance):
+    """
+    Palette indices must match exactly; RGB pixels match when no channel is
+    more than tolerance away from color.
+    """
+    if pixels.ndim == 3:
+        distance = np.abs(pixels.astype(np.int16) - np.asarray(color, dtype=np.int16))
+        return distance.max(axis=2) <= tolerance
+    return pixels == color
+
+def _grow(mask, connectivity=4):
+    """
+    Dilate a boolean mask by one cell (4- or 8-connected).
+    """
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    if connectivity == 8:
+        grown[1:, 1:] |= mask[:-1, :-1]
+        grown[1:, :-1] |= mask[:-1, 1:]
+        grown[:-1, 1:] |= mask[1:, :-1]
+        grown[:-1, :-1] |= mask[1:, 1:]
+    return grown
+
+def region_mask(pixels, row, col, connectivity=4, tolerance=0, within=None):
+    """
+    Boolean mask of the region connected to (row, col) whose pixels match
+    the seed pixel. Grows the region a ring at a time, no recursion.
+    """
+    candidates = _similar(pixels, pixels[row, col], tolerance)
+    if within is not None:
+        candidates &= within
+    region = np.zeros(candidates.shape, dtype=bool)
+    region[row, col] = True
+    size = 1
+    while True:
+        region = _grow(region, connectivity) & candidates
+        grown_size = np.count_nonzero(region)
+        if grown_size == size:
+            return region
+        size = grown_size
+
+def label_regions(pixels, connectivity=4, tolerance=0):
+    """
+    Connected-components labeling. Returns (labels, n) where labels holds a
+    region number 1..n per cell.
+    """
+    labels = np.zeros(pixels.shape[:2], dtype=np.int32)
+    n = 0
+    while True:
+        unlabeled = np.flatnonzero(labels == 0)
+        if len(unlabeled) == 0:
+            return labels, n
+        row, col = divmod(int(unlabeled[0]), labels.shape[1])
+        n += 1
+        labels[region_mask(pixels, row, col, connectivity, tolerance,
+                           within=(labels == 0))] = n
+###------------ end region operations ------------###
+
+def _as_grid(colors, rows, cols):
+    pixels = np.array(colors, dtype=np.uint8)
+    if pixels.size == rows*cols*3:
+        return pixels.reshape(rows, cols, 3)
+    return pixels.reshape(rows, cols)
+
+def _opaque(pixels, transparent):
+    mask = pixels != transparent
+    if pixels.ndim == 3:
+        mask = mask.any(axis=2)
+    return mask
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compiled DDR charts: everything PlayTrack builds from a midi file (track
+arrays, timing, frame times and colors) saved as one .npz, so a song that
+was played before starts without parsing or segmenting anything.
+
+    python -m app.charts [--force]
+
+precompiles every song in assets/midi.
+"""
+import os
+import sys
+import json
+import zipfile
+import hashlib
+import numpy as np
+from .config import STORAGE_PATH
+
+CHART_DIR = os.path.join(STORAGE_PATH, 'charts')
+VERSION = 1     # bump when PlayTrack builds charts differently
+
+
+def chart_key(midi_path, params):
+    """
+    Hash of the midi file's bytes and the parameters the chart was built with.
+    """
+    digest = hashlib.sha1()
+    with open(midi_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps({'version': VERSION, **params}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def chart_path(midi_path, params, root=CHART_DIR):
+    name = os.path.splitext(os.path.basename(midi_path))[0]
+    return os.path.join(root, f'{name}-{chart_key(midi_path, params)[:16]}.npz')
+
+def load(midi_path, params, root=CHART_DIR):
+    """
+    The compiled arrays, or None if this file hasn't been compiled with these
+    parameters (or the cached copy is unreadable).
+    """
+    try:
+        with np.load(chart_path(midi_path, params, root)) as data:
+            return dict(data)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+def save(midi_path, params, arrays, root=CHART_DIR):
+    os.makedirs(root, exist_ok=True)
+    path = chart_path(midi_path, params, root)
+    # write to a temp file and rename: a half-written chart is never loaded
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+    return path
+
+def main(force=False):
+    from . import ddr, launchpad, replay    # launchpad for the Song registry
+    for fname in sorted(os.listdir(ddr.MIDI_DIR_PATH)):
+        name, ext = os.path.splitext(fname)
+        if ext != '.mid':
+            continue
+        kwargs = { }
+        if name in launchpad.Song.SONGS:
+            song = launchpad.Song.get_metadata(name)
+            kwargs = dict(bpm=song.bpm, time_signature=song.time_signature,
+                          start_tick=song.start_tick)
+        if force:
+            kwargs['chart_cache'] = None
+        playtrack = ddr.PlayTrack(fname, replay.OfflinePainter(), **kwargs)
+        if force:
+            save(playtrack.midi_path, playtrack.chart_params, playtrack.compiled())
+        print(f'{fname}: {playtrack.n_frames} frames '
+              f'-> {chart_path(playtrack.midi_path, playtrack.chart_params)}')
+
+if __name__ == '__main__':
+    main(force='--force' in sys.argv[1:])
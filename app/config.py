@@ -2,5 +2,6 @@ import os
 
 PROJECT_ROOT = 'app'
 ASSETS_PATH = os.path.join(PROJECT_ROOT, 'assets')
+STORAGE_PATH = os.path.join(ASSETS_PATH, 'storage')
 
 
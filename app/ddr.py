@@ -1,25 +1,22 @@
 import random
 import mido
-from copy import deepcopy
 import os
 import math
-import time
 import threading
-import queue
+import bisect
+from itertools import islice
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from . import config
+from . import scheduler
+from . import sysex
+from . import scoring
+from . import charts
+from . import calibration
 
 MIDI_DIR = 'assets/midi'
 MIDI_DIR_PATH = os.path.join(config.PROJECT_ROOT, MIDI_DIR)
-
-def get_window(track, offset, cols=8, rows=8):
-    return track[offset*cols:offset*cols+(cols*rows)]
-
-def flip_frame_for_display(frame):
-    flipped = []
-    for i in reversed(range(8)):
-        row = frame[i*8:(i+1)*8]
-        flipped.extend(row)
-    return flipped
+SEGMENTS_PER_BEAT = 12  # a segment is a 12th of a quarter note: fits 16ths and triplets
 
 class TimingTrack: # unused for now, just using a default list atm...
     def __init__(self):
@@ -29,6 +26,46 @@ class TimingTrack: # unused for now, just using a default list atm...
     def __getitem__(self, index):
         return self.items[index]
 
+class TempoMap:
+    """
+    Tick => seconds through every tempo change: the seconds at each set_tempo
+    are worked out once, so a lookup is a bisect and a multiply. Before the
+    first tempo event the tempo is default_bpm.
+    """
+    def __init__(self, ticks_per_beat, tempos=(), default_bpm=120):
+        """
+        tempos: (tick, microseconds per beat) pairs, in tick order
+        """
+        self.ticks_per_beat = ticks_per_beat
+        self.ticks = [0]
+        self.tempos = [mido.bpm2tempo(default_bpm)]
+        self.offsets = [0.0]    # seconds at each tempo change
+        for tick, tempo in tempos:
+            tick = max(0, tick)
+            if tick == self.ticks[-1]:
+                self.tempos[-1] = tempo
+                continue
+            self.offsets.append(self.seconds(tick))
+            self.ticks.append(tick)
+            self.tempos.append(tempo)
+
+    @classmethod
+    def from_timeline(cls, timeline, ticks_per_beat, default_bpm=120):
+        tempos = [(tick, msg.tempo) for tick, msg in timeline if msg.type == 'set_tempo']
+        return cls(ticks_per_beat, tempos, default_bpm)
+
+    def seconds(self, tick):
+        """
+        Seconds from tick 0; ticks before 0 run at the first tempo.
+        """
+        i = max(0, bisect.bisect_right(self.ticks, tick) - 1)
+        return (self.offsets[i]
+                + (tick - self.ticks[i]) * self.tempos[i] / (1e6 * self.ticks_per_beat))
+
+    @property
+    def bpm(self):
+        return mido.tempo2bpm(self.tempos[0])
+
 class TimeSignature:
     def __init__(self, numerator, denominator):
         self.numerator = numerator
@@ -44,310 +81,252 @@ class TimingFrame:
         self.time_signature = time_signature
         self.is_triplet = is_triplet
 
-class TrackFrame:
-    def __init__(self, items:'List[TrackItem]'):
-        self.items = items
-    def __len__(self):
-        return len(self.items)
-    def __getitem__(self, index):
-        return self.items[index]
-    def __getattr__(self, name):
-        if hasattr(self.items, name):
-            return getattr(self.items, name)
-        else:
-            raise AttributeError(name)
-
-class TrackItem:
-    __slots__ = ('note','beat','color','is_triplet','is_blank','is_wall')
-    def __init__(self, note=None, beat=None, color=None,
-                    is_triplet=False, is_blank=False, is_wall=False):
-        self.note = note
-        self.beat = beat
-        self.color = color
-        self.is_triplet = is_triplet
-        self.is_blank = is_blank
-        self.is_wall = is_wall
-        #self._assign_color()
-    def _assign_color(self):
-        assert(self.note or self.is_blank or self.is_wall)
-        if self.is_blank:
-            self.color = 0
-        elif self.is_wall:
-            self.color = -1
-        else:
-            self.color = None # will be assigned by column in _recolor_frame
-            #self.FRAME_RECOLOR_MAP[self.note] 
-
 class InputListener:
     def __init__(self, playtrack:'PlayTrack'):
         self.playtrack = playtrack
         self._input_q = self.playtrack._input_q # shortcuts
-        self.frames = self.playtrack.frames
+        self._stop = threading.Event()  # set by stop_listening(), even before play()
 
     def _clear_queue(self):
         while not self._input_q.empty():
             self._input_q.get()
 
     def _register_miss(self):
+        # the scorer counts misses, show_diagnostics() reports them
         self.streak = 0
         self.bonus = False
-        print('MISS!') 
-
-    def _get_expected_times(self):
-        t = 0
-        times = []
-        for note in self.playtrack.timing_track:
-            times.append(t)
-            t += self.playtrack._ticks_to_seconds(note.duration) / self.rate
-        return times
-
-    def check_for_hit(self, pad_index, hit_time, current_frame_no, next_frame_no,
-                        hit_or_miss_log):
-        thresh = self.playtrack._ticks_to_seconds(self.playtrack.segment_ticks*2)
-        thresh /= self.rate
-
-        expected_time = self.expected_times[current_frame_no]
-        next_expected_time = self.expected_times[next_frame_no]
-        
-        print(f'thresh percent = {thresh/(next_expected_time-expected_time):.2f}')
-
-        # todo: should there be a late allowance? or just early..?
-        diff = hit_time - expected_time # todo: use this to grade accuracy
-
-        # first time check.
-        check_for_leading_hit = False
-        if hit_time < next_expected_time:
-            # check for hit within current frame
-            if hit_or_miss_log[current_frame_no] is None:
-                # current frame has not been hit yet
-                # maybe its a blank and this is a leading hit 
-                if hit_time > (next_expected_time - thresh):
-                    check_for_leading_hit = True
-                # or, maybe this is a first well-timed hit
-                # check if correct columns were hit...
-                hit_pad_note = self.frames[current_frame_no][pad_index].note
-                if pad_index >= 56 and hit_pad_note is not None:
-                    # make sure pad hit was in bottom row
-                    # and that it was not a blank
-                    return 'current', hit_pad_note, diff 
-            else:
-                check_for_leading_hit = True
-
-            if check_for_leading_hit:
-                # current frame has already been hit (or blank frame leading?)
-                # maybe its a leading hit of the next frame
-                if hit_time > (next_expected_time - thresh):
-                    hit_pad_note = self.frames[next_frame_no][pad_index].note
-                    #print('check for early hit:', next_strike_row)
-                    if pad_index >= 56 and hit_pad_note is not None:
-                        # make sure pad hit was in bottom row
-                        # and that it was not a blank
-                        return 'next', hit_pad_note, diff 
-        
+
     def _input_listener(self):
-        self._clear_queue()
-        current_frame_no = -1
-        next_frame_no = 0
-        hit_or_miss_log = {i:None for i in range(self.playtrack.n_frames)}
-        self.hit_or_miss_log = hit_or_miss_log
-        self.expected_times = self._get_expected_times()
-        notes_in_current_frame = { }
-        notes_in_next_frame = { }
+        sampler = self.playtrack.painter.sampler
+        self.scorer = scoring.Scorer(self.chart)
         self.streak = 0
-        self.pad_hit = None
         while True:
             got = self._input_q.get()
-            self.pad_hit = None
             if got['type'] == 'hit':
-                hit_time = got['time'] - self.start_time
-                pad_index = got['pad_index']
-                hit_data = self.check_for_hit(pad_index, hit_time, current_frame_no,
-                                                next_frame_no, hit_or_miss_log)
-                if not hit_data:
-                    # attempted to hit, but missed
-                    self.playtrack.painter.sampler.play_midi_note(-1) # make miss sound
+                t = got['time'] - self.offsets.input - self.start_time
+                hit = self.scorer.hit_pad(got['pad_index'], t)
+                if self.recorder:
+                    self.recorder.record_hit(t, got['pad_index'], got.get('sent'))
+                if hit is None:
+                    sampler.play_midi_note(-1) # make miss sound
                     self._register_miss()
                     continue
-                cur_or_next, note_hit, diff = hit_data
-                self.streak += 1
-                self.pad_hit = pad_index
-                if cur_or_next == 'current':
-                    print(f'got a current hit...{diff:.2f} [{note_hit}]')
-                    # check if already got a hit early last frame
-                    if hit_or_miss_log[current_frame_no]:
-                        print('already hit last frame')
-                        continue 
-                    else:
-                        notes_in_current_frame[note_hit] = True
-                        self.playtrack.painter.sampler.play_midi_note(note_hit) #make sound
-                        if all(notes_in_current_frame.values()): # whole chord/note hit 
-                            hit_or_miss_log[current_frame_no] = diff  # log accuracy of hit
-                if cur_or_next == 'next':
-                    print(f'got a leading hit...{diff:.2f} [{note_hit}]')
-                    notes_in_next_frame[note_hit] = True
-                    self.playtrack.painter.sampler.play_midi_note(note_hit) # make sound
-                    if all(notes_in_next_frame.values()): # whole chord/note hit 
-                        hit_or_miss_log[next_frame_no] = diff  # log accuracy of hit
+                grade, note, offset = hit
+                sampler.play_midi_note(note) # make sound
             elif got['type'] == 'frame_started':
-                current_frame_no += 1
-                next_frame_no = min(self.playtrack.n_frames-1, current_frame_no + 1)
-                if current_frame_no > 0:
-                    if hit_or_miss_log[current_frame_no-1] is None:
-                        # check if previous frame was a miss and mark it as such if so.
-                        if len(notes_in_current_frame) > 0:
-                            hit_or_miss_log[current_frame_no-1] = False
-                            print('missed frame #', current_frame_no-1)
-                            self._register_miss()
-                # reset frame variables (current and look ahead [next] frames)
-                current_strike_row = [item.note or 0
-                                    for item in self.frames[current_frame_no][56:]]
-                notes_in_current_frame = {i:False for i in current_strike_row if i > 0}
-                next_strike_row = [item.note or 0
-                                    for item in self.frames[next_frame_no][56:]]
-                notes_in_next_frame = {i:False for i in next_strike_row if i > 0}
+                t = got['time'] + self.offsets.visual - self.start_time
+                self.scorer.expire(t)
+                if self.recorder:
+                    self.recorder.record_frame(t)
             elif got['type'] == 'exit':
                 break
+            if self.scorer.combo < self.streak:
+                self._register_miss()
+            self.streak = self.scorer.combo
             if self.streak > 10:
                 self.bonus = True
+        self.scorer.finish()
         print('ddr playtrack stopped listening')
 
     def _listen_for_input(self):
-        t = threading.Thread(target=self._input_listener, args=())
-        t.start()
+        self._clear_queue()
+        self._listener = threading.Thread(target=self._input_listener, args=())
+        self._listener.start()
 
     def stop_listening(self):
+        """
+        Stop the game, or the next play() if it hasn't started yet (a
+        sample pack still loading).
+        """
         self._stop.set()
+        self._end_listening()
+
+    def _end_listening(self):
         self.playtrack.painter.sampler.stop_backing_track()
         self._input_q.put({'type': 'exit'})
 
-    def play(self, rate=1, autoplay=False, remote=None):
+    def play(self, rate=1, autoplay=False, remote=None, clock=None, recorder=None,
+                offsets=None):
+        """
+        clock: a scheduler.FrameClock to pace frames with (e.g. a replay's
+        simulated one); recorder: a replay.Recorder to capture the session.
+        offsets: the device's calibration.Offsets. Times are judged and
+        recorded as the player perceives them: start_time is when the
+        first frame is seen, offsets.lead after the clock starts.
+        Returns the result, or None if stopped early.
+        """
+        if self._stop.is_set():
+            print('playback stopped before it started.')
+            return None
         self.rate = rate
-        #print(self._ticks_to_seconds(sum(i.duration for i in self.timing_track)))
-        self.start_time = time.time()
+        self.clock = clock or scheduler.FrameClock()
+        self.recorder = recorder
+        self.offsets = offsets or calibration.Offsets()
+        self.timers = scheduler.TimerHeap(self.clock.clock)
+        self.chart = scoring.Chart.from_playtrack(self.playtrack, rate)
+        lead = self.offsets.lead
+        self.start_time = self.clock.start() + lead
+        self.bonus = False  # before the listener thread reads it
         self._listen_for_input()
-        input_time = 0
-        actual_sleep = 0
-        new_frame_signal = {'type': 'frame_started'}
-        self._stop = threading.Event()
-        self.bonus = False
-        for i in range(len(self.frames)):
+        sampler = self.playtrack.painter.sampler
+        frame_times = self.playtrack.frame_times / rate
+        send_at = lead - self.offsets.visual     # clock seconds frame 0 goes out
+        self.timers.call_at(self.start_time - self.offsets.audio
+                            + frame_times[self.playtrack.INTRO_PAD_FRAMES],
+                            sampler.play_backing_track)
+        for i in range(self.playtrack.n_frames):
+            self.clock.wait_until(send_at + frame_times[i])
             if self._stop.is_set():
                 print('playback stopped early.')
+                self.timers.stop()
                 return
-            self._input_q.put(new_frame_signal)
-            if i == self.playtrack.INTRO_PAD_FRAMES:
-                self.playtrack.painter.sampler.play_backing_track()
-            input_time += self.playtrack.timing_track[i].duration / rate
-
-            #self.painter.remap_sampler(self.frames[i]) #no need for this now
-            frame = self.frames[i]
-            if self.bonus or self.pad_hit:
-                self.playtrack._recolor_frame(frame, bonus=self.bonus,
-                                                pad_hit=self.pad_hit)
-            colors = [item.color for item in frame]
-            self.playtrack.painter.send_sysex(self.playtrack.painter.as_page(colors))
-            if autoplay:
+            self._input_q.put({'type': 'frame_started', 'time': self.clock.clock()})
+            variant = PlayTrack.BONUS if self.bonus else PlayTrack.NORMAL
+            self.playtrack.painter.send_frame(self.playtrack.frame_color_table[i, variant],
+                                            self.playtrack.frame_sysex[i, variant])
+            if autoplay:    # hit on the beat, as a calibrated player would
                 for j in range(56, 64):
-                    if self.frames[i][j].note is not None:
-                        delay = random.random()
-                        delay = 0*delay
-                        t = threading.Timer(delay,
-                                    self.playtrack.painter.sampler.play_note, args=(j,))
-                        t.start()
-            playback_time = time.time() - self.start_time
-            duration_to_next_frame = self.playtrack._ticks_to_seconds(
-                                                    input_time) - playback_time
-            if duration_to_next_frame > 0.0:
-                actual_sleep += duration_to_next_frame
-                time.sleep(duration_to_next_frame)
-        self.end_time = time.time()
-        self.stop_listening()
-        self.show_diagnostics(actual_sleep, input_time)
-        self.display_score(self.hit_or_miss_log)
-
-    def show_diagnostics(self, actual_sleep, input_time):
-        elapsed = self.end_time - self.start_time
+                    if self.playtrack.note_at(i, j) is not None:
+                        self.timers.call_at(self.start_time + frame_times[i] + self.offsets.input,
+                                            sampler.play_note, j)
+        self.clock.wait_until(send_at + frame_times[-1])
+        self.end_time = self.clock.clock()
+        self.timers.stop()
+        self._end_listening()     # not stop_listening(): the track can be played again
+        self._listener.join()
+        self.show_diagnostics()
+        result = self.scorer.result()
+        self.display_score(result)
+        return result
+
+    def show_diagnostics(self):
+        elapsed = self.end_time + self.offsets.visual - self.start_time
+        stats = self.clock.stats()
         print(f'midi track finished in {elapsed:.2f} seconds.')
-        print(f'actual_sleep: {actual_sleep:.2f}')
-        print(f'input_time: {self.playtrack._ticks_to_seconds(input_time):.2f}')
-
-    def display_score(self, hit_or_miss_log):
-        for frame, accuracy in hit_or_miss_log.items():
-            if accuracy is None:
-                continue
-            elif accuracy is False:
-                print(f'{frame:<4}: miss')
-            else:    
-                print(f'{frame:<4}: {accuracy:.2f}')
-        results = list(hit_or_miss_log.values())
-        hits = sum(1 for i in results if i)
-        misses = sum(1 for i in results if i == False)
-        blanks = sum(1 for i in results if i == None)
-        print(f'hits:{hits}, misses:{misses}, blanks:{blanks}')
-        print(f'frames:{hits+misses+blanks}')
+        print(f'expected: {self.playtrack.frame_times[-1] / self.rate:.2f}')
+        print(f"frame lateness: mean {stats['mean_ms']:.3f}ms, "
+              f"p99 {stats['p99_ms']:.3f}ms, max {stats['max_ms']:.3f}ms")
+        print(f'compensating {self.offsets}')
+        hit_offsets = [offset for _, _, grade, offset in self.scorer.log if grade != 'miss']
+        if hit_offsets:     # well off zero: time to recalibrate
+            print(f'hit offset: median {np.median(hit_offsets)*1000:+.1f}ms')
+
+    def display_score(self, result):
+        grades = ', '.join(f'{grade}:{result[grade]}' for grade, _ in self.scorer.windows)
+        print(f"{grades}, misses:{result['miss']}, strays:{result['strays']}")
+        print(f"score:{result['score']}/{result['max_score']}, max combo:{result['max_combo']}")
 
 class PlayTrack:
+    """
+    The song as parallel (rows, 8) arrays, one row per timing frame, first
+    played first: notes (midi note or NO_NOTE) and flags (BLANK, WALL or
+    0 for a note). Frame i is the 8 rows from i up, flipped so the row
+    being played is the bottom (strike) row: frame_notes and frame_flags
+    are (n_frames, 8, 8) sliding-window views of the track, not copies.
+
+    Every frame's colors are worked out at load, for each variant (NORMAL,
+    BONUS), in frame_color_table, along with the matching full-frame sysex
+    in frame_sysex, so playback only looks them up.
+    """
     FRAME_RECOLOR_MAP = {-1: 3, -2: 0, -3:59, 0: 8, 1: 32, 2: 12, 3: 44,
                             4: 4, 5: 24, 6:47, 7:56 }
+    COLUMN_COLORS = np.array([8, 32, 12, 44, 4, 24, 47, 56], dtype=np.uint8) # FRAME_RECOLOR_MAP[0..7]
+    WALL_COLOR = 2
+    BONUS_PULSE = {0:48, 1:52, 2:52, 3:52}
+    NORMAL = 0  # frame_color_table variants
+    BONUS = 1
+    NO_NOTE = -1
+    BLANK = 1
+    WALL = 2
     INTRO_PAD_FRAMES = 8
     OUTRO_PAD_FRAMES = 16
+    TIMING = np.dtype([('duration', '<f8'), ('measure', '<i4'), ('beat', '<i4'),
+                        ('sub_beat', '<i4'), ('is_triplet', '?')])  # timing_track, compiled
     def __init__(self, midi_path, painter, bpm=120, time_signature=(4,4),
-                    ticks_per_beat=480, segment_ticks=40):
+                    ticks_per_beat=None, segment_ticks=None, seed=0, start_tick=0,
+                    cols=3, swing=1, chart_cache=charts.CHART_DIR):
+        """
+        bpm is the tempo until the file's first set_tempo, if it has any.
+        ticks_per_beat defaults to the file's PPQ, segment_ticks to a
+        SEGMENTS_PER_BEAT'th of that. start_tick: lead-in to drop, for a
+        file that runs longer before its first beat than its backing track.
+        seed: for placing chord notes in columns. chart_cache: directory
+        of compiled charts (see charts), None to always build from the file.
+        """
         self.midi_path = os.path.join(MIDI_DIR_PATH, midi_path)
         self.painter = painter
+        self.seed = seed
         self.bpm = bpm
+        self.start_tick = start_tick
         self.time_signature = TimeSignature(*time_signature)
         self.ticks_per_beat = ticks_per_beat
         self.segment_ticks = segment_ticks
-        self._prepare_play_track(cols=3)
+        self.chart_params = {'bpm': bpm, 'time_signature': list(time_signature),
+                            'ticks_per_beat': ticks_per_beat, 'segment_ticks': segment_ticks,
+                            'seed': seed, 'start_tick': start_tick, 'cols': cols, 'swing': swing}
+        compiled = charts.load(self.midi_path, self.chart_params, chart_cache) if chart_cache else None
+        if compiled is None:
+            self._prepare_play_track(cols=cols, swing=swing)
+            if chart_cache:
+                charts.save(self.midi_path, self.chart_params, self.compiled(), chart_cache)
+        else:
+            self._load_compiled(compiled)
+        print('timing frames:', len(self.timing_track), 'frames:', self.n_frames)
+        self.frame_sysex = sysex.build_frames(self.frame_color_table, self.painter.padmap)
         self._input_q = self.painter.sampler.input_q
         self.input_listener = InputListener(self)
 
     def play(self, *args, **kwargs):
-        self.input_listener.play(*args, **kwargs)
+        return self.input_listener.play(*args, **kwargs)
 
     def stop_listening(self):
         self.input_listener.stop_listening()
 
-    @property
-    def seconds_per_segment(self):
-        return (self.segment_ticks/self.ticks_per_beat)*(60/self.bpm)
-
-    def _ticks_to_seconds(self, ticks):
-        return (ticks/self.ticks_per_beat)*(60/self.bpm)
-
-    def _recolor_frames(self):
-        for i in range(len(self.frames)):
-            self._recolor_frame(self.frames[i])
-
-    def _recolor_frame(self, frame:TrackFrame, bonus=False, pad_hit=None):
-        wall_pulse = {0:3, 1:2, 2:2, 3:2}
-        hit_row_pulse = {0:30, 1:31, 2:30, 3:31}
-        bonus_pulse = {0:48, 1:52, 2:52, 3:52}
-        for i in range(len(frame)):
-            item = frame[i]
-            if item.is_wall:
-                map_index = -1
-            elif item.is_blank:
-                map_index = -2
-            elif item.note is not None:
-                map_index = i % 8 # column index
-                if frame.timing.is_triplet:
-                    map_index = -3 
-            base_color = self.FRAME_RECOLOR_MAP[map_index]
-            if not item.is_blank and False: # todo: this is a test auto-false here..
-                row = (i // 8)    # brighten based on row 
-            else:
-                row = 0
-            if item.is_wall:
-                base_color = 2
-                #if pad_hit:
-                #    base_color = 3
-                if i//8 == 7: # color bottom row walls
-                    base_color = 2#-frame.timing.sub_beat#hit_row_pulse[frame.timing.beat]
-                    if bonus:
-                        base_color = bonus_pulse[frame.timing.beat] + frame.timing.sub_beat
-            item.color = base_color + row // 2
+    def _build_frame_times(self):
+        """
+        Seconds from the first frame to the start of each frame (and the end
+        of the last): frame durations are in ticks, and tick 0, where the
+        backing track starts, is INTRO_PAD_FRAMES in.
+        """
+        ticks = np.cumsum([0] + [t.duration for t in self.timing_track])
+        ticks -= ticks[self.INTRO_PAD_FRAMES]
+        seconds = np.array([self.tempo_map.seconds(tick) for tick in ticks])
+        return seconds - seconds[0]
+
+    def note_at(self, frame_no, pad_index):
+        note = self.frame_notes[frame_no][divmod(pad_index, 8)]
+        return None if note == self.NO_NOTE else int(note)
+
+    def strike_notes(self, frame_no):
+        """
+        Notes in the bottom row of frame_no.
+        """
+        row = self.frame_notes[frame_no][7]
+        return [int(note) for note in row[row != self.NO_NOTE]]
+
+    def frame_colors(self, frame_no, bonus=False):
+        variant = self.BONUS if bonus else self.NORMAL
+        return self.frame_color_table[frame_no, variant].reshape(8, 8)
+
+    def _build_color_table(self):
+        """
+        (n_frames, 2, 64) palette colors: notes by column (or all the triplet
+        color in a triplet frame), blanks off, walls dim, and in the BONUS
+        variant the strike row walls pulsing with the beat.
+        """
+        flags = self.frame_flags.reshape(self.n_frames, 64)
+        timing = self.timing_track[:self.n_frames]
+        colors = np.empty((self.n_frames, 64), dtype=np.uint8)
+        colors[:] = np.tile(self.COLUMN_COLORS, 8)
+        colors[[t.is_triplet for t in timing]] = self.FRAME_RECOLOR_MAP[-3]
+        colors[flags == self.BLANK] = self.FRAME_RECOLOR_MAP[-2]
+        colors[flags == self.WALL] = self.WALL_COLOR
+        table = np.stack([colors, colors], axis=1)
+        pulse = np.array([self.BONUS_PULSE.get(t.beat, 52) + t.sub_beat for t in timing],
+                            dtype=np.uint8)
+        walls = flags[:, 56:] == self.WALL
+        table[:, self.BONUS, 56:][walls] = np.broadcast_to(pulse[:, None], walls.shape)[walls]
+        return table
 
     def _circle_around_hit(self, i, pad_index):
         y, x = divmod(i, 8)
@@ -363,66 +342,91 @@ class PlayTrack:
         for i, note in enumerate(sorted(self.note_set)):
             self.note_map[note] = i % cols
 
-    def _prepare_play_track(self, re_segment=True, cols=3):
+    def _prepare_play_track(self, re_segment=True, cols=3, swing=1):
         self.midi_file = mido.MidiFile(self.midi_path)
-        self.midi_track = self.midi_file.tracks[0]
-        self.segments = midi_segmenter(self.midi_track)
+        if self.ticks_per_beat is None:
+            self.ticks_per_beat = self.midi_file.ticks_per_beat
+        if self.segment_ticks is None:
+            self.segment_ticks = self.ticks_per_beat / SEGMENTS_PER_BEAT
+        self.tempo_map = TempoMap.from_timeline(self.timeline(), self.ticks_per_beat,
+                                                default_bpm=self.bpm)
+        segments = midi_segmenter(note_ons(self.timeline()), self.ticks_per_beat)
         if re_segment:
-            self._re_segment(swing=1)
-        self.note_set = set(m.note for m in self.midi_track if isinstance(m, mido.Message)
-                        and m.type == 'note_on')
+            self._re_segment(segments, swing=swing)
+        else:
+            self.segments = list(segments)
+        self.note_set = set(note for _, note, _ in note_ons(self.timeline()))
         self._build_note_map(self.note_set, cols)
-        self.play_track = self._build_play_track(self.segments, self.note_set, cols)
-        self.frames = self._build_frames(self.play_track)
-        self.n_frames = len(self.frames)
-        self._recolor_frames()
+        self.notes, self.flags = self._build_play_track(self.segments, self.note_set, cols)
+        self._build_views()
+        self.frame_times = self._build_frame_times()
+        self.frame_color_table = self._build_color_table()
+
+    def _build_views(self):
+        self.frame_notes = self._build_frames(self.notes)
+        self.frame_flags = self._build_frames(self.flags)
+        self.n_frames = len(self.frame_notes)
+
+    def compiled(self):
+        """
+        The arrays the chart is cached as, see charts.
+        """
+        timing = np.array([(t.duration, t.measure, t.beat, t.sub_beat, t.is_triplet)
+                            for t in self.timing_track], dtype=self.TIMING)
+        return {'notes': self.notes, 'flags': self.flags, 'timing': timing,
+                'frame_times': self.frame_times, 'frame_color_table': self.frame_color_table,
+                'ticks': np.array([self.ticks_per_beat, self.segment_ticks], dtype=np.float64)}
+
+    def _load_compiled(self, arrays):
+        self.notes = arrays['notes']
+        self.flags = arrays['flags']
+        self.timing_track = [TimingFrame(float(t['duration']), int(t['measure']), int(t['beat']),
+                                        sub_beat=int(t['sub_beat']), is_triplet=bool(t['is_triplet']),
+                                        time_signature=self.time_signature)
+                            for t in arrays['timing']]
+        self.frame_times = arrays['frame_times']
+        self.frame_color_table = arrays['frame_color_table']
+        ticks_per_beat, self.segment_ticks = arrays['ticks'].tolist()
+        self.ticks_per_beat = int(ticks_per_beat)
+        self._build_views()
+
+    def timeline(self):
+        """
+        (tick, message) for every track merged, tick counted from start_tick.
+        """
+        tick = -self.start_tick
+        for msg in mido.merge_tracks(self.midi_file.tracks):
+            tick += msg.time
+            yield tick, msg
 
     def _build_play_track(self, segments, note_set, cols):
-        def build_display_row(track_row):
-            display_row = [TrackItem(is_wall=True) for _ in range(8)] # fix a blank color 
-            n = len(track_row)
-            start = (8-n)//2
-            display_row[start:start+n] = track_row 
-            return display_row
-        track = []
-        for _ in range(self.INTRO_PAD_FRAMES):        # intro padding
-            track.extend(build_display_row([TrackItem(is_blank=True) 
-                                            for _ in range(cols)]))
-        for segment in segments:
-            track_row = [TrackItem(is_blank=True) for _ in range(cols)]
-            for i, msg in enumerate(segment):
-                index = self.note_map[msg.note] 
-                item = track_row[index]
-                if item.is_blank:         # first (or only) note in chord
-                    track_row[index] = TrackItem(note=msg.note)
-                else:       # handle chord placement for column assignment collision
-                    index = index + random.randint(1, cols-1)
-                    track_row[index % cols] = TrackItem(note=msg.note)
-            track_row = build_display_row(track_row)
-            track.extend(track_row)
-        for _ in range(self.OUTRO_PAD_FRAMES):        # outro padding
-            track.extend(build_display_row([TrackItem(is_blank=True)
-                                            for _ in range(cols)]))
-        return track
-
-    def _build_frames(self, play_track):
-        n = len(play_track)//8 - 8 #
-        frames = []
-        print('timing frames:', len(self.timing_track), 'frames:', n)
-        for i in range(n):
-            frame = get_window(play_track, offset=i)
-            flipped = flip_frame_for_display(frame)
-            track_frame = TrackFrame([deepcopy(item) for item in flipped])
-            track_frame.timing = self.timing_track[i]
-            frames.append(track_frame)
-        return frames
-
-    def _re_segment(self, seg_ticks=40, swing=1):
+        rows = self.INTRO_PAD_FRAMES + len(segments) + self.OUTRO_PAD_FRAMES
+        notes = np.full((rows, 8), self.NO_NOTE, dtype=np.int8)
+        flags = np.full((rows, 8), self.WALL, dtype=np.uint8)
+        start = (8-cols)//2     # note columns centered, walls either side
+        flags[:, start:start+cols] = self.BLANK
+        rng = random.Random(self.seed)
+        for row, segment in enumerate(segments, self.INTRO_PAD_FRAMES):
+            for note in segment:
+                index = self.note_map[note]
+                if notes[row, start+index] != self.NO_NOTE:
+                    # handle chord placement for column assignment collision
+                    index = (index + rng.randint(1, cols-1)) % cols
+                notes[row, start+index] = note
+                flags[row, start+index] = 0
+        return notes, flags
+
+    def _build_frames(self, track):
+        n = len(track) - 8
+        return sliding_window_view(track, (8, 8))[:n, 0, ::-1]
+
+    def _re_segment(self, segments, swing=1):
         """ 
         Introduce variable timing to the playtrack,
             e.g. handle triplets w/different speed than straight-divisions.
+        Reads segments a quarter note at a time, so it can follow midi_segmenter.
         """
-        segs_per_quarter_note = 12
+        seg_ticks = self.segment_ticks
         timing_track = []
         new_segments = []
         beats_per_bar = self.time_signature.numerator
@@ -450,7 +454,7 @@ class PlayTrack:
         def divide_into_four(quarter_note, position):
             measure, beat = divmod(position, beats_per_bar)
             divisions = quarter_note[::3]
-            swing_short, swing_long = get_swing_ratio(480, swing)
+            swing_short, swing_long = get_swing_ratio(self.ticks_per_beat, swing)
             for i, sixteenth_hit in enumerate(divisions):
                 eighth_ticks = swing_long if i < 2 else swing_short
                 new_segments.append(sixteenth_hit)
@@ -458,13 +462,18 @@ class PlayTrack:
                 timing_frame = TimingFrame(duration, measure, beat, sub_beat=i,
                                             time_signature=self.time_signature)
                 timing_track.append(timing_frame)
-        strikes = { 'triplet': (1,0,0,0,1,0,0,0,1,0,0,0) }
+        def is_triplet(quarter_note):
+            # struck on segments 0, 4 and 8 only
+            return (len(quarter_note) == SEGMENTS_PER_BEAT and
+                    all(bool(hit) == (i % 4 == 0) for i, hit in enumerate(quarter_note)))
         # check a quarter note at a time, check for triplet spacing
         beat_count = 0
-        for i in range(0, len(self.segments), segs_per_quarter_note):
-            quarter_note = self.segments[i:i+segs_per_quarter_note]
-            strike_map = tuple(1 if x else 0 for x in quarter_note)
-            if strike_map == strikes['triplet']:
+        segments = iter(segments)
+        while True:
+            quarter_note = tuple(islice(segments, SEGMENTS_PER_BEAT))
+            if not quarter_note:
+                break
+            if is_triplet(quarter_note):
                 divide_into_three(quarter_note, beat_count)
             else:
                 divide_into_four(quarter_note, beat_count)
@@ -478,27 +487,31 @@ class PlayTrack:
         self.timing_track = timing_track
         self.segments = new_segments
 
-def midi_segmenter(msgs: mido.MidiTrack):
-    msgs = [m for m in msgs if isinstance(m, mido.Message)]
-    ticks_per_segment = 40 # 12th of a quarter note in ticks
-    sequence = iter(msgs)
-    t = 0
+def note_ons(timeline):
+    """
+    (tick, note, velocity) for each note_on in a (tick, message) stream.
+    Notes before tick 0 (in a dropped lead-in) are skipped.
+    """
+    for tick, msg in timeline:
+        if msg.type == 'note_on' and tick >= 0:
+            yield tick, msg.note, msg.velocity
+
+def midi_segmenter(events, ticks_per_beat=480):
+    """
+    Quantizes (tick, note, velocity) events into segments, SEGMENTS_PER_BEAT
+    to the quarter note, in one pass: yields each segment as a tuple of the
+    notes struck in it (empty segments too) as soon as a later event closes it.
+    A velocity 0 note_on is a note off: it can close a segment, it's not struck.
+    """
     i = 0
-    segments = []
-    current_segment = []
-    for msg in sequence:
-        t += msg.time
-        if msg.type != 'note_on':
-            continue
-        if t >= (i+1)*ticks_per_segment:
-            residual = t - i*ticks_per_segment
-            passed_segments = residual // ticks_per_segment
-            segments.append(deepcopy(current_segment))
-            current_segment = [ ]
-            for _ in range(passed_segments - 1):
-                segments.append([])
-            i += passed_segments # advance to next segment (12th of a q-note)
-        if msg.velocity > 0:
-            current_segment.append(msg)
-    return segments
-
+    current = []
+    for tick, note, velocity in events:
+        segment = tick * SEGMENTS_PER_BEAT // ticks_per_beat
+        while i < segment:
+            yield tuple(current)
+            current = []
+            i += 1
+        if velocity > 0:
+            current.append(note)
+    if current:
+        yield tuple(current)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Headless Launchpad: an in-memory model of the pads and CC buttons that
+takes the same note_on/sysex stream as the pygame emulator in main.py, with
+no window, audio or MIDI backend. A Painter drives it through the virtual
+port queues (see HeadlessPainter), so tests and benchmarks can press pads
+and check what lit up.
+
+    python -m app.emulator [presses]
+
+drives a painter with synthetic pad presses and reports the rate.
+"""
+import os
+import sys
+import time
+import pickle
+import threading
+import mido
+import numpy as np
+from . import config
+from . import sysex
+from . import launchpad
+from . import replay
+from .midi_io import VirtualOutport, VirtualInport, MessageRing
+
+PALETTE_PATH = os.path.join(config.PROJECT_ROOT, 'palette_colors.pickle')
+GRID_NOTES = np.array([launchpad.PADMAP[i] for i in range(64)])   # pad index => note
+CC_ROWS = {'top': list(range(91, 99)), 'bottom': list(range(101, 109)),
+            'sub': list(range(1, 9)), 'left': list(range(80, 9, -10)),
+            'right': list(range(89, 18, -10))}  # as laid out in main.py, left to right/top down
+# device inquiry reply: Novation, Launchpad Pro
+IDENTITY_REPLY = [0x7E, 0x00, 0x06, 0x02, 0x00, 0x20, 0x29, 0x51, 0x00, 0x00, 0x00, 0, 0, 0, 0]
+
+def load_palette(path=PALETTE_PATH):
+    with open(path, 'rb') as f:
+        return np.array(pickle.load(f), dtype=np.uint8)     # (128, 3) rgb
+
+
+class Device:
+    """
+    leds: (128, 3) RGB of every LED by its note/cc number, as the pygame
+    emulator would draw it, and lit: which have been set at all; grid
+    and cc() give the usual views.
+
+    Messages from the painter land in inbox, a coalescing MessageRing;
+    pump() applies whatever is there in one batch, or start() applies
+    batches as they come on a thread. Presses go to outbox, which the
+    painter reads.
+    """
+    OFF = 0
+
+    def __init__(self, palette=None, inbox=None, outbox=None):
+        self.palette = load_palette() if palette is None else palette
+        self.leds = np.zeros((128, 3), dtype=np.uint8)
+        self.leds[:] = self.palette[self.OFF]
+        self.lit = np.zeros(128, dtype=bool)    # set since power on
+        self.inbox = MessageRing(coalesce=True) if inbox is None else inbox    # painter => device
+        self.outbox = MessageRing() if outbox is None else outbox              # device => painter
+        self.received = 0
+        self.applied = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def ports(self):
+        """ The painter's (outport, inport) for this device. """
+        return VirtualOutport(outbox=self.inbox), VirtualInport(inbox=self.outbox)
+
+    @property
+    def grid(self):
+        """ (8, 8, 3) RGB of the pads, row 0 at the top. """
+        return self.leds[GRID_NOTES].reshape(8, 8, 3)
+
+    def cc(self, row):
+        return self.leds[CC_ROWS[row]]
+
+    def receive(self, msg):
+        if msg.type == 'note_on':
+            self.set(msg.note, self.palette[msg.velocity])
+        elif msg.type == 'control_change':
+            self.set(msg.control, self.palette[msg.value])
+        elif msg.type == 'note_off':
+            self.set(msg.note, self.palette[self.OFF])
+        elif msg.type == 'sysex':
+            self._receive_sysex(msg.data)
+        self.received += 1
+
+    def set(self, leds, rgb):
+        """ leds: a note/cc number or an array of them, rgb: their colors """
+        self.leds[leds] = rgb
+        self.lit[leds] = True
+
+    def _receive_sysex(self, data):
+        decoded = sysex.decode(data, self.palette)
+        if decoded is not None:
+            self.set(*decoded)
+        elif tuple(data[:4]) == (0x7E, 0x7F, 0x06, 0x01):  # device inquiry
+            self.outbox.put(mido.Message('sysex', data=IDENTITY_REPLY))
+
+    def pump(self, timeout=None):
+        """
+        Apply every message waiting (first waiting up to timeout for one,
+        if given); returns how many.
+        """
+        msgs = self.inbox.drain(timeout)
+        for msg in msgs:
+            self.receive(msg)
+        if msgs:
+            with self.applied:
+                self.applied.notify_all()
+        return len(msgs)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while self._running:
+            self.pump(timeout=0.1)
+
+    def wait_idle(self, timeout=1.0):
+        """ Block until nothing has come in for a moment (or timeout). """
+        deadline = time.perf_counter() + timeout
+        last = -1
+        while self.received != last and time.perf_counter() < deadline:
+            last = self.received
+            with self.applied:
+                self.applied.wait(0.02)
+
+    def press(self, pad_index, velocity=127):
+        self.outbox.put(mido.Message('note_on', note=int(GRID_NOTES[pad_index]), velocity=velocity))
+
+    def release(self, pad_index):
+        self.press(pad_index, velocity=0)
+
+    def press_cc(self, control, value=127):
+        self.outbox.put(mido.Message('control_change', control=control, value=value))
+
+
+class HeadlessPainter(launchpad.Painter):
+    """ A Painter on a Device, with a sampler that plays nothing. """
+    def __init__(self, device=None):
+        self.emulator = device or Device().start()
+        self.handled = 0    # messages taken off the inport
+        super().__init__()
+
+    def _init_connections(self):
+        self.outport, self.port = self.emulator.ports()
+        self.inports = [self.port]
+
+    def _init_sampler(self):
+        return replay.OfflineSampler()
+
+    def receive(self):
+        msg = super().receive()
+        if msg:
+            self.handled += 1
+        return msg
+
+
+def drive(painter, presses=2000, timeout=30):
+    """
+    Press pads round the grid as fast as they can be queued (as fast as
+    the painter makes room in a bounded outbox, which would drop presses
+    otherwise), until the painter has taken every press and the device
+    has applied what it sent back. Returns (presses/sec, messages the
+    device applied).
+    """
+    device = painter.emulator
+    device.wait_idle()
+    received, handled = device.received, painter.handled
+    room = getattr(device.outbox, 'maxsize', 0) or float('inf')
+    t0 = time.perf_counter()
+    for i in range(presses):
+        while device.outbox.qsize() >= room and time.perf_counter() - t0 < timeout:
+            time.sleep(0.0001)
+        device.press(i % 64)
+    while painter.handled - handled < presses and time.perf_counter() - t0 < timeout:
+        time.sleep(0.001)
+    device.wait_idle()
+    return presses / (time.perf_counter() - t0), device.received - received
+
+def main(presses=2000):
+    painter = HeadlessPainter()
+    painter.animator.cancel()   # no welcome marquee
+    rate, msgs = drive(painter, presses)
+    lit = (painter.emulator.grid != painter.emulator.palette[Device.OFF]).any(axis=2)
+    print(f'{presses} presses at {rate:.0f} presses/s, {msgs} messages to the device, '
+          f'{np.count_nonzero(lit)} pads lit')
+    painter.stop()
+    painter.emulator.stop()
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -2,6 +2,9 @@ from PIL import Image
 import string
 import os 
 import time
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from . import config
 
 FONT_ITALIC_IMG = os.path.join(config.PROJECT_ROOT, 'font_italic.png')
@@ -19,65 +22,84 @@ class Character:
         return self.pixels[offset:offset+self.width]
         
 class Font:
+    """
+    A font strip image parsed into a glyph atlas: one (rows, total width)
+    array of shades, the glyphs side by side in VALID_CHARS order, with
+    each glyph's start column and width. The last row of the image marks
+    the gaps between glyphs in red.
+
+    Parsing is done once per image per process: use Font.shared().
+    """
     VALID_CHARS = string.ascii_uppercase + '!?. '
     WHITE_VAL = 4
     SPACE_WIDTH = 5
+    SPACER = (255, 0, 0)
+    _shared = { }   # source image => Font
+    _shared_lock = threading.Lock()
+
     def __init__(self, source_image):
-        self.im = Image.open(source_image)
-        self.characters = []
-        self._load()
-        self._build_lookup() 
-        
+        with Image.open(source_image) as im:
+            rgb = np.asarray(im.convert('RGB'))
+        self._load(rgb)
+        self._build_lookup()
+
+    @classmethod
+    def shared(cls, source_image=FONT_ITALIC_IMG):
+        """ The process-wide Font for source_image, parsed on first use. """
+        with cls._shared_lock:
+            font = cls._shared.get(source_image)
+            if font is None:
+                font = cls._shared[source_image] = cls(source_image)
+            return font
+
     def get_char(self, char):
         char = char.upper()
         assert(char in self.VALID_CHARS) 
         return self._lookup[char]
-        
-    def _load(self):
-        self.im = self.im.convert('RGB')
-        w,h = self.im.size
-        self.pixels = list(self.im.getdata())
-        self.track_row = self.pixels[260*(h-1):]    
-        offset = 0
-        while True:
-            character, offset = self._read_letter(offset)    
-            self.characters.append(character)
-            if offset >= w:
-                break
-                
-    def _read_letter(self, offset):
-        space = (255,0,0) 
-        letter_width = 0
-        im_w, im_h = self.im.size
-        while self.track_row[offset] == space: # skip past leading space
-            offset += 1
-        while True:                      # read until next space
-            index = offset + letter_width
-            if index >= im_w or self.track_row[index] == space:
-                break
-            letter_width += 1            # calculate letter width 
-        letter = []
-        for row in range(im_h):
-            for col in range(letter_width):
-                pix = self.pixels[row*im_w + offset + col]
-                shade = self._get_quartile(pix[0]) # use Red Channel of Pixel
-                letter.append(shade)
-        return Character(letter, letter_width), offset+letter_width
-        
-    def _get_quartile(self, val):
-        return (val // 64) + 1 if val > 0 else 0
+
+    def index(self, char):
+        """ char's glyph number in the atlas """
+        char = char.upper()
+        assert(char in self.VALID_CHARS)
+        return self._index[char]
+
+    def glyph(self, i):
+        """ The i'th glyph's (rows, width) shades, a view into the atlas. """
+        return self.atlas[:, self.starts[i]:self.starts[i] + self.widths[i]]
+
+    def _load(self, rgb):
+        """
+        Glyphs are the runs of columns not marked as gaps; shades are
+        quartiles of the red channel, 0 for black.
+        """
+        gap = (rgb[-1] == self.SPACER).all(axis=1)
+        edges = np.diff(np.concatenate(([1], gap, [1])).astype(np.int8))
+        starts, ends = np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
+        red = rgb[:, :, 0]
+        shades = np.where(red > 0, red // 64 + 1, 0).astype(np.uint8)
+        columns = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+        space = np.full((len(rgb), self.SPACE_WIDTH), self.WHITE_VAL, dtype=np.uint8)
+        self.atlas = np.ascontiguousarray(np.hstack((shades[:, columns], space)))
+        self.widths = np.append(ends - starts, self.SPACE_WIDTH)
+        self.starts = np.cumsum(self.widths) - self.widths
+        self.rows = len(rgb)
 
     def _build_lookup(self):
         """
         Build (ascii character) => (pixel representation) mapping/lookup
         """
-        # add a space character
-        sw = self.__class__.SPACE_WIDTH
-        space_char = Character([self.WHITE_VAL]*sw*8, sw) 
-        self.characters.append(space_char)
+        # glyphs from the image, then a space character
+        self.characters = [Character(self.glyph(i).ravel().tolist(), int(self.widths[i]), self.rows)
+                            for i in range(len(self.widths))]
         self._lookup = dict(zip(self.VALID_CHARS, self.characters))
+        self._index = dict(zip(self.VALID_CHARS, range(len(self.characters))))
 
 class Message:
+    """
+    The text rendered into bitmap, a (ROWS, total_width) array of shades:
+    each glyph followed by a blank column, copied out of the font's atlas
+    in one pass.
+    """
     WHITE_SPACE = 4 # code to signify white/off pixel 
     ROWS = 8 
     def __init__(self, message, font):
@@ -85,70 +107,81 @@ class Message:
         self.message = message.upper()
         self.total_width = None
         self._validate()
-        self._get_chars() 
         self._construct()
         
     def print(self):
-        for i in range(Message.ROWS):
-            for j in range(self.total_width):
-                print(Character.SHADES[self.pixels[i*self.total_width + j]], end=" ")
-            print()
+        for row in self.bitmap:
+            print(' '.join(Character.SHADES[shade] for shade in row))
 
     def _validate(self):
         for c in self.message:
             assert(c in self.font.__class__.VALID_CHARS)
             
-    def _get_chars(self):  
-        self.chars = [self.font.get_char(c) for c in self.message] 
-        
     def _construct(self, spaces=1):
-        chars = self.chars
-        pixels = []
-        self.total_width = sum(c.width+spaces for c in chars)
-        n = len(chars)
-        for row in range(Message.ROWS):
-            for i in range(n):
-                segment = chars[i].get_row(row)
-                pixels.extend(segment + [self.WHITE_SPACE]*spaces)
-        self.pixels = pixels 
+        glyphs = np.array([self.font.index(c) for c in self.message], dtype=np.intp)
+        widths = self.font.widths[glyphs]
+        cells = widths + spaces
+        self.total_width = int(cells.sum())
+        # every glyph column: where it is in the atlas, where it goes in the bitmap
+        glyph = np.repeat(np.arange(len(glyphs)), widths)
+        col = np.arange(len(glyph)) - np.repeat(np.cumsum(widths) - widths, widths)
+        src = self.font.starts[glyphs][glyph] + col
+        dst = (np.cumsum(cells) - cells)[glyph] + col
+        self.bitmap = np.full((self.ROWS, self.total_width), self.WHITE_SPACE, dtype=np.uint8)
+        self.bitmap[:, dst] = self.font.atlas[:self.ROWS, src]
 
 class Marquee:
+    """
+    Scrolls a Message across an 8 pad wide window. Frames are (8, 8) views
+    into the message's bitmap, made as they are shown, so memory doesn't
+    grow with the text; set_message() swaps the text mid-scroll (a clock,
+    a score) and loop=True makes a ticker.
+    """
+    WINDOW_WIDTH = 8
     def __init__(self, message: str, font:Font=None, painter=None):
         if font is None:
-            font = Font(source_image=FONT_ITALIC_IMG)
+            font = Font.shared(FONT_ITALIC_IMG)
         self.font = font
-        self.message = Message(message, font) 
-        self.frames = []
         self.painter = painter
-        self._build_sequence() 
-
-    def _crop(self, offset, window_width=8):
-        cropped = []
-        for i in range(self.message.ROWS):
-            start = i*self.message.total_width + offset
-            segment = self.message.pixels[start:start+window_width]
-            cropped.extend(segment)
-        return cropped 
-     
-    def _build_sequence(self, window_width=8):
-        last = self.message.total_width - window_width
-        for offset in range(last):
-            frame = self._crop(offset)             
-            self.frames.append(frame)
-
-    def animate(self, fps=15, callback=lambda: None):
-        for frame in self.frames:
+        self._stop = threading.Event()
+        self.set_message(message)
+
+    def set_message(self, message):
+        """ Takes effect from the next frame, at the same scroll offset. """
+        message = Message(message, self.font)
+        bitmap = message.bitmap
+        short = self.WINDOW_WIDTH - bitmap.shape[1]
+        if short > 0:   # narrower than the window: nothing to scroll (len() is 0), but keep a view
+            bitmap = np.pad(bitmap, ((0, 0), (0, short)), constant_values=Message.WHITE_SPACE)
+        windows = sliding_window_view(bitmap, self.WINDOW_WIDTH, axis=1)
+        self.message, self._windows = message, windows
+
+    def __len__(self):
+        return max(0, self.message.total_width - self.WINDOW_WIDTH)
+
+    def frames(self, loop=False):
+        offset = 0
+        while not self._stop.is_set():
+            if offset >= len(self):
+                if not loop or not len(self):
+                    return
+                offset = 0
+            yield self._windows[:, offset]
+            offset += 1
+
+    def stop(self):
+        self._stop.set()
+
+    def animate(self, fps=15, callback=lambda: None, loop=False):
+        for frame in self.frames(loop):
             self.print_frame(frame)
             time.sleep(1/fps)
         return callback()
 
-    def print_frame(self, frame, width=8): # TODO: overwrite this method as sysex
+    def print_frame(self, frame): # TODO: overwrite this method as sysex
         if os.name == 'posix':
             os.system('clear')
         else:
             os.system('cls')
-        for i in range(8):
-            for j in range(width):
-                print(Character.SHADES[frame[i*width + j]], end=" ")
-            print()
-
+        for row in frame:
+            print(' '.join(Character.SHADES[shade] for shade in row))
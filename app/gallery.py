@@ -0,0 +1,180 @@
+import os
+import uuid
+import queue
+import pickle
+import sqlite3
+import atexit
+import threading
+import numpy as np
+from .canvas import Page
+from .config import STORAGE_PATH
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """ gallery_items.pickle refers to Page by its old home, app.launchpad """
+    def find_class(self, module, name):
+        if name == 'Page':
+            return Page
+        return super().find_class(module, name)
+
+
+class Gallery:
+    """
+    Page store backed by an append-only SQLite table: every save appends one
+    record (O(page) bytes, not O(gallery)), the newest record per page wins,
+    and compact() drops the superseded ones. Records are indexed by quick
+    slot (int page ids) and by UUID.
+
+    Nothing is read at construction: the database is opened on first use and
+    each page is read the first time it is asked for. Writes happen on a
+    background thread, so save() returns immediately and never holds up the
+    MIDI listener.
+    """
+    DATA_FILEPATH = os.path.join(STORAGE_PATH, 'gallery.sqlite3')
+    LEGACY_FILEPATH = os.path.join(STORAGE_PATH, 'gallery_items.pickle')
+    COMPACT_AFTER = 256   # saves between compactions
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            slot INTEGER,
+            uuid TEXT,
+            quick_id INTEGER,
+            rows INTEGER NOT NULL,
+            cols INTEGER NOT NULL,
+            channels INTEGER NOT NULL,
+            pixels BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS pages_slot ON pages(slot);
+        CREATE INDEX IF NOT EXISTS pages_uuid ON pages(uuid);
+    """
+    LATEST = 'SELECT max(seq) FROM pages GROUP BY slot, uuid'
+    INSERT = ('INSERT INTO pages (slot, uuid, quick_id, rows, cols, channels, pixels) '
+              'VALUES (?,?,?,?,?,?,?)')
+
+    def __init__(self, path=DATA_FILEPATH):
+        self.path = path
+        self.pages = {}         # pages read or saved so far
+        self._db = None
+        self._open_lock = threading.Lock()
+
+    def _open(self):
+        with self._open_lock:
+            if self._db is not None:
+                return
+            migrate = not os.path.exists(self.path)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            with db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.executescript(self.SCHEMA)
+            if migrate:
+                self._import_legacy(db)
+            self._db_lock = threading.Lock()
+            self._writes = queue.Queue()
+            self._saves = 0
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+            self._db = db
+
+    ###------------ record <=> page ------------###
+    @staticmethod
+    def _key(page_id):
+        if isinstance(page_id, uuid.UUID):
+            return None, str(page_id)
+        return page_id, None
+
+    @staticmethod
+    def _to_record(page):
+        slot, page_uuid = Gallery._key(page.id)
+        rows, cols = page.shape
+        channels = 3 if page.is_rgb else 1
+        return (slot, page_uuid, page.quick_id, rows, cols, channels,
+                page.pixels.tobytes())
+
+    @staticmethod
+    def _to_page(slot, page_uuid, quick_id, rows, cols, channels, pixels):
+        shape = (rows, cols, 3) if channels == 3 else (rows, cols)
+        page = Page(np.frombuffer(pixels, dtype=np.uint8).reshape(shape),
+                    quick_id=quick_id, rows=rows, cols=cols)
+        page.id = slot if page_uuid is None else uuid.UUID(page_uuid)
+        return page
+    ###------------ end record <=> page ------------###
+
+    def _read(self, page_id):
+        self._open()
+        with self._db_lock:
+            row = self._db.execute('SELECT slot, uuid, quick_id, rows, cols, channels, '
+                                'pixels FROM pages WHERE slot IS ? AND uuid IS ? '
+                                'ORDER BY seq DESC LIMIT 1', self._key(page_id)
+                                ).fetchone()
+        return None if row is None else self._to_page(*row)
+
+    def _import_legacy(self, db):
+        """
+        Copy the pickled gallery into a new database, in one transaction
+        before anything can read it (not through the writer, or the first
+        reads would miss pages that are on their way).
+        """
+        try:
+            with open(self.LEGACY_FILEPATH, 'rb') as f:
+                legacy = _LegacyUnpickler(f).load()
+        except FileNotFoundError:
+            return
+        with db:
+            db.executemany(self.INSERT, [self._to_record(page) for page in legacy.values()])
+
+    def _write_loop(self):
+        while True:
+            page = self._writes.get()
+            if page is None:
+                self._writes.task_done()
+                break
+            with self._db_lock, self._db:   # one transaction per record
+                self._db.execute(self.INSERT, self._to_record(page))
+            self._saves += 1
+            if self._saves >= self.COMPACT_AFTER:
+                self.compact()
+            self._writes.task_done()
+
+    def compact(self):
+        """
+        Drop records superseded by a newer save of the same page.
+        """
+        self._open()
+        with self._db_lock:
+            with self._db:
+                self._db.execute(f'DELETE FROM pages WHERE seq NOT IN ({self.LATEST})')
+            self._db.execute('VACUUM')
+        self._saves = 0
+
+    def flush(self):
+        """
+        Block until every queued save is on disk.
+        """
+        if self._db is not None:
+            self._writes.join()
+
+    def close(self):
+        if self._db is not None and self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join()
+
+    def save(self, page):
+        self._open()
+        self.pages[page.id] = page
+        self._writes.put(page)
+
+    def load(self, page_id):
+        self._open()
+        if page_id not in self.pages:
+            page = self._read(page_id)
+            if page is None:
+                raise KeyError(page_id)
+            self.pages[page_id] = page
+        return self.pages[page_id]
+
+    def __contains__(self, page_id):
+        try:
+            self.load(page_id)
+        except KeyError:
+            return False
+        return True
@@ -1,16 +1,24 @@
 import mido
 import re
 import threading
+import itertools
 import queue
-import pickle
-import uuid
-import copy
 import pygame
 import os
 import time
+import numpy as np
 from . import fonts
 from . import ddr
 from . import config
+from . import midi_io
+from . import sysex
+from . import samples
+from . import mixer
+from . import replay
+from . import calibration
+from . import animation
+from .canvas import Page
+from .gallery import Gallery
 
 
 ###------------ helper functions ------------###
@@ -54,17 +62,21 @@ def build_padmap(start=81, stop=1, step=-10, cols=8):
 # todo: build synthesizer w/gui ...use numpy
 
 class SysexMarquee(fonts.Marquee):
-    SHADES = [4,5,6,7,0]
+    SHADES = np.array([4,5,6,7,0], dtype=np.uint8)
+    def page(self, frame):
+        return Page(self.SHADES[frame].ravel().tolist())
+    def pages(self, loop=False):
+        return map(self.page, self.frames(loop))
     def print_frame(self, frame):
-        frame = [self.SHADES[i] for i in frame]
-        self.painter.send_sysex(Page(frame))
+        self.painter.send_sysex(self.page(frame))
 
 class State:
     QUICK_SLOTS = [19,29,39,49,59,69,79,89]
-    CONTROL_KEYS = list(range(101,109)) + list(range(10,81,10))
-    CTRL = {'marquee':101, 'ddr': 102, 'ddr_auto': 103, 'load':106,
+    CONTROL_KEYS = list(range(101,109)) + list(range(10,81,10)) + list(range(91,95))
+    CTRL = {'marquee':101, 'ddr': 102, 'ddr_auto': 103, 'calibrate': 104, 'load':106,
             'save':107, 'palette':108, 'brush_tool':10 ,'bucket_tool':20,
-            'animate_gallery': 80,}
+            'animate_gallery': 80, 'up': 91, 'down': 92, 'left': 93,
+            'right': 94,}
     def __init__(self, painter):
         self.painter = painter      # shortcut to controller objects (painter/sampler)
         self.sampler = painter.sampler
@@ -82,7 +94,7 @@ class State_LoadPending(State):
     def action(self, msg):
         if not msg.is_cc() or msg.control not in self.QUICK_SLOTS:
             return
-        if msg.control not in self.painter.gallery.pages:
+        if msg.control not in self.painter.gallery:
             self.painter.gallery.pages[msg.control] = Page([0]*64)
         self.painter.load_canvas(id=msg.control)    
         self.new_state(State_Canvas)
@@ -140,6 +152,22 @@ class State_DDR(State):
         self.painter.switch_to_canvas() # todo: set up a thread remote for ddr feed
         self.new_state(State_Canvas)
 
+class State_Calibrate(State):
+    """
+    While a calibration.Calibrator runs: pad presses are its taps, and
+    device replies go to it. It puts the painter back on the canvas; the
+    calibrate or ddr (stop) button cancels it.
+    """
+    CANCEL = (State.CTRL['calibrate'], State.CTRL['ddr'])
+    def action(self, msg):
+        if self.is_cc_press(msg):
+            if msg.control in self.CANCEL:
+                self.painter.calibrator.cancel()
+        elif self.is_pad_press(msg):
+            self.sampler.play_note(self.painter.rev_padmap[msg.note])
+        elif msg.type == 'sysex':
+            self.painter.calibrator.on_message(msg)
+
 class State_ChooseDDRSong:
     # TODO: select from a gui menu the song to be played
     def to_ddr(self):
@@ -147,11 +175,13 @@ class State_ChooseDDRSong:
 
 class Song:
     SONGS = { }
-    def __init__(self, name, bpm, sample_dir='voice_plucks', time_signature=(4,4)):
+    def __init__(self, name, bpm, sample_dir='voice_plucks', time_signature=(4,4),
+                    start_tick=0):
         self.name = name
-        self.bpm = bpm
+        self.bpm = bpm      # until the midi file's first tempo change
         self.sample_dir = sample_dir
         self.time_signature = time_signature 
+        self.start_tick = start_tick # midi lead-in the backing track doesn't have
         self._register()
     def _register(self):
         Song.SONGS[self.name] = self
@@ -160,7 +190,7 @@ class Song:
     def get_metadata(cls, name):
         return cls.SONGS[name]
 
-Song('ddr_test', bpm=120, sample_dir='voice_plucks')
+Song('ddr_test', bpm=120, sample_dir='voice_plucks', start_tick=30720)
 Song('fallen_down', bpm=110, sample_dir='voice_plucks', time_signature=(3,4))
 Song('mario_theme', bpm=90, sample_dir='dumb')
 
@@ -174,9 +204,14 @@ class State_Canvas(State):
             State.CTRL['marquee']: ('State_Canvas', 'marquee', ()),
             State.CTRL['ddr']: ('State_DDR', 'to_ddr', ()), # TODO: fix state
             State.CTRL['ddr_auto']: ('State_DDR', 'to_ddr_auto', ()), 
+            State.CTRL['calibrate']: ('State_Calibrate', 'to_calibrate', ()),
             State.CTRL['brush_tool']: ('State_Canvas', 'switch_tool', ('brush',)),
             State.CTRL['bucket_tool']: ('State_Canvas', 'switch_tool', ('bucket',)),
             State.CTRL['animate_gallery']:('State_Canvas', 'animate_gallery', ()),
+            State.CTRL['up']: ('State_Canvas', 'scroll', (0, -1)),
+            State.CTRL['down']: ('State_Canvas', 'scroll', (0, 1)),
+            State.CTRL['left']: ('State_Canvas', 'scroll', (-1, 0)),
+            State.CTRL['right']: ('State_Canvas', 'scroll', (1, 0)),
             }
     tools = {'brush':'paint', 'bucket':'flood_fill'}
     current_tool = 'brush'
@@ -191,8 +226,9 @@ class State_Canvas(State):
                 newstate, transition, args = self.rule.get(msg.control,
                                                 ('State_Canvas', 'no_action', ()))
                 transition_func = getattr(self, transition)
-                transition_func(*args)
+                # switch first: a transition's thread (ddr, calibration) may move on from it
                 self.new_state(eval(newstate))
+                transition_func(*args)
     def to_palette(self):
         self.painter.switch_to_palette(0)
     def marquee(self):
@@ -201,46 +237,18 @@ class State_Canvas(State):
         self.painter.animate_gallery()
     def switch_tool(self, tool):
         self.current_tool = tool
+    def scroll(self, dx, dy):
+        self.painter.scroll_canvas(dx, dy)
     def to_ddr(self):
         self.painter.play_ddr_minigame(self.song, rate=1, autoplay=False)
     def to_ddr_auto(self):
         self.painter.play_ddr_minigame(self.song, rate=1, autoplay=True)
+    def to_calibrate(self):
+        self.painter.calibrate()
     def no_action(self):
         pass
 
 
-class Page:
-    def __init__(self,colors, quick_id = None):
-        self.colors = colors
-        self.id = uuid.uuid1()
-        self.quick_id = quick_id
-
-    def edit(self, index, color):
-        self.colors[index] = color
-
-    def get_color(self, index):
-        return self.colors[index]
-
-class Gallery:
-    DATA_FILEPATH = os.path.join(config.ASSETS_PATH, 'storage',
-                                                    'gallery_items.pickle')
-    def __init__(self):
-        try:
-            with open(self.DATA_FILEPATH, 'rb') as f:
-                pages = pickle.load(f) 
-        except FileNotFoundError:
-            pages = {}
-        self.pages = pages
-
-    def save(self, page):
-        self.pages[page.id] = page
-        with open(self.DATA_FILEPATH, 'wb') as f: 
-            pickle.dump(self.pages, f)
-
-    def load(self, page_id):
-        return self.pages[page_id]
-
-
 PADMAP = build_padmap()
 REV_PADMAP = {v:k for k,v  in PADMAP.items()}
 
@@ -250,12 +258,31 @@ class Sampler:
     SAMPLE_ROOT = os.path.join(config.ASSETS_PATH, 'samples')
     SAMPLE_PACKS = { }
 
-    def __init__(self, sample_dir):
+    PCM_CACHE = os.path.join(config.STORAGE_PATH, 'pcm')
+    MEMORY_BUDGET = samples.SampleCache.MEMORY_BUDGET
+
+    def __init__(self, sample_dir, engine='pygame', block_size=256, voices=32):
+        """
+        engine: 'pygame' plays each hit on a pygame channel, 'numpy' mixes
+        all voices through mixer.Mixer with the given block size and
+        polyphony.
+        """
         pygame.mixer.init()
-        pygame.mixer.set_num_channels(32)
-        self.loaded_packs = { }
-        self.load_samples(sample_dir)
+        pygame.mixer.set_num_channels(voices)
+        self.mixer = None
+        if engine == 'numpy':
+            rate, _, channels = pygame.mixer.get_init()
+            self.mixer = mixer.Mixer(rate, channels, block_size=block_size, voices=voices)
+            self.mixer_stream = mixer.MixerStream(self.mixer)
+        self.cache = samples.SampleCache(self.SAMPLE_ROOT, budget=self.MEMORY_BUDGET,
+                                            pcm_cache=self.PCM_CACHE,
+                                            on_evict=self._unload_pack if self.mixer else None)
+        self.MISS_SOUND = None
+        self.cache.load_sound(os.path.join(self.SAMPLE_ROOT, 'boo.wav')
+                                ).add_done_callback(self._set_miss_sound)
+        self.remap(list(range(64)))  # todo: maybe do a better mapping here
         self.input_q = queue.Queue()
+        self.loading = self.load_samples(sample_dir)
 
     def load_backing_track(self, fname='mario_theme'):
         pygame.mixer.music.load(os.path.join(config.ASSETS_PATH,
@@ -263,26 +290,36 @@ class Sampler:
 
     def load_samples(self, sample_dir):
         """
-        Load samples from disk into memory.
+        Make sample_dir the current pack, decoding it in the background
+        unless it is already cached. Returns a Future for the pack; notes
+        are silent until it is done.
         """
-        paths = os.scandir(os.path.join(self.SAMPLE_ROOT, sample_dir))
-        self.MISS_SOUND = pygame.mixer.Sound(os.path.join(self.SAMPLE_ROOT, 'boo.wav'))
-        sample_pack = { }
-        for path in paths:
-            note = int(path.name.split('.')[0])
-            sound = pygame.mixer.Sound(path.path)
-            sample_pack[note] = sound
-        self.remap(list(range(64)))  # todo: maybe do a better mapping here
-        self.loaded_packs[sample_dir] = sample_pack
         self.current_sample_pack = sample_dir
+        loading = self.cache.load(sample_dir)
+        loading.add_done_callback(lambda loading: self._check_load(sample_dir, loading))
+        return loading
+
+    def _check_load(self, sample_dir, loading):
+        if loading.exception():
+            print('failed to load sample pack:', loading.exception())
+        elif self.mixer and sample_dir in self.cache:  # not evicted already
+            for note, sound in loading.result().items():
+                self.mixer.load((sample_dir, note), mixer.sound_to_pcm(sound))
+
+    def _unload_pack(self, sample_dir, pack):
+        self.mixer.unload((sample_dir, note) for note in pack)
+
+    def _set_miss_sound(self, loading):
+        self.MISS_SOUND = loading.result()
+        if self.mixer:
+            self.mixer.load('miss', mixer.sound_to_pcm(self.MISS_SOUND))
 
     def switch_sample_pack(self, sample_dir):
         """
         Switch Sampler to an already loaded sample pack.
         """
-        sample_pack = self.loaded_packs.get(sample_dir)
-        if sample_pack:
-            self.current_sample_pack = sample_pack
+        if sample_dir in self.cache:
+            self.current_sample_pack = sample_dir
         else:
             raise RuntimeError(f'Tried to switch to an unloaded sample pack:{sample_dir}')
 
@@ -296,13 +333,19 @@ class Sampler:
             pass
 
     def play_midi_note(self, note):
-        sample_pack = self.loaded_packs[self.current_sample_pack]
+        sample_pack = self.cache.get(self.current_sample_pack)
+        if sample_pack is None:     # still loading
+            return
+        if self.mixer:
+            key = (self.current_sample_pack, note) if note in sample_pack else 'miss'
+            self.mixer.note_on(key)
+            return
         sound = sample_pack.get(note, self.MISS_SOUND)
         if sound:
             sound.play()
 
     def play_note(self, pad_index):
-        t = time.time()
+        t = time.perf_counter() # same clock as ddr's FrameClock
         self.input_q.put({'type':'hit', 'pad_index': pad_index,
                             'time': t})
 
@@ -311,19 +354,28 @@ class Sampler:
             self.PAD_TO_MIDI[i] = notes[i] 
 
 class Painter:
+    CANVAS_SIZE = (8, 8) # (rows, cols) of the drawing sheet, the pads show an 8x8 window
+    JOIN_TIMEOUT = 1.0
     gallery = Gallery()
     def __init__(self):
         self._init_connections()
+        self.inputs = midi_io.InputMux(self.inports)
         self.padmap = PADMAP
         self.rev_padmap = REV_PADMAP
+        self.frame_diff = sysex.FrameDiff(self.padmap)
+        self.animator = animation.Animator(self._send_page)
         self.msg = None
         self.listen_remote = threading.Event()
         self.current_color = 69
-        self.current_page = Page([0]*64)
-        self.canvas = Page([0]*64)
+        self.sheet = Page.blank(0, *self.CANVAS_SIZE)
+        self.view_x, self.view_y = 0, 0
+        self.canvas = self.sheet.window(self.view_x, self.view_y)
+        self.current_page = self.canvas
         self.palettes = [Page([i for i in range(64)]),
                         Page([i for i in range(64,128)])]
-        self.sampler = Sampler('dumb')
+        self.sampler = self._init_sampler()
+        self.device = self._device_name()
+        self.offsets = calibration.load(self.device)
         self.state = State(self)
         self.run()
 
@@ -331,41 +383,57 @@ class Painter:
         set_programmer_mode(open_output())
         self.outport = open_output()
         self.port = open_input()
+        self.inports = [self.port]
         
-    def __del__(self):
-        self.outport.close()
-        self.port.close()
+    def _init_sampler(self):
+        return Sampler('dumb')
+
+    def _device_name(self):
+        """ what the device's calibration is stored under """
+        return self.outport.name or type(self).__name__
 
     def stop(self):
+        """ Stop listening and animating, then close the ports. """
         self.listen_remote.set()
+        self.animator.stop()
+        self.inputs.close()     # joins the threads reading the inports first
+        if self._listener is not threading.current_thread():
+            self._listener.join(self.JOIN_TIMEOUT)
+        self._close_ports()
+
+    def _close_ports(self):
+        self.outport.close()
+        for port in self.inports:
+            port.close()
 
     def _send_msg(self, msg):
         self.outport.send(msg)
 
     def send_note(self, msg):
-        self._send_msg(msg)
+        """ Goes through the animator too; returns whether it was sent. """
+        return self.animator.send(self._send_msg, msg)
 
-    def scroll_text(self, text, fps=20):
-        callback = self.switch_to_canvas
+    def scroll_text(self, text, fps=20, loop=False):
+        """
+        Scrolls text across the pads until it ends (or a pad or button is
+        pressed), then shows the current page again. Returns the animation.Clip.
+        """
         text = SysexMarquee(message=text, painter=self)
-        t = threading.Thread(target=text.animate, args=(fps, callback))
-        t.start()
+        clip = animation.Clip(text.pages(loop), fps=fps, priority=animation.MARQUEE,
+                            name='marquee', interruptible=True,
+                            on_done=self.switch_to_current_page)
+        return self.animator.play(clip, replace=True)
 
     def store_animation(self):
         pass
 
-    def animate_gallery(self, duration=1/15):
+    def animate_gallery(self, fps=15, loops=10):
         frame_sequence = [19,29,39,49,59,69,79,89]
-        pages = (self.gallery.load(page_id) for page_id in frame_sequence)
-        frames = [self._build_sysex(page.colors) for page in pages]
-        def animate(loops=10):
-            for _ in range(loops): 
-                for sysex_frame_msg in frames:
-                    self._send_msg(sysex_frame_msg)
-                    time.sleep(duration)
-            self.switch_to_canvas()
-        t = threading.Thread(target=animate)
-        t.start()
+        frames = [self.gallery.load(page_id) for page_id in frame_sequence]
+        clip = animation.Clip(itertools.chain.from_iterable(itertools.repeat(frames, loops)),
+                            fps=fps, priority=animation.GALLERY, name='gallery',
+                            interruptible=True, on_done=self.switch_to_current_page)
+        return self.animator.play(clip, replace=True)
 
     def as_page(self, colors):
         return Page(colors)
@@ -376,31 +444,93 @@ class Painter:
 
     def play_ddr_minigame(self, song:Song, rate=1, autoplay=False):
         self.play_track = ddr.PlayTrack(song.name + '.mid', bpm=song.bpm,
-                                        time_signature=song.time_signature, painter=self)
+                                        time_signature=song.time_signature, painter=self,
+                                        start_tick=song.start_tick)
         self.sampler.load_backing_track(song.name)
-        if song.sample_dir:
-            self.sampler.load_samples(song.sample_dir)
-        t = threading.Thread(target=self.play_track.play, args=(rate, autoplay))
+        loading = self.sampler.load_samples(song.sample_dir) if song.sample_dir else None
+        def play():
+            if loading:
+                try:
+                    loading.result()    # don't start the song on a half-loaded pack
+                except Exception as e:
+                    print(f'could not load {song.sample_dir}: {e}')
+                    self.play_track.stop_listening()
+                    self.state.new_state(State_Canvas)
+                    self.switch_to_canvas()
+                    return
+            recorder = replay.Recorder()
+            # the song paces its own frames: hold the device for its send_frame()s
+            self.animator.interrupt()
+            hold = self.animator.hold(animation.GAME, name='ddr', on_done=self.switch_to_canvas)
+            try:
+                result = self.play_track.play(rate, autoplay, recorder=recorder,
+                                                offsets=self.offsets)
+            finally:
+                hold.end()
+            if result is not None:   # finished, not stopped early
+                recorder.save(replay.recording_path(song.name), self.play_track, result)
+        t = threading.Thread(target=play)
         t.start()
         print('playing ddr minigame...')
         
+    def calibrate(self):
+        """
+        Measure this device's audio, visual and input offsets (see
+        calibration.Calibrator); DDR uses them from the next song on.
+        """
+        self.calibrator = calibration.Calibrator(self, self.device, self.offsets)
+        self.animator.interrupt()   # its flashes have to show
+        def run():
+            offsets = self.calibrator.run()
+            if offsets is not None:     # None: cancelled
+                self.offsets = offsets
+            self.state.new_state(State_Canvas)
+            self.switch_to_canvas()
+        t = threading.Thread(target=run)
+        t.start()
+        print('calibrating...')
+
     def send_sysex(self, page, mode=0):
         """ 
-        builds and sends a sysex msg for a page
+        sends a page, only the pads that differ from what the device shows.
+        Like the other sends, it goes through the animator: nothing is sent
+        while an animation is showing.
         """
+        return self.animator.send(self._send_page, page, mode)
+
+    def _send_page(self, page, mode=0):
         assert(len(page.colors) == 64)
-        msg = self._build_sysex(page.colors, mode)
-        self._send_msg(msg)
+        if page.is_rgb:
+            mode = sysex.MODE_RGB
+        for msg in self.frame_diff.encode(page.colors, mode):
+            self._send_msg(msg)
+
+    def send_frame(self, colors, data=None):
+        """
+        sends 64 palette colors, data: the same frame prebuilt by sysex.build_frames
+        """
+        return self.animator.send(self._send_frame, colors, data)
+
+    def _send_frame(self, colors, data):
+        for msg in self.frame_diff.encode(colors, sysex.MODE_PALETTE, full=data):
+            self._send_msg(msg)
+
+    def send_pads(self, page, pad_indices):
+        """
+        sends only the given pads of a page
+        """
+        return self.animator.send(self._send_pads, page, pad_indices)
+
+    def _send_pads(self, page, pad_indices):
+        mode = sysex.MODE_RGB if page.is_rgb else sysex.MODE_PALETTE
+        for msg in self.frame_diff.encode(page.colors, mode, pads=pad_indices):
+            self._send_msg(msg)
     
     def _build_sysex(self, data, mode=0):
-        bytes = [0, 32, 41, 2, 14, 3] #sysex RGB preamble
-        for i in range(64):
-            spec = [mode, self.padmap[i], data[i]]
-            bytes.extend(spec)
-        return mido.Message('sysex', data=bytes)
+        return self.frame_diff.frames[mode].build(data)
 
     def fill_page(self, color):
-        self.canvas = Page([color for i in range(64)])
+        self.canvas.fill(color)
         self.switch_to_canvas()
 
     def clear_page(self):
@@ -414,6 +544,18 @@ class Painter:
         self.current_page = self.canvas
         self.switch_to_current_page()
 
+    def scroll_canvas(self, dx, dy):
+        """
+        Move the 8x8 window across the sheet (no-op on an 8x8 sheet).
+        """
+        rows, cols = self.sheet.shape
+        self.view_x = max(0, min(cols - 8, self.view_x + dx))
+        self.view_y = max(0, min(rows - 8, self.view_y + dy))
+        on_canvas = self.current_page is self.canvas
+        self.canvas = self.sheet.window(self.view_x, self.view_y)
+        if on_canvas:
+            self.switch_to_canvas()
+
     def switch_to_current_page(self):
         self.send_sysex(self.current_page)
 
@@ -426,48 +568,44 @@ class Painter:
         out_midi_note = self.padmap[pad_index]
         out_msg = mido.Message('note_on', note=out_midi_note,
                                 velocity=color)
-        self.send_note(out_msg)
+        if self.send_note(out_msg):     # else the canvas is redrawn once the clip ends
+            self.frame_diff.mark(pad_index, color)
 
     def _edit_canvas(self, pad_index, color):
         self.canvas.edit(pad_index, color)
 
     def flood_fill(self):
         pad_index = self.rev_padmap[self.msg.note]
-        cover_color = self.canvas.get_color(pad_index)
-        if self.current_color == cover_color:
-            return
-        self._flood_fill(pad_index, cover_color, visited=set())
-        self.switch_to_current_page()
-
-    def _flood_fill(self, pad_index, cover_color, visited):
-        self._edit_canvas(pad_index, self.current_color)
         row, col = divmod(pad_index, 8)
-        neighbors = set([(row-1, col), (row+1, col), (row, col-1), (row, col+1)])
-        for r, c in neighbors - visited:
-            if 0 <= r < 8 and 0 <= c < 8:
-                visited.add((r,c))
-                neighbor_index = r*8 + c
-                neighbor_color = self.canvas.get_color(neighbor_index)
-                if neighbor_color != cover_color:
-                    continue
-                self._flood_fill(neighbor_index, cover_color, visited)
+        touched = self.sheet.flood_fill((row + self.view_y, col + self.view_x),
+                                        self.current_color)
+        self.send_pads(self.canvas, self._visible_pads(touched))
+
+    def _visible_pads(self, sheet_indices):
+        """
+        sheet flat indices => pad indices of the ones inside the window
+        """
+        rows, cols = divmod(np.asarray(sheet_indices), self.sheet.shape[1])
+        rows, cols = rows - self.view_y, cols - self.view_x
+        visible = (rows >= 0) & (rows < 8) & (cols >= 0) & (cols < 8)
+        return rows[visible]*8 + cols[visible]
 
     def select_color(self):
         pad_index = self.rev_padmap[self.msg.note]
-        self.current_color = self.current_page.colors[pad_index]
+        self.current_color = self.current_page.get_color(pad_index)
 
     def save_canvas(self, id):
-        page = copy.deepcopy(self.canvas)
+        page = self.canvas.copy()
         page.id = id
         self.gallery.save(page)
 
     def load_canvas(self, id):
-        self.canvas = copy.deepcopy(self.gallery.load(page_id=id))
+        self.canvas.blit(self.gallery.load(page_id=id))
         self.current_page = self.canvas
         self.switch_to_current_page()
 
     def receive(self):
-        return self.port.receive()
+        return self.inputs.receive()
 
     def listen(self):
         while not self.listen_remote.is_set():
@@ -476,13 +614,17 @@ class Painter:
                 continue
             if self.msg.type == 'clock':
                 continue
+            if self.state.is_pad_press(self.msg) or self.state.is_cc_press(self.msg):
+                # e.g. stop the marquee, then paint or change state: a clip
+                # showing would hold back the new state's page
+                self.animator.interrupt()
             self.state.action(self.msg)
         print('painter stopped listening.')
         self.listen_remote.clear()
 
     def run(self):
-        listener = threading.Thread(target = self.listen, args = ())
-        listener.start()
+        self._listener = threading.Thread(target = self.listen, args = ())
+        self._listener.start()
         self.switch_to_current_page()
         self.scroll_text(text='Welcome!', fps=25)
 
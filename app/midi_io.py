@@ -0,0 +1,229 @@
+import mido
+import queue
+import threading
+import collections
+
+
+class VirtualOutport(mido.ports.BaseOutput):
+    def __init__(self, *args, outbox=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbox = outbox
+    def _send(self, msg):
+        self.outbox.put(msg)
+
+class MessageRing:
+    """
+    Bounded message queue between a painter and an emulated device, in
+    place of an unbounded queue.Queue (it has the same put/get calls, so
+    the virtual ports take either).
+
+    Once maxsize messages are waiting the oldest note/control change is
+    dropped to make room. Sysex is never dropped (the device would miss a
+    whole frame and FrameDiff's idea of what it shows would go stale): a
+    sysex put on a ring full of sysex waits for room like queue.Queue.put,
+    and a note put on one is dropped itself. With coalesce,
+    a note_on/note_off/control_change for an LED that already has one
+    waiting replaces it, so a burst of sends leaves only the latest state
+    per pad; any other message (a sysex frame) is a barrier nothing is
+    coalesced across. Don't coalesce presses: a release would swallow its
+    press.
+
+    drain() takes everything waiting at once, for a consumer that applies
+    a batch per frame.
+    """
+    COALESCED = ('note_on', 'note_off', 'control_change')
+
+    def __init__(self, maxsize=1024, coalesce=False):
+        self.maxsize = maxsize
+        self.coalesce = coalesce
+        self._slots = collections.deque()   # [key, msg]
+        self._latest = { }                  # LED number => its waiting slot
+        self._cond = threading.Condition()
+        self.received = 0
+        self.dropped = 0        # pushed out by a full ring
+        self.coalesced = 0      # replaced by a newer state for the same LED
+        self.blocked = 0        # sysex puts that waited for room
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def qsize(self):
+        return len(self._slots)
+
+    def empty(self):
+        return not self._slots
+
+    def put(self, msg, block=True, timeout=None):
+        """
+        Only blocks for sysex, when every waiting message is sysex too;
+        raises queue.Full if there's still no room after timeout.
+        """
+        with self._cond:
+            self.received += 1
+            key = None
+            if self.coalesce:
+                if msg.type in self.COALESCED:
+                    key = msg.control if msg.type == 'control_change' else msg.note
+                    slot = self._latest.get(key)
+                    if slot is not None:
+                        slot[1] = msg
+                        self.coalesced += 1
+                        return
+                else:
+                    self._latest.clear()
+            if len(self._slots) >= self.maxsize and not self._make_room(msg, block, timeout):
+                return
+            slot = [key, msg]
+            self._slots.append(slot)
+            if key is not None:
+                self._latest[key] = slot
+            self.max_depth = max(self.max_depth, len(self._slots))
+            self._cond.notify_all()
+
+    def put_nowait(self, msg):
+        self.put(msg, block=False)
+
+    def _make_room(self, msg, block, timeout):
+        """ Called full, with the lock held. False if msg is to be dropped. """
+        for i, slot in enumerate(self._slots):
+            if slot[1].type != 'sysex':
+                del self._slots[i]
+                self._forget(slot)
+                self.dropped += 1
+                return True
+        if msg.type != 'sysex':
+            self.dropped += 1
+            return False
+        self.blocked += 1
+        if not (block and self._cond.wait_for(lambda: len(self._slots) < self.maxsize, timeout)):
+            raise queue.Full
+        return True
+
+    def _forget(self, slot):
+        if slot[0] is not None and self._latest.get(slot[0]) is slot:
+            del self._latest[slot[0]]
+        return slot[1]
+
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if block and not self._cond.wait_for(lambda: self._slots, timeout):
+                raise queue.Empty
+            if not self._slots:
+                raise queue.Empty
+            self._cond.notify_all()     # a sysex put may be waiting for room
+            return self._forget(self._slots.popleft())
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self, timeout=None):
+        """
+        Every message waiting, oldest first (first waiting up to timeout for
+        one, if given); [] if none.
+        """
+        with self._cond:
+            if timeout:
+                self._cond.wait_for(lambda: self._slots, timeout)
+            msgs = [slot[1] for slot in self._slots]
+            self._slots.clear()
+            self._latest.clear()
+            self._cond.notify_all()
+            return msgs
+
+    def stats(self):
+        return {'depth': len(self._slots), 'max_depth': self.max_depth,
+                'received': self.received, 'dropped': self.dropped,
+                'coalesced': self.coalesced, 'blocked': self.blocked}
+
+
+class VirtualInport(mido.ports.BaseInput):
+    BLOCK_TIMEOUT = 0.1     # lets close() grab the port lock during receive()
+    def __init__(self, *args, inbox=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inbox = inbox
+    def _receive(self, block=True):
+        try:
+            return self.inbox.get(block=block, timeout=self.BLOCK_TIMEOUT)
+        except queue.Empty:
+            return None
+    def drain(self):
+        """ Everything waiting on a MessageRing inbox, in one batch. """
+        return self.inbox.drain()
+
+class InputMux:
+    """
+    Merges any number of input ports into a single blocking stream.
+
+    Ports with a callback hook (the rtmidi backend) push straight into the
+    shared queue from the driver thread; any other port gets a reader thread
+    blocked on port.receive(). Either way receive() sleeps until a message
+    arrives on *some* port, instead of polling each one in turn.
+    """
+    WAKE = object()     # sentinel pushed by wake()/close()
+    JOIN_TIMEOUT = 1.0
+
+    def __init__(self, ports=()):
+        self._q = queue.Queue()
+        self.ports = []
+        self._threads = []
+        self.closed = False
+        for port in ports:
+            self.add_port(port)
+
+    def add_port(self, port):
+        if hasattr(port, 'callback'):
+            port.callback = self._q.put
+        else:
+            t = threading.Thread(target=self._pump, args=(port,), daemon=True)
+            t.start()
+            self._threads.append(t)
+        self.ports.append(port)
+
+    def _pump(self, port):
+        try:
+            for msg in port:
+                if self.closed:
+                    break
+                self._q.put(msg)
+        except (OSError, ValueError):   # port closed under us
+            pass
+
+    def receive(self, timeout=None):
+        """
+        Block until a message arrives on any port. Returns None on timeout
+        or when woken up by wake()/close().
+        """
+        try:
+            msg = self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if msg is self.WAKE:
+            return None
+        return msg
+
+    def wake(self):
+        """
+        Unblock a pending receive() without delivering a message.
+        """
+        self._q.put(self.WAKE)
+
+    def close(self):
+        """
+        Stop reading and wake any pending receive(). Ports without a callback
+        hook are closed too, since that is the only way to unblock their
+        reader threads, and those threads are joined: none is left holding
+        a port's lock (in receive()) for whoever closes the ports next.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for port in self.ports:
+            if hasattr(port, 'callback'):
+                port.callback = None
+            else:
+                port.close()
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(self.JOIN_TIMEOUT)
+        self.wake()
@@ -0,0 +1,153 @@
+import time
+import wave
+import threading
+import numpy as np
+import pygame
+
+
+class Mixer:
+    """
+    Software mixer: samples are float32 (frames, channels) arrays, active
+    voices are summed a block at a time, and when every voice is busy the
+    oldest one is stolen (lowest voice index on ties), so the same input
+    always renders the same output.
+    """
+    def __init__(self, rate=44100, channels=2, block_size=256, voices=32, gain=0.5):
+        self.rate = rate
+        self.channels = channels
+        self.block_size = block_size
+        self.gain = gain
+        self.samples = { }
+        self.voice_sample = [None]*voices
+        self.voice_pos = np.zeros(voices, dtype=np.int64)  # < 0: frames until start
+        self.voice_gain = np.zeros(voices, dtype=np.float32)
+        self.voice_started = np.zeros(voices, dtype=np.int64)
+        self.frame = 0      # frames rendered so far
+        self.notes_played = 0
+        self.stolen = 0
+        self._triggers = 0
+        self._lock = threading.Lock()
+        self._out = np.zeros((block_size, channels), dtype=np.float32)
+
+    @property
+    def latency(self):
+        return self.block_size / self.rate
+
+    def load(self, key, pcm):
+        self.samples[key] = pcm
+
+    def unload(self, keys):
+        """
+        Forget samples; voices already playing them finish normally.
+        """
+        for key in keys:
+            self.samples.pop(key, None)
+
+    def note_on(self, key, velocity=1.0, offset=0):
+        """
+        Start sample key offset frames into the next block.
+        """
+        pcm = self.samples.get(key)
+        if pcm is None:
+            return
+        with self._lock:
+            free = [i for i, s in enumerate(self.voice_sample) if s is None]
+            if free:
+                voice = free[0]
+            else:
+                voice = int(np.argmin(self.voice_started))
+                self.stolen += 1
+            self._triggers += 1
+            self.voice_sample[voice] = pcm
+            self.voice_pos[voice] = -offset
+            self.voice_gain[voice] = velocity
+            self.voice_started[voice] = self._triggers
+            self.notes_played += 1
+
+    def render_block(self):
+        out = self._out
+        out[:] = 0
+        n = self.block_size
+        with self._lock:
+            for voice, pcm in enumerate(self.voice_sample):
+                if pcm is None:
+                    continue
+                pos = int(self.voice_pos[voice])
+                start = max(0, -pos)
+                chunk = pcm[max(0, pos):max(0, pos + n)]
+                out[start:start + len(chunk)] += chunk * self.voice_gain[voice]
+                pos += n
+                self.voice_pos[voice] = pos
+                if pos >= len(pcm):
+                    self.voice_sample[voice] = None
+            self.frame += n
+        np.clip(out * self.gain, -1.0, 1.0, out=out)
+        return out
+
+    def render(self, events, duration=None):
+        """
+        Offline render. events: (seconds, key[, velocity]) tuples.
+        Returns a float32 (frames, channels) array.
+        """
+        events = sorted(events, key=lambda e: e[0])
+        if duration is None:
+            tail = max((len(self.samples[e[1]]) for e in events if e[1] in self.samples),
+                        default=0)
+            duration = (events[-1][0] if events else 0) + tail / self.rate
+        n_blocks = int(np.ceil(duration * self.rate / self.block_size))
+        blocks = np.zeros((n_blocks, self.block_size, self.channels), dtype=np.float32)
+        i = 0
+        for b in range(n_blocks):
+            block_end = self.frame + self.block_size
+            while i < len(events) and round(events[i][0]*self.rate) < block_end:
+                at = round(events[i][0]*self.rate)
+                self.note_on(events[i][1], *events[i][2:], offset=max(0, at - self.frame))
+                i += 1
+            blocks[b] = self.render_block()
+        return blocks.reshape(-1, self.channels)
+
+    def render_to_wav(self, path, events, duration=None):
+        pcm = self.render(events, duration)
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(self.channels)
+            f.setsampwidth(2)
+            f.setframerate(self.rate)
+            f.writeframes((pcm * 32767).astype('<i2').tobytes())
+        return pcm
+
+class MixerStream:
+    """
+    Real-time output for a Mixer: keeps one pygame channel fed with
+    rendered blocks, at most one block queued ahead.
+    """
+    def __init__(self, mixer, channel_id=0):
+        self.mixer = mixer
+        self.channel = pygame.mixer.Channel(channel_id)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        poll = self.mixer.latency / 4
+        while not self._stop.is_set():
+            if self.channel.get_queue() is None:
+                block = (self.mixer.render_block() * 32767).astype(np.int16)
+                sound = pygame.mixer.Sound(buffer=block.tobytes())
+                if self.channel.get_busy():
+                    self.channel.queue(sound)
+                else:
+                    self.channel.play(sound)
+            time.sleep(poll)
+
+    def stop(self):
+        self._stop.set()
+
+def sound_to_pcm(sound):
+    """
+    pygame Sound => float32 (frames, channels) in -1..1
+    """
+    samples = pygame.sndarray.array(sound)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    scale = float(np.iinfo(samples.dtype).max) if samples.dtype.kind in 'iu' else 1.0
+    return samples.astype(np.float32) / scale
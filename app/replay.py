@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Record DDR sessions and replay them without a device, on simulated time.
+
+    python -m app.replay recording.npz [...]
+
+Replays each recording as fast as the playback path allows, then reports
+frames/sec, hit judging latency and any difference from the recorded score.
+Exits non-zero if a score differs.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import concurrent.futures
+import numpy as np
+from . import ddr
+from . import sysex
+from . import scheduler
+from .config import STORAGE_PATH
+from .scheduler import percentile
+
+REPLAY_DIR = os.path.join(STORAGE_PATH, 'replays')
+VERSION = 4  # 2: charts keep the last segment (midi_segmenter), 3: start_tick,
+             # 4: PlayTrack.chart_params
+HIT = 0
+FRAME = 1
+EVENT = np.dtype([('t', '<f8'), ('kind', 'u1'), ('pad', 'i1')])  # t: seconds from start
+
+
+class Recorder:
+    """
+    Collects what the DDR listener receives: hits and frame starts, in
+    seconds from the start of playback, calibration offsets applied (so a
+    replay runs with none). Passed to InputListener.play().
+    """
+    def __init__(self):
+        self.events = []
+        self.latencies = []     # seconds from a replayed hit being sent to judged
+
+    def record_hit(self, t, pad_index, sent=None):
+        self.events.append((t, HIT, pad_index))
+        if sent is not None:
+            self.latencies.append(time.perf_counter() - sent)
+
+    def record_frame(self, t):
+        self.events.append((t, FRAME, -1))
+
+    def save(self, path, playtrack, result):
+        listener = playtrack.input_listener
+        meta = {'version': VERSION, 'midi': os.path.basename(playtrack.midi_path),
+                'chart': playtrack.chart_params, 'rate': listener.rate, 'result': result,
+                'offsets': listener.offsets.as_dict()}  # already applied to the times
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, events=np.array(self.events, dtype=EVENT),
+                                meta=np.array(json.dumps(meta)))
+        return path
+
+def load(path):
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        if meta['version'] != VERSION:
+            raise ValueError(f'{path}: recording version {meta["version"]}, expected {VERSION}')
+        return data['events'], meta
+
+def recording_path(song_name):
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    return os.path.join(REPLAY_DIR, time.strftime(f'{song_name}-%Y%m%d-%H%M%S.npz'))
+
+
+class VirtualClock(scheduler.FrameClock):
+    """
+    FrameClock on simulated time: wait_until() jumps straight to the
+    deadline, first handing the listener every recorded hit due by then,
+    so frames and hits reach it in the same order as they did live.
+    """
+    def __init__(self, hits, input_q):
+        self.now = 0.0
+        super().__init__(clock=lambda: self.now)
+        self.hits = hits
+        self.input_q = input_q
+        self._next = 0
+
+    def wait_until(self, t):
+        deadline = self.t0 + t
+        while self._next < len(self.hits) and self.t0 + self.hits[self._next]['t'] <= deadline:
+            hit = self.hits[self._next]
+            self.input_q.put({'type': 'hit', 'pad_index': int(hit['pad']),
+                              'time': self.t0 + float(hit['t']), 'sent': time.perf_counter()})
+            self._next += 1
+        self.now = max(self.now, deadline)
+        self.lateness.append(0.0)
+
+
+class OfflineSampler:
+    """
+    Takes the Sampler calls a DDR session (or a headless Painter) makes,
+    and plays nothing; hits still reach input_q, as from a Sampler.
+    """
+    def __init__(self):
+        self.input_q = queue.Queue()
+    def load_samples(self, sample_dir):
+        loading = concurrent.futures.Future()
+        loading.set_result({ })
+        return loading
+    def load_backing_track(self, fname):
+        pass
+    def remap(self, notes):
+        pass
+    def play_note(self, pad_index):
+        self.input_q.put({'type': 'hit', 'pad_index': pad_index, 'time': time.perf_counter()})
+    def play_midi_note(self, note):
+        pass
+    def play_backing_track(self):
+        pass
+    def stop_backing_track(self):
+        pass
+
+class OfflinePainter:
+    """
+    Stands in for a Painter: frames still go through a FrameDiff, as they
+    would on the way to the device, and are counted.
+    """
+    def __init__(self):
+        from . import launchpad     # not at the top: launchpad imports this module
+        self.padmap = launchpad.PADMAP
+        self.sampler = OfflineSampler()
+        self.frame_diff = sysex.FrameDiff(self.padmap)
+        self.frames_sent = 0
+        self.msgs_sent = 0
+
+    def send_frame(self, colors, data=None):
+        self.msgs_sent += len(self.frame_diff.encode(colors, sysex.MODE_PALETTE, full=data))
+        self.frames_sent += 1
+
+
+def replay(path):
+    """
+    Replay a recording; returns a report dict. score_diff maps each result
+    field that changed to (recorded, replayed).
+    """
+    events, meta = load(path)
+    painter = OfflinePainter()
+    playtrack = ddr.PlayTrack(meta['midi'], painter, **meta['chart'])
+    hits = events[events['kind'] == HIT]
+    clock = VirtualClock(hits, playtrack._input_q)
+    recorder = Recorder()
+    t0 = time.perf_counter()
+    result = playtrack.play(rate=meta['rate'], clock=clock, recorder=recorder)
+    wall = time.perf_counter() - t0
+    ms = [x*1000 for x in recorder.latencies]
+    return {'frames': painter.frames_sent, 'msgs': painter.msgs_sent,
+            'fps': painter.frames_sent / wall, 'speedup': clock.now / wall,
+            'hits': len(hits), 'latency_p50_ms': percentile(ms, 50),
+            'latency_p99_ms': percentile(ms, 99),
+            'score_diff': {k: (v, result[k]) for k, v in meta['result'].items()
+                            if result.get(k) != v},
+            'result': result}
+
+def main(paths):
+    failed = False
+    for path in paths:
+        report = replay(path)
+        print(f"{os.path.basename(path)}: {report['frames']} frames at {report['fps']:.0f} fps "
+              f"({report['speedup']:.0f}x real time), {report['hits']} hits judged in "
+              f"p50={report['latency_p50_ms']:.3f}ms p99={report['latency_p99_ms']:.3f}ms")
+        for k, (recorded, replayed) in report['score_diff'].items():
+            print(f'    {k}: recorded {recorded}, replayed {replayed}')
+        failed |= bool(report['score_diff'])
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,168 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import pygame
+
+
+class SampleCache:
+    """
+    Decoded sample packs (note => pygame Sound), by pack directory name.
+
+    Packs decode file-by-file on a thread pool, a pack that is loaded (or
+    loading) is never decoded twice, and the least recently played packs
+    are evicted once the decoded PCM goes over the memory budget.
+
+    With a pcm_cache directory, each decoded pack is also written out as
+    raw mixer-format PCM (.npy, memory-mapped on read), so a warm start
+    builds its Sounds straight from that buffer without decoding any WAVs.
+    Cache files are named after a hash of the pack's file listing (names
+    and mtimes), so adding, removing or touching a sample invalidates them.
+
+    on_evict(name, pack) is called (with the cache locked) for each pack
+    that is evicted, so whatever else holds its samples can drop them too.
+    """
+    MEMORY_BUDGET = 256 * 2**20  # bytes of decoded PCM
+
+    def __init__(self, root, budget=MEMORY_BUDGET, workers=4, pcm_cache=None, on_evict=None):
+        self.root = root
+        self.budget = budget
+        self.pcm_cache = pcm_cache
+        self.on_evict = on_evict
+        self.packs = OrderedDict()  # least recently used first
+        self.sizes = { }
+        self._loading = { }         # name -> Future
+        self._lock = threading.Lock()
+        self._packs = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sample-pack')
+        self._decoder = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='sample-decode')
+
+    def __contains__(self, name):
+        return name in self.packs
+
+    def get(self, name):
+        """
+        The decoded pack, or None if it isn't loaded (yet).
+        """
+        with self._lock:
+            pack = self.packs.get(name)
+            if pack is not None:
+                self.packs.move_to_end(name)
+            return pack
+
+    def load(self, name):
+        """
+        Returns a Future for the pack, starting the decode if needed.
+        """
+        with self._lock:
+            if name in self.packs:
+                self.packs.move_to_end(name)
+                done = Future()
+                done.set_result(self.packs[name])
+                return done
+            if name not in self._loading:
+                self._loading[name] = self._packs.submit(self._load_pack, name)
+            return self._loading[name]
+
+    def load_sound(self, path):
+        return self._decoder.submit(pygame.mixer.Sound, path)
+
+    def _load_pack(self, name):
+        try:
+            pack, size = self._read_pcm_cache(name) or self._decode_pack(name)
+            with self._lock:
+                self.packs[name] = pack
+                self.sizes[name] = size
+                self._evict()
+            return pack
+        finally:
+            with self._lock:
+                del self._loading[name]
+
+    def _evict(self):
+        while sum(self.sizes.values()) > self.budget and len(self.packs) > 1:
+            name, pack = self.packs.popitem(last=False)
+            del self.sizes[name]
+            if self.on_evict:
+                self.on_evict(name, pack)
+
+    def _sample_paths(self, name):
+        paths = { }
+        for entry in os.scandir(os.path.join(self.root, name)):
+            note, ext = os.path.splitext(entry.name)
+            if ext == '.wav' and note.isdigit():    # <midi note>.wav
+                paths[int(note)] = entry.path
+        return paths
+
+    def _decode_pack(self, name):
+        paths = self._sample_paths(name)
+        decoding = {note: self._decoder.submit(pygame.mixer.Sound, path)
+                    for note, path in paths.items()}
+        pack = {note: sound.result() for note, sound in decoding.items()}
+        if self.pcm_cache:
+            size = self._write_pcm_cache(name, pack)
+        else:
+            size = sum(sound_size(sound) for sound in pack.values())
+        return pack, size
+
+    ###------------ persisted PCM ------------###
+    def _pcm_prefix(self, name):
+        freq, fmt, channels = pygame.mixer.get_init()
+        return f'{name}-{freq}-{fmt}-{channels}-'
+
+    def _pcm_paths(self, name):
+        listing = hashlib.sha1()
+        for path in sorted(self._sample_paths(name).values()):
+            listing.update(f'{os.path.basename(path)}:{os.stat(path).st_mtime_ns};'.encode())
+        stem = os.path.join(self.pcm_cache, self._pcm_prefix(name) + listing.hexdigest()[:16])
+        return stem + '.pcm.npy', stem + '.index.npy'
+
+    def _read_pcm_cache(self, name):
+        if not self.pcm_cache:
+            return None
+        pcm_path, index_path = self._pcm_paths(name)
+        if not os.path.exists(index_path):
+            return None     # never cached, or the pack changed on disk since
+        pcm = np.load(pcm_path, mmap_mode='r')
+        index = np.load(index_path)
+        pack = {int(note): pygame.mixer.Sound(buffer=pcm[start:stop])
+                for note, start, stop in index}
+        return pack, len(pcm)
+
+    def _write_pcm_cache(self, name, pack):
+        os.makedirs(self.pcm_cache, exist_ok=True)
+        pcm_path, index_path = self._pcm_paths(name)
+        raw = {note: sound.get_raw() for note, sound in pack.items()}
+        index = np.zeros((len(raw), 3), dtype=np.int64)
+        offset = 0
+        for i, (note, data) in enumerate(raw.items()):
+            index[i] = note, offset, offset + len(data)
+            offset += len(data)
+        pcm = np.frombuffer(b''.join(raw.values()), dtype=np.uint8)
+        # write to temp files and rename, the index last: it marks the cache valid
+        for path, array in ((pcm_path, pcm), (index_path, index)):
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        self._remove_stale_pcm(name, keep=(pcm_path, index_path))
+        return offset
+
+    def _remove_stale_pcm(self, name, keep):
+        prefix = self._pcm_prefix(name)
+        keep = [os.path.basename(path) for path in keep]
+        for entry in os.scandir(self.pcm_cache):
+            if entry.name.startswith(prefix) and entry.name not in keep:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+    ###------------ end persisted PCM ------------###
+
+def sound_size(sound):
+    """
+    Bytes of PCM held by a Sound, without copying it out.
+    """
+    freq, fmt, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * freq) * channels * abs(fmt) // 8
@@ -0,0 +1,128 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(p/100 * (len(values) - 1))))
+    return values[k]
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+class FrameClock:
+    """
+    Paces playback against absolute deadlines on a monotonic clock.
+
+    wait_until() sleeps until spin_margin before the deadline and busy-waits
+    the rest, so it wakes within microseconds of it instead of with
+    time.sleep's overshoot. The busy-wait doesn't yield: every sleep(0) is a
+    chance to lose the CPU for a whole time slice. With a single CPU
+    spin_margin is 0, since spinning there only competes with the threads
+    it is waiting on and the OS preempts a spinner sooner than a sleeper.
+    Deadlines are measured from start(), never from the previous wake-up,
+    so lateness never builds up over a song. Every wake-up's lateness is
+    recorded for stats().
+    """
+    SPIN_MARGIN = 0.001
+
+    def __init__(self, clock=time.perf_counter, sleep=time.sleep, spin_margin=None):
+        self.clock = clock
+        self.sleep = sleep
+        if spin_margin is None:
+            spin_margin = self.SPIN_MARGIN if available_cpus() > 1 else 0.0
+        self.spin_margin = spin_margin
+        self.lateness = []
+        self.t0 = None
+
+    def start(self):
+        self.t0 = self.clock()
+        self.lateness = []
+        return self.t0
+
+    def elapsed(self):
+        return self.clock() - self.t0
+
+    def wait_until(self, t):
+        """
+        Block until t seconds after start().
+        """
+        deadline = self.t0 + t
+        remaining = deadline - self.clock()
+        if remaining > self.spin_margin:
+            self.sleep(remaining - self.spin_margin)
+        now = self.clock()
+        while now < deadline:
+            now = self.clock()
+        self.lateness.append(now - deadline)
+
+    def stats(self):
+        ms = [x*1000 for x in self.lateness]
+        return {'frames': len(ms),
+                'mean_ms': sum(ms)/len(ms) if ms else 0.0,
+                'p50_ms': percentile(ms, 50),
+                'p99_ms': percentile(ms, 99),
+                'max_ms': max(ms, default=0.0)}
+
+class TimerHeap:
+    """
+    One worker thread running callbacks at absolute clock times, kept in
+    a heap, instead of a threading.Timer (and a new thread) per call.
+    """
+    SPIN_MARGIN = 0.001
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()   # FIFO for equal times
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def call_at(self, when, func, *args):
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._seq), func, args))
+            self._cond.notify()
+
+    def call_later(self, delay, func, *args):
+        self.call_at(self.clock() + delay, func, *args)
+
+    def clear(self):
+        with self._cond:
+            self._heap.clear()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._heap:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                when = self._heap[0][0]
+                remaining = when - self.clock()
+                if remaining > self.SPIN_MARGIN:
+                    # wake early (or on a new, sooner entry) and re-check
+                    self._cond.wait(remaining - self.SPIN_MARGIN)
+                    continue
+                due = remaining <= 0
+                if due:
+                    _, _, func, args = heapq.heappop(self._heap)
+            if due:
+                func(*args)
+            else:
+                time.sleep(0)   # spin out the last stretch
@@ -0,0 +1,142 @@
+import bisect
+import numpy as np
+
+# (grade, seconds either side of the onset), tightest first
+JUDGE_WINDOWS = (('perfect', 0.033), ('great', 0.083), ('good', 0.133))
+POINTS = {'perfect': 3, 'great': 2, 'good': 1, 'miss': 0}
+STRIKE_ROW = 56     # first pad index of the bottom row
+
+
+class Chart:
+    """
+    Expected note onsets, per strike-row column, as sorted lists of seconds
+    from the start of playback, plus the midi note played at each onset.
+    """
+    def __init__(self, onsets, notes):
+        self.onsets = onsets    # column => [seconds, ...]
+        self.notes = notes      # column => [midi note, ...]
+
+    def __len__(self):
+        return sum(len(onsets) for onsets in self.onsets.values())
+
+    @classmethod
+    def from_playtrack(cls, playtrack, rate=1):
+        """
+        A note's onset is the start of the frame that has it in the strike row.
+        """
+        starts = playtrack.frame_times[:playtrack.n_frames] / rate
+        strike = playtrack.frame_notes[:, 7]
+        onsets, notes = { }, { }
+        for col in range(8):
+            frames = np.flatnonzero(strike[:, col] != playtrack.NO_NOTE)
+            onsets[col] = starts[frames].tolist()
+            notes[col] = strike[frames, col].tolist()
+        return cls(onsets, notes)
+
+
+class Scorer:
+    """
+    Judges hits against a Chart: each hit takes the nearest onset in its
+    column that is still unjudged and within the widest window, found by
+    bisecting that column's onsets, and is graded by the tightest window
+    it falls in. Chord notes are separate onsets in separate columns, so
+    each is judged on its own.
+
+    Onsets left unjudged once the widest window has passed are misses,
+    counted on the next hit or expire() call; finish() settles the rest.
+    A hit with no onset in reach is a stray: it breaks the combo but
+    isn't a miss.
+    """
+    def __init__(self, chart, windows=JUDGE_WINDOWS, points=POINTS):
+        self.chart = chart
+        self.windows = sorted(windows, key=lambda w: w[1])
+        self.reach = self.windows[-1][1]
+        self.points = points
+        self.judged = {col: [None]*len(onsets) for col, onsets in chart.onsets.items()}
+        self._cursor = dict.fromkeys(chart.onsets, 0)  # all before it are judged
+        self.counts = dict.fromkeys([grade for grade, _ in self.windows] + ['miss'], 0)
+        self.score = 0
+        self.combo = 0
+        self.max_combo = 0
+        self.strays = 0
+        self.log = []   # (seconds, column, grade, offset); offset < 0 is early
+
+    def _grade(self, offset):
+        for grade, window in self.windows:
+            if abs(offset) <= window:
+                return grade
+
+    def _record(self, t, col, grade, offset):
+        self.counts[grade] += 1
+        self.score += self.points[grade]
+        self.combo = 0 if grade == 'miss' else self.combo + 1
+        self.max_combo = max(self.max_combo, self.combo)
+        self.log.append((t, col, grade, offset))
+
+    def hit(self, col, t):
+        """
+        Judge a hit on column col at t seconds. Returns (grade, note, offset),
+        or None for a stray hit.
+        """
+        self.expire(t)
+        onsets = self.chart.onsets.get(col, [])
+        judged = self.judged.get(col)
+        best = None
+        i = bisect.bisect_left(onsets, t - self.reach, self._cursor.get(col, 0))
+        stop = bisect.bisect_right(onsets, t + self.reach, i)
+        for i in range(i, stop):
+            if judged[i] is None and (best is None or abs(onsets[i] - t) < abs(onsets[best] - t)):
+                best = i
+        if best is None:
+            self.strays += 1
+            self.combo = 0
+            return None
+        offset = t - onsets[best]
+        grade = self._grade(offset)
+        judged[best] = grade
+        self._record(t, col, grade, offset)
+        return grade, self.chart.notes[col][best], offset
+
+    def hit_pad(self, pad_index, t):
+        """
+        hit() for a pad; anything off the strike row is a stray.
+        """
+        if pad_index < STRIKE_ROW:
+            self.strays += 1
+            self.combo = 0
+            return None
+        return self.hit(pad_index - STRIKE_ROW, t)
+
+    def expire(self, t):
+        """
+        Count onsets that can no longer be hit by t as misses.
+        """
+        for col, onsets in self.chart.onsets.items():
+            judged = self.judged[col]
+            i = self._cursor[col]
+            while i < len(onsets) and (judged[i] is not None or onsets[i] + self.reach < t):
+                if judged[i] is None:
+                    judged[i] = 'miss'
+                    self._record(onsets[i] + self.reach, col, 'miss', None)
+                i += 1
+            self._cursor[col] = i
+
+    def finish(self):
+        self.expire(float('inf'))
+        return self.result()
+
+    def result(self):
+        return {'score': self.score, 'max_score': len(self.chart)*max(self.points.values()),
+                'notes': len(self.chart), 'max_combo': self.max_combo,
+                'strays': self.strays, **self.counts}
+
+
+def replay(chart, hits, windows=JUDGE_WINDOWS):
+    """
+    Score a recorded hit stream: (seconds, pad_index) pairs. The same stream
+    always gives the same result.
+    """
+    scorer = Scorer(chart, windows)
+    for t, pad_index in sorted(hits):
+        scorer.hit_pad(pad_index, t)
+    return scorer.finish()
@@ -5,7 +5,9 @@ import random
 import math
 import colorsys
 import os
+import numpy as np
 from . import config
+from . import sysex
 
 ROOT_DIR = config.PROJECT_ROOT 
 SPRITESHEET = os.path.join(ROOT_DIR, 'sprites.png')
@@ -103,17 +105,18 @@ def get_sprite_pixels(im, x, y):
     im8x8 = im.resize((8,8), Image.BOX)
     return list(im8x8.getdata())
 
+_rgb_frames = { } # padmap's notes, pad 0 to 63 => FrameBuilder
+
 def build_sysex_rgb(pixels, padmap, smallbytes=True):
     """ 
     Remaps pixels to 0-127 and builds up a sysex msg for an image
     """
     assert(len(pixels) == 64)
-    bytes = [0, 32, 41, 2, 14, 3] #sysex RGB preamble
-    type = 3 # RGB
-    for i in range(64):
-        spec = [type, padmap[i], *map(rescale, pixels[i])] 
-        bytes.extend(spec)
-    return mido.Message('sysex', data=bytes) 
+    key = tuple(padmap[i] for i in range(64))     # a dict padmap iterates its keys
+    if key not in _rgb_frames:
+        _rgb_frames[key] = sysex.FrameBuilder(padmap, mode=sysex.MODE_RGB)
+    rgb = np.asarray(pixels, dtype=np.uint8)[:, :3] # drop alpha, if any
+    return _rgb_frames[key].build(sysex.RGB_TO_7BIT[rgb])
 
 def build_rgb(pixels): # incomplete WIP
     assert(len(pixels) == 64)
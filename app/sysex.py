@@ -0,0 +1,180 @@
+import threading
+import mido
+import numpy as np
+
+PREAMBLE = [0, 32, 41, 2, 14, 3]    # Launchpad Pro "set LEDs" sysex header
+MODE_PALETTE = 0
+MODE_RGB = 3
+SPEC_WIDTH = {MODE_PALETTE: 1, MODE_RGB: 3}   # color bytes per pad
+RGB_TO_7BIT = (np.arange(256)*127//255).astype(np.uint8) # 0-255 => 0-127 lookup
+RGB_FROM_7BIT = np.round(np.arange(128)*255/127).astype(np.uint8)   # and back
+# color bytes per pad for every lighting type a device takes: flashing (1)
+# and pulsing (2) are shown as their first color
+DECODE_WIDTH = {MODE_PALETTE: 1, 1: 2, 2: 1, MODE_RGB: 3}
+_PREAMBLE = np.array(PREAMBLE, dtype=np.uint8)
+
+
+def build_frames(colors, padmap):
+    """
+    Full palette frames for many pages at once: colors (..., 64) => uint8
+    (..., len) array of sysex data, one ready-to-send frame per page.
+    """
+    colors = np.asarray(colors, dtype=np.uint8)
+    if colors.max(initial=0) > 127:
+        raise ValueError('data byte must be in range 0..127')
+    frames = np.empty(colors.shape[:-1] + (len(PREAMBLE) + 64*3,), dtype=np.uint8)
+    frames[..., :len(PREAMBLE)] = PREAMBLE
+    specs = frames[..., len(PREAMBLE):].reshape(colors.shape[:-1] + (64, 3))
+    specs[..., 0] = MODE_PALETTE
+    specs[..., 1] = [padmap[i] for i in range(64)]
+    specs[..., 2] = colors
+    return frames
+
+
+def decode(data, palette):
+    """
+    What a set-LEDs sysex (data, without F0/F7) lights: (leds, rgb), the
+    note of each pad spec and its color as (n, 3) uint8 RGB, palette colors
+    looked up in palette ((128, 3) uint8). None for any other sysex.
+
+    A message in one mode (as FrameDiff sends them) is decoded as a single
+    (n, 2 + width) array; a message mixing modes is walked spec by spec.
+    """
+    buf = np.frombuffer(bytes(data), dtype=np.uint8)
+    if len(buf) < len(PREAMBLE) or (buf[:len(PREAMBLE)] != _PREAMBLE).any():
+        return None
+    specs = buf[len(PREAMBLE):]
+    if not len(specs):
+        return specs, np.empty((0, 3), dtype=np.uint8)
+    mode = specs[0]
+    stride = 2 + DECODE_WIDTH.get(mode, 1)
+    if len(specs) % stride == 0 and (specs[::stride] == mode).all():
+        specs = specs.reshape(-1, stride)
+        if mode == MODE_RGB:
+            return specs[:, 1], RGB_FROM_7BIT[specs[:, 2:5] & 127]
+        return specs[:, 1], palette[specs[:, 2] & 127]
+    leds, rgb = [], []
+    i = 0
+    while i + 2 < len(specs):
+        mode, led = specs[i], specs[i+1]
+        leds.append(led)
+        if mode == MODE_RGB:
+            rgb.append(RGB_FROM_7BIT[specs[i+2:i+5] & 127])
+        else:
+            rgb.append(palette[specs[i+2] & 127])
+        i += 2 + DECODE_WIDTH.get(mode, 1)
+    return np.array(leds, dtype=np.uint8), np.array(rgb, dtype=np.uint8).reshape(-1, 3)
+
+
+class FrameBuilder:
+    """
+    Full 64-pad sysex template. The preamble, spec type and pad notes are
+    written once into a preallocated buffer; write() only fills the color
+    slots, in place.
+    """
+    def __init__(self, padmap, mode=MODE_PALETTE):
+        self.mode = mode
+        self.width = SPEC_WIDTH[mode]
+        stride = 2 + self.width
+        self.buf = bytearray(PREAMBLE) + bytearray(64*stride)
+        self.specs = np.frombuffer(self.buf, dtype=np.uint8,
+                                    offset=len(PREAMBLE)).reshape(64, stride)
+        self.specs[:, 0] = mode
+        self.specs[:, 1] = [padmap[i] for i in range(64)]
+        self.colors = self.specs[:, 2:]    # writable view into buf
+
+    def write(self, colors):
+        """
+        colors: 64 palette indices, or 64 (r, g, b) triplets (0-127) in RGB mode
+        """
+        self.colors[:] = np.reshape(colors, (64, self.width))
+        return self.buf
+
+    def message(self):
+        """
+        mido's per-byte validation costs more than building the frame, so the
+        color slots are range-checked here in one go and mido's skipped.
+        """
+        if self.colors.max() > 127:
+            raise ValueError('data byte must be in range 0..127')
+        return mido.Message('sysex', data=self.buf, skip_checks=True)
+
+    def build(self, colors):
+        self.write(colors)
+        return self.message()
+
+
+class FrameDiff:
+    """
+    Keeps the last state sent to the device and encodes each new frame as the
+    cheapest set of messages that gets the device there: a sysex holding only
+    the changed pads, or one note_on per changed pad (palette mode only).
+
+    Cost is bytes on the wire plus MSG_OVERHEAD per message, which stands in
+    for the per-send USB packet and driver write.
+    """
+    MSG_OVERHEAD = 4
+
+    def __init__(self, padmap):
+        self.notes = np.array([padmap[i] for i in range(64)], dtype=np.uint8)
+        self.frames = {mode: FrameBuilder(padmap, mode) for mode in SPEC_WIDTH}
+        self._lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget the device state, e.g. after a mode switch or reconnect.
+        The next frame is then sent in full.
+        """
+        self.modes = np.full(64, -1, dtype=np.int16)
+        self.values = np.zeros((64, 3), dtype=np.int16)
+
+    def mark(self, pad_index, color, mode=MODE_PALETTE):
+        """
+        Record a pad that was set outside of encode() (e.g. a single note_on).
+        """
+        with self._lock:
+            self.modes[pad_index] = mode
+            self.values[pad_index] = 0
+            self.values[pad_index, :SPEC_WIDTH[mode]] = color
+
+    def encode(self, colors, mode=MODE_PALETTE, pads=None, full=None):
+        """
+        colors is always the full frame; pads, if given, limits the update
+        to those pad indices (e.g. the ones a flood fill touched). full is
+        the same frame as prebuilt sysex data (see build_frames: a uint8 row
+        or anything else bytes() takes), sent as is when every pad changed.
+        """
+        width = SPEC_WIDTH[mode]
+        new = np.zeros((64, 3), dtype=np.int16)
+        new[:, :width] = np.asarray(colors, dtype=np.int16).reshape(64, width)
+        with self._lock:
+            stale = (self.modes != mode) | (self.values != new).any(axis=1)
+            if pads is not None:
+                stale &= np.isin(np.arange(64), pads)
+            changed = np.flatnonzero(stale)
+            if len(changed) == 0:
+                return []
+            self.modes[changed] = mode
+            self.values[changed] = new[changed]
+            if mode == MODE_PALETTE and self._note_on_cost(changed) < self._sysex_cost(changed, width):
+                return [mido.Message('note_on', note=int(self.notes[i]),
+                                        velocity=int(new[i, 0])) for i in changed]
+            if len(changed) == 64:
+                if full is not None:
+                    return [mido.Message('sysex', data=bytes(full), skip_checks=True)]
+                return [self.frames[mode].build(new[:, :width])]
+            return [self._build_sysex(changed, new[:, :width], mode)]
+
+    def _sysex_cost(self, changed, width):
+        return 2 + len(PREAMBLE) + len(changed)*(2 + width) + self.MSG_OVERHEAD
+
+    def _note_on_cost(self, changed):
+        return len(changed)*(3 + self.MSG_OVERHEAD)
+
+    def _build_sysex(self, changed, values, mode):
+        specs = np.empty((len(changed), 2 + values.shape[1]), dtype=np.int16)
+        specs[:, 0] = mode
+        specs[:, 1] = self.notes[changed]
+        specs[:, 2:] = values[changed]
+        return mido.Message('sysex', data=PREAMBLE + specs.ravel().tolist())
@@ -1,5 +1,4 @@
 import sys
-import time
 import os
 import colorsys
 import math
@@ -9,42 +8,26 @@ import numpy as np
 import random
 from app import launchpad
 import mido
-import queue
 import pickle 
 #import LaunchpadSprite.config as config
 from app import config
+from app import emulator
+from app.midi_io import VirtualOutport, VirtualInport, MessageRing
 
-program_inbox = queue.Queue()
-device_inbox = queue.Queue()
-
-
-class VirtualOutport(mido.ports.BaseOutput):
-    def __init__(self, *args, outbox=None, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.outbox = outbox
-    def _send(self, msg):
-        self.outbox.put(msg) 
-
-class VirtualInport(mido.ports.BaseInput):
-    def __init__(self, *args, inbox=None, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.inbox = inbox
-    def _receive(self, block=True):
-        try:
-            return self.inbox.get(block=block) 
-        except queue.Empty:
-            return None
+program_inbox = MessageRing()                   # presses, to the painter
+device_inbox = MessageRing(coalesce=True)       # LED updates: only the latest per pad
 
 class VirtualPainter(launchpad.Painter):
     def _init_connections(self):
         self.outport = VirtualOutport(outbox=device_inbox)
         self.port = VirtualInport(inbox=program_inbox)
+        self.inports = [self.port]
 
         #cls.outport = VirtualOutport(outbox=program_inbox)
         #cls.inport = VirtualInport(inbox=device_inbox)
 
 class MultiPainter(launchpad.Painter):
-    def __del__(self):
+    def _close_ports(self):
         for port in self.outports+self.inports:
             port.close()
 
@@ -53,12 +36,8 @@ class MultiPainter(launchpad.Painter):
         for port in self.outports:
             port.send(msg)
 
-    def receive(self):
-        msg = self.inport_physical.receive(block=False)
-        if not msg:
-            msg = self.inport_virtual.receive(block=False)
-        time.sleep(0.001)
-        return msg
+    def _device_name(self):
+        return self.outport_physical.name
 
     def _init_connections(self):
         launchpad.set_programmer_mode(launchpad.open_output())
@@ -92,6 +71,7 @@ class UI:
         self.dragging = False
         self.t = 0
         self.frame = 0
+        self.exposed = True     # window needs a full redraw
     def update(self, dt):
         self.clicked = False
         self.t += dt
@@ -111,8 +91,11 @@ def load_color_palette():
 
 class Box(pygame.sprite.Sprite):
     color_palette = load_color_palette()
+    # what the pads show: decodes the painter's messages into an LED color array
+    device = emulator.Device(np.array(color_palette, dtype=np.uint8),
+                            inbox=device_inbox, outbox=program_inbox)
     current_color = GREY
-    msg = None
+    msgs = []
     REFRESH_RATE = 4 #frames
     selected_x = 0
     selected_y = 0
@@ -143,9 +126,9 @@ class Box(pygame.sprite.Sprite):
         self.rect.y = pos[1]
         self._color0 = COLOR_PAD
         self._color = self._color0
-        self.painted = False
-        self.painted_color = None
+        self.hovering = False
         self.image.fill(self.color)
+        self.dirty = True   # image changed since it was last drawn
         self.pos = pos
         self.pos0 = pos.copy()
         self.padXY = padXY
@@ -175,11 +158,7 @@ class Box(pygame.sprite.Sprite):
 
     @classmethod
     def load_page(cls, values):
-        for i in range(cls.ROWS):
-            for j in range(cls.COLS):
-                box = Box.mp[i][j]
-                box.painted = True
-                box.painted_color = values[i*cls.COLS + j]
+        cls.device.set(emulator.GRID_NOTES, np.asarray(values))
 
     @classmethod
     def build_map(cls):
@@ -194,18 +173,13 @@ class Box(pygame.sprite.Sprite):
 
     @classmethod
     def set_color(cls, note, color):
-        index = launchpad.REV_PADMAP[note]
         color = cls.color_palette[color]
-#        color = cls.color_palette[index] #TODO testing this delete...
-        row, col = divmod(index,ROWS)
-        Box.mp[row][col].painted_color = color
+        cls.device.set(note, color)
         cls.current_color = color
 
     @classmethod
     def parse_sysex(cls, msg):
-        colors = msg.data[6:][2::3]
-        colors = [cls.color_palette[i] for i in colors]
-        cls.load_page(colors)
+        cls.device.receive(msg)     # any mode, pads in any order
 
     @classmethod
     def save_map(cls):
@@ -220,8 +194,14 @@ class Box(pygame.sprite.Sprite):
         return self._color
     @color.setter
     def color(self, val):
-        self._color = val
+        val = tuple(val)
+        if val != self._color:  # only re-fill (and re-draw) what changed
+            self._color = val
+            self.redraw()
+
+    def redraw(self):
         self.image.fill(self._color)
+        self.dirty = True
 
     @classmethod
     def _init_ports(cls):
@@ -244,11 +224,8 @@ class Box(pygame.sprite.Sprite):
             box = Box.mp[u][v]
             box.color = COLOR_PAD_HOVER
     
-    def small_crosshair(self):
-        j,i = self.index
-        #Box.mp[i][j].color = Box.current_color
-        hovered_box = Box.mp[i][j]
-        hovered_box.color = tuple(min(255,int(i*1.2)) for i in hovered_box.color)
+    def small_crosshair(self, color):
+        return tuple(min(255,int(i*1.2)) for i in color)
 
     def hover(self):
         Box.hovered = self
@@ -271,8 +248,9 @@ class Box(pygame.sprite.Sprite):
         self.outport.send(msg)
 
     @classmethod
-    def receive_msg(cls):
-        cls.msg = cls.inport.receive(block=False)
+    def receive_msgs(cls):
+        """ Everything the painter sent since the last frame, in one batch. """
+        cls.msgs = cls.inport.drain()
 
     @classmethod
     def ping_device(cls):
@@ -280,22 +258,22 @@ class Box(pygame.sprite.Sprite):
         cls.outport.send(msg)
 
     def apply_color(self):
-        if self.painted:
-            self.color = self.painted_color
-        else:
-            self.color = self._color0
+        """
+        Settle on this frame's color in one go, so a box that looks the
+        same as last frame isn't touched.
+        """
+        lit = Box.device.lit[self.note]
+        color = Box.device.leds[self.note].tolist() if lit else self._color0
+        if Box.hovered is self:
+            color = self.small_crosshair(color)
+        self.color = color
 
     def toggle_color(self):
-        if self.painted:
-            self.color = self._color0
-            self.painted = False
-        else:
-            self.painted = True
-            #self.painted_color = COLOR_PAD_CLICKED
+        Box.device.lit[self.note] = not Box.device.lit[self.note]
 
     def update(self, dt):
-        self.apply_color()
-        if self.is_hovering():
+        self.hovering = self.is_hovering()
+        if self.hovering:
             #self.color = COLOR_PAD_HOVER
             self.hover()
             if ui.clicked:
@@ -327,7 +305,10 @@ class Box(pygame.sprite.Sprite):
         return colors
 
     def draw(self, screen):
-        screen.blit(self.image, self.pos)
+        screen.fill(COLOR_BG, self.rect)
+        screen.blit(self.image, self.rect)
+        self.dirty = False
+        return self.rect
 
 class CCBox(Box):
     ACTIONS = { 101: 'scroll_text', 102: 'save', 103: 'clear', 104: 'palette',
@@ -393,8 +374,15 @@ class CCBox(Box):
         self.outport.send(msg)
 
     def hover(self):
-        self.color = self.hover_color
-        self.image.blit(self.label, self.label_offset)
+        pass
+
+    def apply_color(self):
+        self.color = self.hover_color if self.hovering else self._color0
+
+    def redraw(self):
+        super().redraw()
+        if self.hovering:
+            self.image.blit(self.label, self.label_offset)
 
     def click(self):
         self.send_msg()
@@ -460,12 +448,13 @@ def update(dt):
         if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
             ui.clicked = True
             ui.dragging = False
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            ui.exposed = True
 
     #Box.animate() 
 
-    Box.receive_msg()
-    msg = Box.msg
-    if msg:
+    Box.receive_msgs()
+    for msg in Box.msgs:
         if msg.type == 'note_on':
             Box.set_color(msg.note, msg.velocity)
         elif msg.type == 'sysex':
@@ -473,24 +462,27 @@ def update(dt):
 
     for box in Box.group:
         box.update(dt)
-
-    if Box.hovered and True:
-        Box.hovered.small_crosshair()
+    for box in Box.group:   # after, so every box sees this frame's hover
+        box.apply_color()
 
     if ui.clicked:
         pass
 
-def draw(screen):
+def draw(screen, full=False):
   """
-  Draw things to the window. Called once per frame.
+  Draw things to the window. Called once per frame, only redraws the
+  boxes that changed (all of them when full) and updates just their
+  part of the window.
   """
-  screen.fill(COLOR_BG) # Fill the screen with black.
-  
-  #Box.group.draw() 
-  
-  for box in Box.group:
-      box.draw(screen)
-  pygame.display.flip()
+  if full:
+      screen.fill(COLOR_BG)
+      for box in Box.group:
+          box.draw(screen)
+      pygame.display.flip()
+      return
+  rects = [box.draw(screen) for box in Box.group if box.dirty]
+  if rects:
+      pygame.display.update(rects)
  
 class Game:
     def __init__(self, w, h):
@@ -513,9 +505,11 @@ class Game:
         self.main_loop()
 
     def main_loop(self):
+        ui.exposed = True   # (also coming back from the song menu)
         while True:
             update(self.dt) 
-            draw(self.screen)
+            draw(self.screen, full=ui.exposed)
+            ui.exposed = False
             self.dt = self.fps_clock.tick(self.fps)
 
 class Menu:
@@ -557,5 +551,6 @@ class Menu:
                 return game.main_loop()
             Menu.draw_song_menu()
             
-game = Game(W, H)
-game.run()
+if __name__ == '__main__':
+    game = Game(W, H)
+    game.run()
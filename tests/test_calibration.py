@@ -0,0 +1,47 @@
+import queue
+from app import calibration
+
+
+class FakeSampler:
+    def __init__(self):
+        self.input_q = queue.Queue()
+        self.clicks = 0
+
+    def play_midi_note(self, note):
+        self.clicks += 1
+
+class FakePainter:
+    """ Answers each device inquiry with a reply stamped 10ms after it. """
+    def __init__(self):
+        self.sampler = FakeSampler()
+        self.calibrator = None
+
+    def send_note(self, msg):
+        assert msg == calibration.IDENTITY_REQUEST
+        self.calibrator.replies.put(self.calibrator.clock.clock() + 0.010)
+
+    def send_frame(self, colors):
+        pass
+
+def calibrator(painter, tmp_path, offsets):
+    cal = calibration.Calibrator(painter, 'dev', offsets, path=str(tmp_path / 'cal.json'))
+    cal.BPM = 6000      # 10ms beats
+    painter.calibrator = cal
+    return cal
+
+def test_cancel_keeps_previous_offsets(tmp_path):
+    previous = calibration.Offsets(audio=0.05, visual=0.02, input=0.01)
+    painter = FakePainter()
+    cal = calibrator(painter, tmp_path, previous)
+    painter.sampler.play_midi_note = lambda note: cal.cancel()
+    assert cal.run() is None
+    assert previous.as_dict() == {'audio': 0.05, 'visual': 0.02, 'input': 0.01}
+    assert not (tmp_path / 'cal.json').exists()
+
+def test_finished_run_is_saved(tmp_path):
+    painter = FakePainter()
+    cal = calibrator(painter, tmp_path, calibration.Offsets(audio=0.05))
+    offsets = cal.run()
+    assert abs(offsets.input - 0.005) < 0.001
+    assert offsets.audio == 0.05    # no taps: kept
+    assert calibration.load('dev', str(tmp_path / 'cal.json')).as_dict() == offsets.as_dict()
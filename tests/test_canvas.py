@@ -0,0 +1,84 @@
+import numpy as np
+from app.canvas import Page
+
+
+def numbered(rows=8, cols=8):
+    return Page(np.arange(rows*cols) % 128, rows=rows, cols=cols)
+
+def test_edit_takes_flat_index_or_cell():
+    page = Page.blank()
+    page.edit(10, 5)
+    page.edit((2, 3), 7)
+    assert page.get_color(10) == 5
+    assert page.get_color(2*8 + 3) == 7
+    assert page.pixels[1, 2] == 5
+
+def test_fill_and_rgb_colors():
+    page = Page.blank((1, 2, 3), rgb=True)
+    assert page.is_rgb
+    assert page.get_color(63) == (1, 2, 3)
+    assert page.colors.shape == (64, 3)
+    page.fill(9)
+    assert (page.colors == 9).all()
+
+def test_colors_is_a_view_for_a_whole_page():
+    page = Page.blank()
+    page.colors[3] = 4
+    assert page.get_color(3) == 4
+
+def test_blit_clips_and_skips_transparent():
+    page = Page.blank(1)
+    stamp = Page([[0, 2], [3, 4]], rows=2, cols=2)
+    page.blit(stamp, x=7, y=-1, transparent=0)
+    assert page.get_color((0, 7)) == 3          # only stamp's (1, 0) lands
+    assert (page.diff(Page.blank(1)) == [7]).all()
+    page.blit(stamp, x=0, y=0)
+    assert page.get_color((0, 0)) == 0
+    page.blit(stamp, x=20, y=20)                # entirely off the page
+
+def test_window_writes_through():
+    sheet = Page.blank(rows=16, cols=16)
+    view = sheet.window(8, 4)
+    assert view.shape == (8, 8)
+    view.edit(0, 6)
+    assert sheet.pixels[4, 8] == 6
+    assert view.colors[0] == 6
+    view.colors[1] = 9                          # a copy: doesn't reach the sheet
+    assert sheet.pixels[4, 9] == 0
+
+def test_flood_fill_stays_in_region():
+    page = Page.blank()
+    page.pixels[:, 4] = 1                       # wall down column 4
+    painted = page.flood_fill((0, 0), 2)
+    assert len(painted) == 32
+    assert (page.pixels[:, :4] == 2).all()
+    assert (page.pixels[:, 5:] == 0).all()
+    assert len(page.flood_fill(0, 2)) == 0      # already that color
+
+def test_flood_fill_connectivity():
+    page = Page.blank()
+    page.pixels[np.eye(8, dtype=bool)] = 3      # diagonal only touches corners
+    assert len(page.copy().flood_fill(0, 4, connectivity=4)) == 1
+    assert len(page.copy().flood_fill(0, 4, connectivity=8)) == 8
+
+def test_rotate_and_flip_are_new_pages():
+    page = numbered()
+    page.quick_id = 2
+    turned = page.rotate()
+    assert turned.id != page.id and turned.quick_id == 2
+    assert turned.get_color((0, 0)) == page.get_color((0, 7))
+    assert (page.rotate(4).pixels == page.pixels).all()
+    flipped = page.flip()
+    assert flipped.get_color((0, 0)) == page.get_color((0, 7))
+    assert page.flip(horizontal=False).get_color((0, 0)) == page.get_color((7, 0))
+    flipped.edit(0, 0)
+    assert page.get_color((0, 7)) == 7
+
+def test_compose_stacks_layers():
+    bottom = Page.blank(1)
+    top = Page.blank()
+    top.edit(5, 2)
+    page = Page.compose([bottom, top])
+    assert page.get_color(5) == 2
+    assert (np.delete(page.colors, 5) == 1).all()
+    assert (bottom.colors == 1).all()
@@ -0,0 +1,14 @@
+import numpy as np
+from app import charts
+
+
+def test_unreadable_chart_is_recompiled(tmp_path):
+    midi = tmp_path / 'song.mid'
+    midi.write_bytes(b'MThd')
+    params = {'tempo': 1}
+    assert charts.load(midi, params, root=tmp_path) is None
+    path = charts.save(midi, params, {'notes': np.arange(4)}, root=tmp_path)
+    assert (charts.load(midi, params, root=tmp_path)['notes'] == np.arange(4)).all()
+    with open(path, 'r+b') as f:    # keep the zip magic, lose the rest
+        f.truncate(40)
+    assert charts.load(midi, params, root=tmp_path) is None
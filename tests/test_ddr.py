@@ -0,0 +1,77 @@
+import time
+import concurrent.futures
+import numpy as np
+from app import ddr, emulator, launchpad, replay
+
+
+def offline_playtrack(name='ddr_test'):
+    song = launchpad.Song.get_metadata(name)
+    return ddr.PlayTrack(name + '.mid', replay.OfflinePainter(), bpm=song.bpm,
+                         time_signature=song.time_signature,
+                         start_tick=song.start_tick, seed=0)
+
+def no_hits(playtrack):
+    return replay.VirtualClock(np.array([], dtype=replay.EVENT), playtrack._input_q)
+
+def test_stop_before_play_cancels_the_game():
+    playtrack = offline_playtrack()
+    playtrack.stop_listening()
+    assert playtrack.play(clock=no_hits(playtrack)) is None
+
+def test_finished_track_plays_again():
+    playtrack = offline_playtrack()
+    first = playtrack.play(clock=no_hits(playtrack))
+    second = playtrack.play(clock=no_hits(playtrack))
+    assert first is not None and first == second
+
+
+class PendingSampler(replay.OfflineSampler):
+    """ load_samples() hands back a future the test resolves """
+    def __init__(self):
+        super().__init__()
+        self.loading = concurrent.futures.Future()
+    def load_samples(self, sample_dir):
+        return self.loading
+
+class PendingPainter(emulator.HeadlessPainter):
+    def _init_sampler(self):
+        return PendingSampler()
+
+def wait_for(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def press_ddr(painter):
+    painter.emulator.press_cc(launchpad.State.CTRL['ddr'])
+
+def in_state(painter, state):
+    return lambda: isinstance(painter.state, state)
+
+def test_stop_while_samples_load():
+    painter = PendingPainter()
+    try:
+        press_ddr(painter)
+        assert wait_for(in_state(painter, launchpad.State_DDR))
+        press_ddr(painter)      # stop, before the pack has loaded
+        assert wait_for(in_state(painter, launchpad.State_Canvas))
+        painter.sampler.loading.set_result({ })
+        time.sleep(0.2)
+        assert painter._listener.is_alive()
+        assert isinstance(painter.state, launchpad.State_Canvas)
+    finally:
+        painter.stop()
+        painter.emulator.stop()
+
+def test_failed_sample_load_returns_to_canvas():
+    painter = PendingPainter()
+    try:
+        painter.sampler.loading.set_exception(OSError('bad pack'))
+        press_ddr(painter)
+        assert wait_for(lambda: hasattr(painter, 'play_track'))
+        assert wait_for(in_state(painter, launchpad.State_Canvas))
+        assert painter._listener.is_alive()
+    finally:
+        painter.stop()
+        painter.emulator.stop()
@@ -0,0 +1,52 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, timeout=30):
+    env = dict(os.environ, PYTHONPATH=ROOT, SDL_AUDIODRIVER='dummy')
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=timeout)
+
+def test_headless_painter_exits_cleanly():
+    # a Painter used to close its ports from __del__ at interpreter exit,
+    # waiting forever on a lock a frozen reader thread held
+    proc = run_python(
+        'from app import emulator\n'
+        'painter = emulator.HeadlessPainter()\n'
+        'painter.stop()\n'
+        'painter.emulator.stop()\n')
+    assert proc.returncode == 0, proc.stderr
+
+def test_headless_painter_paints():
+    proc = run_python(
+        'from app import emulator\n'
+        'painter = emulator.HeadlessPainter()\n'
+        'painter.animator.cancel()\n'
+        'emulator.drive(painter, 64)\n'
+        'lit = (painter.emulator.grid != painter.emulator.palette[0]).any(axis=2)\n'
+        'painter.stop()\n'
+        'painter.emulator.stop()\n'
+        'assert lit.all(), lit\n')
+    assert proc.returncode == 0, proc.stderr
+
+def test_button_press_stops_marquee_and_shows_new_page():
+    proc = run_python(
+        'import time\n'
+        'import numpy as np\n'
+        'from app import emulator, launchpad\n'
+        'painter = emulator.HeadlessPainter()\n'
+        'painter.scroll_text("HELLO WORLD", loop=True)\n'
+        'time.sleep(0.2)\n'
+        'painter.emulator.press_cc(launchpad.State.CTRL["palette"])\n'
+        'time.sleep(0.3)\n'
+        'device = painter.emulator\n'
+        'palette = device.palette[np.array(painter.palettes[0].colors)].reshape(8, 8, 3)\n'
+        'shown = (device.grid == palette).all()\n'
+        'busy = painter.animator.busy()\n'
+        'painter.stop()\n'
+        'device.stop()\n'
+        'assert shown and not busy, (shown, busy)\n')
+    assert proc.returncode == 0, proc.stderr
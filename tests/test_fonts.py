@@ -0,0 +1,17 @@
+import pytest
+from app.fonts import Marquee
+
+
+@pytest.mark.parametrize('text', ['', 'I', '.'])
+def test_text_narrower_than_window_scrolls_nothing(text):
+    marquee = Marquee(text)
+    assert len(marquee) == 0
+    assert list(marquee.frames()) == []
+    assert list(marquee.frames(loop=True)) == []
+
+def test_frames_slide_one_column_at_a_time():
+    marquee = Marquee('Welcome!')
+    frames = [frame.copy() for frame in marquee.frames()]
+    assert len(frames) == len(marquee) > 0
+    assert all(frame.shape == (8, 8) for frame in frames)
+    assert (frames[1][:, :-1] == frames[0][:, 1:]).all()
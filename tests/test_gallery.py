@@ -0,0 +1,39 @@
+import pickle
+import numpy as np
+from app.canvas import Page
+from app.gallery import Gallery
+
+
+def legacy_gallery(tmp_path, ids):
+    pages = { }
+    for i, page_id in enumerate(ids):
+        page = Page([i + 1]*64)
+        page.id = page_id
+        pages[page_id] = page
+    path = tmp_path / 'gallery_items.pickle'
+    with open(path, 'wb') as f:
+        pickle.dump(pages, f)
+    return pages, str(path)
+
+def test_migrated_pages_readable_on_first_open(tmp_path):
+    ids = [19, 29, 39, 49, 59, 69, 79, 89]
+    pages, legacy_path = legacy_gallery(tmp_path, ids)
+    gallery = Gallery(path=str(tmp_path / 'gallery.sqlite3'))
+    gallery.LEGACY_FILEPATH = legacy_path
+    assert ids[0] in gallery     # the very first read opens and migrates
+    for page_id in ids:
+        assert np.array_equal(gallery.load(page_id).pixels, pages[page_id].pixels)
+    assert 99 not in gallery
+    gallery.close()
+
+def test_saves_survive_reopen(tmp_path):
+    path = str(tmp_path / 'gallery.sqlite3')
+    gallery = Gallery(path=path)
+    gallery.LEGACY_FILEPATH = str(tmp_path / 'missing.pickle')
+    page = Page([5]*64)
+    page.id = 19
+    gallery.save(page)
+    gallery.close()
+    reopened = Gallery(path=path)
+    assert (reopened.load(19).pixels == 5).all()
+    reopened.close()
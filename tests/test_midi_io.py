@@ -0,0 +1,46 @@
+import queue
+import threading
+import mido
+import pytest
+from app.midi_io import MessageRing
+
+
+def note(n, velocity=1):
+    return mido.Message('note_on', note=n, velocity=velocity)
+
+def frame(n):
+    return mido.Message('sysex', data=[n])
+
+def test_full_ring_drops_notes_not_sysex():
+    ring = MessageRing(maxsize=3)
+    for msg in (frame(1), note(1), frame(2), note(2)):
+        ring.put(msg)
+    assert ring.drain() == [frame(1), frame(2), note(2)]
+    assert ring.stats()['dropped'] == 1
+
+def test_note_is_dropped_when_only_sysex_waits():
+    ring = MessageRing(maxsize=2)
+    for msg in (frame(1), frame(2), note(1)):
+        ring.put(msg)
+    assert ring.drain() == [frame(1), frame(2)]
+    assert ring.dropped == 1
+
+def test_sysex_waits_for_room():
+    ring = MessageRing(maxsize=2)
+    ring.put(frame(1))
+    ring.put(frame(2))
+    with pytest.raises(queue.Full):
+        ring.put_nowait(frame(3))
+    with pytest.raises(queue.Full):
+        ring.put(frame(3), timeout=0.01)
+    threading.Timer(0.05, ring.get).start()
+    ring.put(frame(3), timeout=5)
+    assert ring.drain() == [frame(2), frame(3)]
+    assert ring.stats()['blocked'] == 3 and ring.dropped == 0
+
+def test_coalesce_keeps_latest_per_led_between_frames():
+    ring = MessageRing(coalesce=True)
+    for msg in (note(1, 5), note(1, 6), frame(1), note(1, 7), note(2, 1), note(1, 8)):
+        ring.put(msg)
+    assert ring.drain() == [note(1, 6), frame(1), note(1, 8), note(2, 1)]
+    assert ring.coalesced == 2
@@ -0,0 +1,60 @@
+import json
+import random
+import numpy as np
+from app import ddr, replay, scoring
+from app.launchpad import Song
+
+SONG = 'ddr_test'
+
+
+def offline_playtrack():
+    song = Song.get_metadata(SONG)
+    return ddr.PlayTrack(SONG + '.mid', replay.OfflinePainter(), bpm=song.bpm,
+                         time_signature=song.time_signature,
+                         start_tick=song.start_tick, seed=0)
+
+def player_hits(chart, seed=0):
+    """ every other note, jittered across the grades, plus a few strays """
+    rng = random.Random(seed)
+    hits = [(t + rng.uniform(-0.12, 0.12), scoring.STRIKE_ROW + col)
+            for col, onsets in chart.onsets.items() for t in onsets[::2]]
+    end = max(max(onsets, default=0) for onsets in chart.onsets.values())
+    hits += [(rng.uniform(0, end), rng.randrange(64)) for _ in range(10)]
+    return np.array([(t, replay.HIT, pad) for t, pad in sorted(hits)], dtype=replay.EVENT)
+
+def record(tmp_path):
+    playtrack = offline_playtrack()
+    hits = player_hits(scoring.Chart.from_playtrack(playtrack))
+    recorder = replay.Recorder()
+    result = playtrack.play(clock=replay.VirtualClock(hits, playtrack._input_q),
+                            recorder=recorder)
+    path = recorder.save(str(tmp_path / 'game.npz'), playtrack, result)
+    return path, hits, result
+
+def test_recording_round_trips(tmp_path):
+    path, hits, result = record(tmp_path)
+    events, meta = replay.load(path)
+    recorded = events[events['kind'] == replay.HIT]
+    assert np.array_equal(recorded['pad'], hits['pad'])
+    assert np.allclose(recorded['t'], hits['t'])
+    assert meta['result'] == result
+    assert meta['midi'] == SONG + '.mid'
+
+def test_replay_scores_identically(tmp_path):
+    path, _, result = record(tmp_path)
+    assert 0 < result['perfect'] < result['notes'] and result['miss'] > 0
+    first, second = replay.replay(path), replay.replay(path)
+    assert first['score_diff'] == { } and second['score_diff'] == { }
+    assert first['result'] == second['result'] == result
+    assert first['frames'] == second['frames']
+
+def test_replay_reports_a_changed_score(tmp_path):
+    path, _, result = record(tmp_path)
+    events, meta = replay.load(path)
+    hits = events['kind'] == replay.HIT
+    events['t'][hits] += 0.5    # every hit far off its note
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, events=events, meta=np.array(json.dumps(meta)))
+    report = replay.replay(path)
+    assert 'score' in report['score_diff']
+    assert report['score_diff']['score'][0] == result['score']
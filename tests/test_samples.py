@@ -0,0 +1,67 @@
+import os
+import wave
+import numpy as np
+import pygame
+import pytest
+from app import mixer
+from app.samples import SampleCache
+
+
+def fake_cache(budget, evicted):
+    cache = SampleCache('unused', budget=budget,
+                        on_evict=lambda name, pack: evicted.append((name, sorted(pack))))
+    cache._decode_pack = lambda name: ({60: name, 62: name}, 8)
+    return cache
+
+def test_evicted_packs_are_reported():
+    evicted = []
+    cache = fake_cache(20, evicted)
+    cache.load('a').result()
+    cache.load('b').result()
+    cache.get('a')                  # b is now the least recently played
+    cache.load('c').result()
+    assert evicted == [('b', [60, 62])]
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+
+def test_mixer_drops_unloaded_samples():
+    engine = mixer.Mixer(block_size=4, voices=2)
+    pcm = np.ones((8, 2), dtype=np.float32)
+    engine.load(('a', 60), pcm)
+    engine.load(('b', 60), pcm)
+    engine.note_on(('a', 60))
+    engine.unload([('a', 60), ('a', 62)])
+    assert list(engine.samples) == [('b', 60)]
+    assert engine.render_block().any()  # the playing voice still finishes
+    engine.note_on(('a', 60))
+    assert engine.notes_played == 1
+
+@pytest.fixture
+def audio(monkeypatch):
+    monkeypatch.setenv('SDL_AUDIODRIVER', 'dummy')
+    pygame.mixer.init(44100, -16, 2)
+    yield
+    pygame.mixer.quit()
+
+def write_wav(path, frames=64):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(b'\x01\x00'*2*frames)
+
+def cached_notes(root, cache_dir):
+    cache = SampleCache(str(root), pcm_cache=str(cache_dir))
+    pack = cache.load('pack').result()
+    return sorted(pack), len(os.listdir(cache_dir))
+
+def test_pcm_cache_follows_the_file_listing(tmp_path, audio):
+    pack_dir = tmp_path / 'samples' / 'pack'
+    pack_dir.mkdir(parents=True)
+    write_wav(pack_dir / '60.wav')
+    write_wav(pack_dir / '62.wav')
+    cache_dir = tmp_path / 'pcm'
+    assert cached_notes(pack_dir.parent, cache_dir) == ([60, 62], 2)
+    write_wav(pack_dir / '64.wav')
+    assert cached_notes(pack_dir.parent, cache_dir) == ([60, 62, 64], 2)
+    os.remove(pack_dir / '60.wav')
+    assert cached_notes(pack_dir.parent, cache_dir) == ([62, 64], 2)
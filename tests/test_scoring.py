@@ -0,0 +1,123 @@
+import types
+import numpy as np
+import pytest
+from app import scoring
+from app.scoring import Chart, Scorer, JUDGE_WINDOWS, STRIKE_ROW
+
+EPS = 1e-6
+
+
+def chart(onsets, note=60):
+    return Chart(onsets, {col: [note]*len(ts) for col, ts in onsets.items()})
+
+def grade_at(offset, onset=1.0):
+    scorer = Scorer(chart({0: [onset]}))
+    hit = scorer.hit(0, onset + offset)
+    return None if hit is None else hit[0]
+
+@pytest.mark.parametrize('grade, window', JUDGE_WINDOWS)
+@pytest.mark.parametrize('side', [1, -1])   # late, early
+def test_window_boundaries(grade, window, side):
+    assert grade_at(side*(window - EPS)) == grade
+    wider = [g for g, w in JUDGE_WINDOWS if w > window]
+    assert grade_at(side*(window + EPS)) == (wider[0] if wider else None)
+
+def test_outside_widest_window_is_a_stray_then_a_miss():
+    reach = JUDGE_WINDOWS[-1][1]
+    scorer = Scorer(chart({0: [1.0]}))
+    assert scorer.hit(0, 1.0 - reach - EPS) is None
+    assert scorer.strays == 1
+    result = scorer.finish()
+    assert result['miss'] == 1 and result['score'] == 0
+
+def test_hit_returns_note_and_offset():
+    scorer = Scorer(Chart({0: [1.0]}, {0: [64]}))
+    grade, note, offset = scorer.hit(0, 0.99)
+    assert (grade, note) == ('perfect', 64)
+    assert offset == pytest.approx(-0.01)
+
+def test_chord_notes_are_judged_separately():
+    scorer = Scorer(chart({0: [1.0], 3: [1.0], 7: [1.0]}))
+    assert scorer.hit(0, 1.0)[0] == 'perfect'
+    assert scorer.hit(3, 1.05)[0] == 'great'
+    result = scorer.finish()
+    assert (result['perfect'], result['great'], result['miss']) == (1, 1, 1)
+    assert result['strays'] == 0
+
+def test_fast_passage_takes_nearest_unjudged_onset():
+    # onsets closer together than the widest window
+    scorer = Scorer(chart({0: [1.0, 1.05, 1.1]}))
+    assert scorer.hit(0, 1.049)[2] == pytest.approx(-0.001)    # the middle one
+    assert scorer.hit(0, 1.049)[2] == pytest.approx(0.049)     # then 1.0, nearer than 1.1
+    assert scorer.hit(0, 1.2)[2] == pytest.approx(0.1)         # 1.1, the one left
+    assert scorer.judged[0] == ['great', 'perfect', 'good']
+    assert scorer.finish()['miss'] == 0
+
+def test_one_hit_per_onset():
+    scorer = Scorer(chart({0: [1.0]}))
+    assert scorer.hit(0, 1.0) is not None
+    assert scorer.hit(0, 1.0) is None
+    assert scorer.strays == 1
+
+def test_strays_break_the_combo():
+    scorer = Scorer(chart({0: [1.0, 2.0, 3.0]}))
+    scorer.hit(0, 1.0)
+    scorer.hit(0, 2.0)
+    assert scorer.combo == 2
+    assert scorer.hit(5, 2.5) is None       # no onsets in that column
+    assert scorer.hit_pad(STRIKE_ROW - 1, 2.6) is None     # off the strike row
+    assert (scorer.strays, scorer.combo) == (2, 0)
+    scorer.hit(0, 3.0)
+    result = scorer.finish()
+    assert (result['max_combo'], result['strays'], result['miss']) == (2, 2, 0)
+
+def test_hit_pad_maps_strike_row_to_columns():
+    scorer = Scorer(chart({2: [1.0]}))
+    assert scorer.hit_pad(STRIKE_ROW + 2, 1.0)[0] == 'perfect'
+
+def test_expire_counts_misses_once_the_window_has_passed():
+    reach = JUDGE_WINDOWS[-1][1]
+    scorer = Scorer(chart({0: [1.0, 2.0], 1: [1.5]}))
+    scorer.expire(1.0 + reach - EPS)
+    assert scorer.counts['miss'] == 0
+    scorer.expire(1.0 + reach + EPS)
+    assert scorer.counts['miss'] == 1
+    scorer.expire(1.5 + reach + EPS)
+    scorer.expire(1.5 + reach + EPS)    # counted once
+    assert scorer.counts['miss'] == 2
+    assert scorer.combo == 0
+    assert scorer.log[0] == (1.0 + reach, 0, 'miss', None)
+    assert scorer.finish()['miss'] == 3
+
+def test_expired_onset_cannot_be_hit_late():
+    reach = JUDGE_WINDOWS[-1][1]
+    scorer = Scorer(chart({0: [1.0]}))
+    scorer.expire(1.0 + reach + EPS)
+    assert scorer.hit(0, 1.0 + reach - EPS) is None
+
+def test_result_totals():
+    scorer = Scorer(chart({0: [1.0, 2.0, 3.0]}))
+    scorer.hit(0, 1.0)
+    scorer.hit(0, 2.1)
+    result = scorer.finish()
+    assert result == {'score': 3 + 1, 'max_score': 9, 'notes': 3, 'max_combo': 2,
+                      'strays': 0, 'perfect': 1, 'great': 0, 'good': 1, 'miss': 1}
+
+def test_replay_is_order_independent():
+    c = chart({0: [1.0, 2.0], 1: [1.5]})
+    hits = [(2.01, STRIKE_ROW), (1.0, STRIKE_ROW), (1.6, STRIKE_ROW + 1)]
+    assert scoring.replay(c, hits) == scoring.replay(c, list(reversed(hits)))
+
+def test_chart_from_playtrack():
+    no_note = -1
+    frame_notes = np.full((4, 8, 8), no_note, dtype=np.int16)
+    frame_notes[1, 7, 0] = 60
+    frame_notes[1, 7, 3] = 64     # a chord
+    frame_notes[3, 7, 0] = 62
+    frame_notes[2, 6, 5] = 70     # not on the strike row yet
+    playtrack = types.SimpleNamespace(frame_times=np.array([0.0, 0.5, 1.0, 1.5, 2.0]),
+                                      n_frames=4, frame_notes=frame_notes, NO_NOTE=no_note)
+    c = Chart.from_playtrack(playtrack, rate=2)
+    assert c.onsets[0] == [0.25, 0.75] and c.notes[0] == [60, 62]
+    assert c.onsets[3] == [0.25] and c.notes[3] == [64]
+    assert c.onsets[5] == [] and len(c) == 3
@@ -0,0 +1,92 @@
+import numpy as np
+import mido
+from app import sysex
+from app.launchpad import PADMAP
+
+
+def test_full_frame_message_holds_ints():
+    colors = np.arange(64) % 128
+    full = sysex.build_frames(colors, PADMAP)
+    msg, = sysex.FrameDiff(PADMAP).encode(colors, full=full)
+    assert msg == sysex.FrameBuilder(PADMAP).build(colors)
+    assert all(type(b) is int for b in msg.bytes())
+    assert mido.Message.from_bytes(msg.bytes()) == msg
+
+def note_on_cost(n):
+    return n*(3 + sysex.FrameDiff.MSG_OVERHEAD)
+
+def sysex_cost(n, width=1):
+    return 2 + len(sysex.PREAMBLE) + n*(2 + width) + sysex.FrameDiff.MSG_OVERHEAD
+
+def synced_diff(colors):
+    diff = sysex.FrameDiff(PADMAP)
+    diff.encode(colors)
+    return diff
+
+def test_first_frame_is_sent_in_full():
+    colors = [5]*64
+    msgs = sysex.FrameDiff(PADMAP).encode(colors)
+    assert msgs == [sysex.FrameBuilder(PADMAP).build(colors)]
+
+def test_cheaper_encoding_at_the_crossover():
+    crossover = next(n for n in range(1, 64) if note_on_cost(n) >= sysex_cost(n))
+    for n, kind in ((crossover - 1, 'note_on'), (crossover, 'sysex')):
+        diff = synced_diff([0]*64)
+        colors = [0]*64
+        colors[:n] = [9]*n
+        msgs = diff.encode(colors)
+        assert {msg.type for msg in msgs} == {kind}
+        assert len(msgs) == (n if kind == 'note_on' else 1)
+
+def test_note_ons_address_the_changed_pads():
+    diff = synced_diff([0]*64)
+    colors = [0]*64
+    colors[10] = 3
+    msg, = diff.encode(colors)
+    assert (msg.type, msg.note, msg.velocity) == ('note_on', PADMAP[10], 3)
+
+def test_rgb_changes_always_go_as_sysex():
+    diff = sysex.FrameDiff(PADMAP)
+    rgb = np.zeros((64, 3), dtype=np.uint8)
+    diff.encode(rgb, sysex.MODE_RGB)
+    rgb[0] = (1, 2, 3)
+    msg, = diff.encode(rgb, sysex.MODE_RGB)
+    assert msg.type == 'sysex'
+    assert list(msg.data[len(sysex.PREAMBLE):]) == [sysex.MODE_RGB, PADMAP[0], 1, 2, 3]
+
+def test_unchanged_frame_sends_nothing():
+    diff = synced_diff([7]*64)
+    assert diff.encode([7]*64) == []
+
+def test_state_changes_only_for_what_is_sent():
+    diff = synced_diff([0]*64)
+    colors = [4]*64
+    msgs = diff.encode(colors, pads=[1, 2])     # only two pads go out
+    assert len(msgs) == 2
+    assert diff.values[1:3, 0].tolist() == [4, 4]
+    assert (diff.values[3:, 0] == 0).all()
+    # the rest are still stale, so the next frame sends them
+    msgs = diff.encode(colors)
+    assert len(msgs) == 1 and msgs[0].type == 'sysex'
+    assert len(msgs[0].data) == len(sysex.PREAMBLE) + 62*3
+
+def test_invalidate_resends_everything():
+    diff = synced_diff([7]*64)
+    diff.invalidate()
+    msgs = diff.encode([7]*64)
+    assert msgs == [sysex.FrameBuilder(PADMAP).build([7]*64)]
+
+def test_mark_records_a_pad_sent_elsewhere():
+    diff = synced_diff([0]*64)
+    diff.mark(5, 12)
+    colors = [0]*64
+    colors[5] = 12
+    assert diff.encode(colors) == []
+
+def test_full_frame_used_only_when_every_pad_changed():
+    diff = synced_diff([0]*64)
+    colors = [1]*64
+    colors[0] = 0
+    full = sysex.build_frames(colors, PADMAP)
+    msg, = diff.encode(colors, full=full)
+    assert len(msg.data) == len(sysex.PREAMBLE) + 63*3   # a partial frame, full ignored